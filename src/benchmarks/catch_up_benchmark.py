@@ -0,0 +1,146 @@
+"""
+Measures live offer fan-out latency while one subscriber catches up on a large
+backlog from the offer log (by default 1M offers), compared with no catch-up
+running, and how fast the backlog is streamed. Subscribers are served by a sink in
+a separate process.
+
+Usage:
+    python3 src/benchmarks/catch_up_benchmark.py --backlog 1000000 --live-subscribers 200
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.delivery_benchmark import raise_fd_limit, sink, subscriber_addresses
+from modules import pub_sub_handler
+from modules.offer_log import OfferLog
+from modules.pub_sub_handler import PubSub
+from utils import codec as wire_codec
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+
+def fill_log(offer_log: OfferLog, count: int, offer_size: int):
+    chunk = 5000
+    for start in range(0, count, chunk):
+        payloads = [
+            wire_codec.encode({"businessType": "Backlog", "offer": f"{i:08d}".ljust(offer_size, "x")})
+            for i in range(start, min(count, start + chunk))
+        ]
+        offer_log.append_many(payloads)
+
+
+def live_round(pub_sub: PubSub, args, future=None) -> list:
+    """
+    Publishes live offers every --interval seconds, until the catch-up finishes if
+    one is given, and returns how long each fan-out took.
+    """
+    latencies = []
+    deadline = time.monotonic() + args.live_duration
+    while True:
+        if future is not None and future.done():
+            break
+        if future is None and time.monotonic() >= deadline:
+            break
+        log, offsets = pub_sub.log_offers([{"businessType": "Live", "offer": "y" * args.offer_size}])
+        started = time.perf_counter()
+        pub_sub.deliver_to_subscribers(
+            "Live", {"businessType": "Live", "offer": "y" * args.offer_size, "offset": offsets[0], "log": log}
+        )
+        latencies.append(time.perf_counter() - started)
+        time.sleep(args.interval)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catch-up vs live fan-out benchmark")
+    parser.add_argument("--backlog", type=int, default=1000000)
+    parser.add_argument("--live-subscribers", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.02, help="Seconds between live offers")
+    parser.add_argument("--live-duration", type=float, default=5, help="Length of the baseline run")
+    parser.add_argument("--offer-size", type=int, default=100)
+    parser.add_argument("--port", type=int, default=18600)
+    parser.add_argument("--dir", default=".", help="Where to create the offer log")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    ready = multiprocessing.Event()
+    sink_process = multiprocessing.Process(target=sink, args=(args.port, ready), daemon=True)
+    sink_process.start()
+    ready.wait(5)
+
+    directory = tempfile.mkdtemp(prefix="catch_up_benchmark_", dir=args.dir)
+    pub_sub = PubSub(-1, 1, "127.0.0.1", [], "127.0.0.1", 0)
+    # Keep the per-offer delivery reports from flooding the output.
+    pub_sub_handler.print = lambda *_args, **_kwargs: None
+    pub_sub.offer_log = OfferLog(directory, fsync="never", key=pub_sub_handler.business_type_of)
+
+    started = time.perf_counter()
+    fill_log(pub_sub.offer_log, args.backlog, args.offer_size)
+    fill_seconds = time.perf_counter() - started
+
+    for address in subscriber_addresses(args.live_subscribers, args.port):
+        pub_sub_handler.subscriptions.subscribe(address, ["Live"])
+    catching_up = ("127.9.9.9", args.port)
+    pub_sub_handler.subscriptions.subscribe(catching_up, ["Backlog"])
+
+    live_round(pub_sub, args)
+    baseline = live_round(pub_sub, args)
+
+    started = time.perf_counter()
+    future = pub_sub.start_catch_up(catching_up, {"Backlog": {"since": 0}})
+    during = live_round(pub_sub, args, future)
+    job = future.result()
+    catch_up_seconds = time.perf_counter() - started
+
+    pub_sub.offer_log.close()
+    shutil.rmtree(directory)
+    sink_process.terminate()
+
+    result = {
+        "backlog": args.backlog,
+        "live_subscribers": args.live_subscribers,
+        "log_fill_seconds": round(fill_seconds, 2),
+        "catch_up_offers": job.sent,
+        "catch_up_batches": job.batches,
+        "catch_up_seconds": round(catch_up_seconds, 2),
+        "catch_up_offers_per_sec": round(job.sent / catch_up_seconds),
+        "live_fanout_ms": {
+            "baseline_p50": percentile(baseline, 50) * 1000,
+            "baseline_p99": percentile(baseline, 99) * 1000,
+            "during_catch_up_p50": percentile(during, 50) * 1000,
+            "during_catch_up_p99": percentile(during, 99) * 1000,
+            "during_catch_up_max": max(during) * 1000 if during else 0.0,
+            "offers_during_catch_up": len(during),
+        },
+    }
+    print(
+        f"Backlog of {job.sent} offers streamed in {job.batches} batches in "
+        f"{catch_up_seconds:.1f} s ({result['catch_up_offers_per_sec']} offers/s)"
+    )
+    live = result["live_fanout_ms"]
+    print(f"Live fan-out to {args.live_subscribers} subscribers (ms):")
+    print(f"  without catch-up: p50 {live['baseline_p50']:.2f}  p99 {live['baseline_p99']:.2f}")
+    print(
+        f"  during catch-up:  p50 {live['during_catch_up_p50']:.2f}  p99 {live['during_catch_up_p99']:.2f}"
+        f"  max {live['during_catch_up_max']:.2f}  ({live['offers_during_catch_up']} offers)"
+    )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Runs a whole cluster on localhost and measures end-to-end publish-to-deliver
+latency: the register, N server nodes and P publishers each run in a process of
+their own, and M subscribers are served by sinks in this process.
+
+The subscribers register with the leader like Subscriber does, each for one of
+--types business types, which the shard ring spreads over the nodes. The
+publishers are Publisher objects, which batch the offers and send them straight
+to the owners of their business types; each offer carries the time it was
+published. Offers published during --warmup are not counted.
+
+Reports the offers published and delivered a second, the share of the expected
+deliveries that arrived, p50/p99/p999 latency from publish to delivery, and the
+CPU time every component used during the measurement. The register and nodes serve
+their metrics, which the CPU time and their offer counts are read from.
+
+Usage:
+    python3 src/benchmarks/cluster_benchmark.py -n 3 -m 200 --rate 500 -o results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.delivery_benchmark import raise_fd_limit, subscriber_addresses
+from benchmarks.gossip_benchmark import percentile
+from benchmarks.startup_benchmark import register, register_listening, server_node, wait_for
+from modules.metrics import MetricsServer
+from modules.publisher import Publisher
+from utils import codec as wire_codec
+from utils import utils
+
+
+def with_metrics(target, metrics_port: int, *args):
+    sys.stdout = open(os.devnull, "w")
+    MetricsServer(metrics_port).start()
+    target(*args)
+
+
+def scrape(port: int) -> dict:
+    """
+    Returns:
+        dict: The total of every metric a process serves, over all its labels, or
+        an empty dict if it does not answer.
+    """
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            text = response.read().decode()
+    except OSError:
+        return {}
+    totals = Counter()
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            totals[sample.split("{")[0]] += float(value)
+    return totals
+
+
+class Sinks:
+    def __init__(self, port: int, window: tuple):
+        """
+        Accepts the leader's connections to every subscriber, which all listen on
+        port on their own loopback address, and records how long after it was
+        published every offer published within window arrived.
+        """
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("0.0.0.0", port))
+        self.listener.listen(4096)
+        self.listener.setblocking(False)
+        self.window = window
+        self.latencies = []
+        self.cpu_seconds = 0.0
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.listener, selectors.EVENT_READ)
+        window_start, window_end = self.window
+        cpu_start = None
+        while not self.stopped.is_set():
+            if cpu_start is None and time.monotonic() >= window_start:
+                cpu_start = time.thread_time()
+            for key, _ in selector.select(0.1):
+                if key.fileobj is self.listener:
+                    try:
+                        conn, _ = self.listener.accept()
+                    except BlockingIOError:
+                        continue
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ, utils.FrameDecoder())
+                    continue
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                except ConnectionError:
+                    data = b""
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    continue
+                now = time.monotonic()
+                for frame in key.data.feed(data):
+                    msg = wire_codec.decode(frame)
+                    offers = msg["offers"] if "offers" in msg else [msg.get("offer", "")]
+                    for offer in offers:
+                        published = float(offer.split(":", 3)[2])
+                        if window_start <= published < window_end:
+                            self.latencies.append(now - published)
+        self.cpu_seconds = time.thread_time() - (cpu_start or 0.0)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(5)
+        self.listener.close()
+
+
+def publisher(config_path: str, index: int, types: list, start_at: float, args, results):
+    sys.stdout = open(os.devnull, "w")
+    node = Publisher(False, config_path)
+    # Registers like start_service, so the leader accepts the fallback connection.
+    with socket.create_connection((node.leaderIP, node.leaderPort)) as sock:
+        registration = {"client_type": "publisher", "ip": node.pubIP, "port": node.pubPort}
+        utils.send_frame(sock, json.dumps(registration).encode())
+    node.load_shards()
+    deadline = time.monotonic() + 5
+    while node.publisher_socket is None and time.monotonic() < deadline:
+        try:
+            node.publisher_socket = socket.create_connection((node.pubIP, node.pubPort))
+        except OSError:
+            time.sleep(0.01)
+    Thread(target=node.flush_batches, daemon=True).start()
+
+    rate = args.rate / args.publishers
+    padding = "x" * args.offer_size
+    window_start = start_at + args.warmup
+    end = window_start + args.seconds
+    counted = Counter()
+    cpu_start = None
+    sent = 0
+    while True:
+        due = start_at + sent / rate
+        if due >= end:
+            break
+        time.sleep(max(0, due - time.monotonic()))
+        if due >= window_start and cpu_start is None:
+            cpu_start = time.process_time()
+        business_type = types[(sent * args.publishers + index) % len(types)]
+        node.publish(business_type, f"{index}:{sent}:{time.monotonic():.6f}:{padding}")
+        if due >= window_start:
+            counted[business_type] += 1
+        sent += 1
+    node.flush()
+    cpu_seconds = time.process_time() - (cpu_start or 0.0)
+    # Let the links send what is queued before the process exits.
+    time.sleep(args.drain)
+    results.put({"index": index, "published": sent, "counted": dict(counted), "cpu_seconds": cpu_seconds})
+    results.close()
+    results.join_thread()
+    os._exit(0)
+
+
+def run(args) -> dict:
+    context = multiprocessing.get_context("fork")
+    directory = tempfile.mkdtemp(prefix="cluster_benchmark_", dir=args.dir)
+    leader = {"ip": "127.0.0.1", "port": args.leader_port}
+    config_path = os.path.join(directory, "config.json")
+    with open(config_path, "w") as config_file:
+        register_address = {"ip": "127.0.0.1", "port": args.register_port}
+        json.dump({"register": register_address, "node": {"ip": "127.0.0.1"}, "leader": leader}, config_file)
+
+    def start(*target_args):
+        process = context.Process(target=with_metrics, args=target_args, daemon=True)
+        process.start()
+        return process
+
+    # Metrics ports: the register's, then one per node.
+    components = {"register": args.metrics_port}
+    processes = [start(register, args.metrics_port, config_path, directory)]
+    while not register_listening(args.register_port):
+        time.sleep(0.01)
+    for i in range(args.nodes):
+        components[f"node {i + 1}"] = args.metrics_port + 1 + i
+        processes.append(start(server_node, args.metrics_port + 1 + i, config_path, directory, args.leader_port))
+    if wait_for(lambda size: size == args.nodes, args.leader_port, time.time(), args.timeout) is None:
+        for process in processes:
+            process.kill()
+        shutil.rmtree(directory, ignore_errors=True)
+        raise SystemExit(f"The cluster of {args.nodes} nodes did not come up within {args.timeout} s")
+
+    types = [f"type{i}/offers" for i in range(args.types)]
+    subscribers = subscriber_addresses(args.subscribers, args.sink_port)
+    start_at = time.monotonic() + args.settle
+    window = (start_at + args.warmup, start_at + args.warmup + args.seconds)
+    sinks = Sinks(args.sink_port, window)
+    for i, (ip, port) in enumerate(subscribers):
+        registration = {
+            "client_type": "subscriber",
+            "ip": ip,
+            "port": port,
+            "interests": [types[i % len(types)]],
+            "codecs": wire_codec.PREFERRED_CODECS,
+        }
+        with socket.create_connection((leader["ip"], leader["port"])) as sock:
+            utils.send_frame(sock, json.dumps(registration).encode())
+
+    results = context.Queue()
+    publishers = []
+    for i in range(args.publishers):
+        path = os.path.join(directory, f"publisher{i}.json")
+        with open(path, "w") as config_file:
+            own_address = {"ip": "127.0.0.1", "port": args.publisher_port + i}
+            json.dump({"leader": leader, "publisher": own_address}, config_file)
+        process = context.Process(target=publisher, args=(path, i, types, start_at, args, results), daemon=True)
+        process.start()
+        publishers.append(process)
+
+    time.sleep(max(0, window[0] - time.monotonic()))
+    before = {name: scrape(port) for name, port in components.items()}
+    time.sleep(max(0, window[1] - time.monotonic()))
+    after = {name: scrape(port) for name, port in components.items()}
+    published = [results.get(timeout=args.drain + 30) for _ in publishers]
+    sinks.stop()
+
+    for process in publishers + processes:
+        process.kill()
+        process.join(1)
+    shutil.rmtree(directory, ignore_errors=True)
+
+    per_type = Counter()
+    for i in range(len(subscribers)):
+        per_type[types[i % len(types)]] += 1
+    counted = sum(sum(result["counted"].values()) for result in published)
+    expected = sum(
+        per_type[business_type] * count
+        for result in published
+        for business_type, count in result["counted"].items()
+    )
+
+    def grew(name: str, metric: str) -> float:
+        return after[name].get(metric, 0) - before[name].get(metric, 0)
+
+    cpu = {}
+    for name in components:
+        cpu[name] = {
+            "cpu_seconds": round(grew(name, "process_cpu_seconds_total"), 3),
+            "leader": bool(after[name].get("lbn_is_leader")),
+            "offers_received": grew(name, "lbn_offers_received_total"),
+            "fanouts": grew(name, "lbn_fanouts_total"),
+        }
+    for result in published:
+        cpu[f"publisher {result['index'] + 1}"] = {"cpu_seconds": round(result["cpu_seconds"], 3)}
+    cpu["subscriber sinks"] = {"cpu_seconds": round(sinks.cpu_seconds, 3)}
+
+    latencies = sinks.latencies
+    return {
+        "nodes": args.nodes,
+        "subscribers": args.subscribers,
+        "publishers": args.publishers,
+        "types": args.types,
+        "rate": args.rate,
+        "offer_size": args.offer_size,
+        "seconds": args.seconds,
+        "published_per_sec": counted / args.seconds,
+        "delivered_per_sec": len(latencies) / args.seconds,
+        "delivered_ratio": len(latencies) / expected if expected else 0.0,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "latency_p999_ms": percentile(latencies, 99.9) * 1000,
+        "latency_max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "components": cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback cluster publish-to-deliver benchmark")
+    parser.add_argument("-n", "--nodes", type=int, default=3, help="Server nodes")
+    parser.add_argument("-m", "--subscribers", type=int, default=100)
+    parser.add_argument("-p", "--publishers", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=200, help="Offers published per second, over all publishers")
+    parser.add_argument("--types", type=int, default=8, help="Business types, one per subscriber in turn")
+    parser.add_argument("--offer-size", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10, help="Length of the measurement")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of publishing not counted")
+    parser.add_argument("--settle", type=float, default=1, help="Seconds for subscriptions to reach owners")
+    parser.add_argument("--drain", type=float, default=2, help="Seconds to wait for the last deliveries")
+    parser.add_argument("--register-port", type=int, default=18900)
+    parser.add_argument("--leader-port", type=int, default=18990, help="The leader's client port")
+    parser.add_argument("--metrics-port", type=int, default=18910, help="The register's, then one per node")
+    parser.add_argument("--sink-port", type=int, default=18890)
+    parser.add_argument("--publisher-port", type=int, default=18870)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the cluster")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the nodes keep their offer logs")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    result = run(args)
+
+    print(
+        f"{args.nodes} nodes, {args.subscribers} subscribers, {args.publishers} publishers "
+        f"at {args.rate:.0f} offers/s over {args.types} business types"
+    )
+    print(
+        f"Published {result['published_per_sec']:.0f} offers/s, delivered {result['delivered_per_sec']:.0f}/s "
+        f"({result['delivered_ratio']:.1%} of expected)"
+    )
+    print(
+        f"Publish to deliver ms: p50 {result['latency_p50_ms']:.2f}  p99 {result['latency_p99_ms']:.2f}  "
+        f"p99.9 {result['latency_p999_ms']:.2f}  max {result['latency_max_ms']:.2f}"
+    )
+    print(f"{'component':<18}{'cpu s':>8}{'cpu %':>8}{'offers in':>11}{'fan-outs':>10}")
+    for name, row in result["components"].items():
+        label = name + (" (leader)" if row.get("leader") else "")
+        counts = f"{row['offers_received']:>11.0f}{row['fanouts']:>10.0f}" if "fanouts" in row else ""
+        print(f"{label:<18}{row['cpu_seconds']:>8.2f}{row['cpu_seconds'] / args.seconds:>8.1%}{counts}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
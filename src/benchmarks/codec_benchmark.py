@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of the wire codecs. For a representative message of every Type it
+reports encode and decode time (ns/op) and the encoded size, for the JSON codec,
+the binary codec and the previous json.dumps + eval decoding.
+
+Usage:
+    python3 src/benchmarks/codec_benchmark.py
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants.constants import Type
+from utils import codec as wire_codec
+
+
+def node_message(msg_type: Type) -> dict:
+    return {"type": msg_type.value, "id": 742, "port": 51234, "ip": "10.0.3.17"}
+
+
+def sample_messages() -> dict:
+    offer = {"businessType": "Restaurant", "offer": "20% off all pizzas until 9pm today"}
+    samples = {msg_type.name: node_message(msg_type) for msg_type in Type}
+    samples["SUBSCRIBE"].update({"buisnessType": "Restaurant"})
+    samples["CONNECT_TO_CLIENT"].update(
+        {
+            "client_type": "subscriber",
+            "interests": ["Restaurant", "Retail", "Grocery"],
+            "codecs": wire_codec.PREFERRED_CODECS,
+        }
+    )
+    samples["PUBLISH_DATA_TO_SUBSCRIBERS"] = dict(
+        offer, type=Type["PUBLISH_DATA_TO_SUBSCRIBERS"].value, id=742
+    )
+    samples["UPDATE_BUSINESS_TYPE"].update({"businessType": "Retail"})
+    samples["PUBLISH_OFFER"] = dict(offer, type=Type["PUBLISH_OFFER"].value)
+    samples["UPDATE_INTERESTS"].update({"interests": ["Restaurant", "Retail"]})
+    samples["PEER_LINK"].update({"codecs": wire_codec.PREFERRED_CODECS})
+    samples["PUBLISH_BATCH"] = {
+        "type": Type["PUBLISH_BATCH"].value,
+        "offers": [dict(offer, offer=f"{offer['offer']} #{i}") for i in range(50)],
+    }
+    return samples
+
+
+def ns_per_op(func, number: int) -> float:
+    runs = timeit.repeat(func, number=number, repeat=5)
+    return min(runs) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire codec micro-benchmark")
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    json_codec = wire_codec.get_codec("json")
+    binary_codec = wire_codec.get_codec("binary")
+
+    results = []
+    for name, msg in sample_messages().items():
+        # Batches are much larger, so run fewer iterations to keep the total time sane.
+        number = args.number // 50 if name == "PUBLISH_BATCH" else args.number
+        legacy = json.dumps(msg).encode("utf-8")
+        encoded_json = json_codec.encode(msg)
+        encoded_binary = binary_codec.encode(msg)
+        assert binary_codec.decode(encoded_binary) == msg
+        results.append(
+            {
+                "type": name,
+                "legacy_bytes": len(legacy),
+                "json_bytes": len(encoded_json),
+                "binary_bytes": len(encoded_binary),
+                "legacy_decode_ns": ns_per_op(lambda: eval(legacy.decode("utf-8")), number),
+                "json_encode_ns": ns_per_op(lambda: json_codec.encode(msg), number),
+                "json_decode_ns": ns_per_op(lambda: json_codec.decode(encoded_json), number),
+                "binary_encode_ns": ns_per_op(lambda: binary_codec.encode(msg), number),
+                "binary_decode_ns": ns_per_op(lambda: binary_codec.decode(encoded_binary), number),
+            }
+        )
+
+    print(
+        f"{'type':<29}{'bytes legacy/json/bin':>22}{'eval dec':>10}"
+        f"{'json enc':>10}{'json dec':>10}{'bin enc':>10}{'bin dec':>10}   (ns/op)"
+    )
+    for row in results:
+        sizes = f"{row['legacy_bytes']}/{row['json_bytes']}/{row['binary_bytes']}"
+        print(
+            f"{row['type']:<29}{sizes:>22}{row['legacy_decode_ns']:>10.0f}"
+            f"{row['json_encode_ns']:>10.0f}{row['json_decode_ns']:>10.0f}"
+            f"{row['binary_encode_ns']:>10.0f}{row['binary_decode_ns']:>10.0f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Measures offer delivery latency to healthy subscribers while some subscribers
+stall: they accept the leader's connection but never read from it. The
+DeliveryQueues give every subscriber its own queue, so the stalled subscribers
+should only delay their own offers. With --unreachable, some subscribers also
+never accept the connection, and are retried with a backoff until they are
+disconnected. Their first connects all time out at once at the start, which
+--warmup leaves out of the latencies.
+
+With --fanout, it instead queues one offer for N subscribers of which the first
+is unreachable, once with new connections and once with pooled ones, and reads
+from the offer's DeliveryReport how long the others took and when the
+unreachable one was given up on.
+
+Offers are published at --rate a second, each carrying the time it was due, and
+the healthy subscribers record how long after that they received it. Healthy
+subscribers are served by a receiver process, stalled ones by a process that
+accepts their connections with a small receive buffer and never reads.
+
+Usage:
+    python3 src/benchmarks/delivery_benchmark.py -n 100 --stalled 0 0.05
+    python3 src/benchmarks/delivery_benchmark.py -n 1000 --stalled 0 --unreachable 0.05 --warmup 5
+    python3 src/benchmarks/delivery_benchmark.py --fanout 100 1000 10000 --offer-size 200
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import selectors
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gossip_benchmark import percentile
+from modules.connection_pool import SubscriberConnectionPool
+from modules.delivery_queues import DeliveryQueues
+from utils import codec as wire_codec
+from utils import utils
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def sink(port: int, ready):
+    """
+    Accepts any number of connections on every loopback address and discards
+    whatever is written to them.
+    """
+    raise_fd_limit()
+    selector = selectors.DefaultSelector()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", port))
+    listener.listen(4096)
+    listener.setblocking(False)
+    selector.register(listener, selectors.EVENT_READ)
+    ready.set()
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is listener:
+                try:
+                    conn, _ = listener.accept()
+                except BlockingIOError:
+                    continue
+                conn.setblocking(False)
+                selector.register(conn, selectors.EVENT_READ)
+                continue
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            except ConnectionError:
+                data = b""
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+
+
+def black_hole() -> tuple:
+    """
+    Returns a listening socket whose accept queue is full, so further connects to it
+    hang until they time out, like a host that silently drops packets.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(0)
+    filler = socket.create_connection(listener.getsockname())
+    return listener, filler
+
+
+def subscriber_addresses(count: int, port: int) -> list:
+    return [("127.1.{}.{}".format(i // 250, i % 250 + 1), port) for i in range(count)]
+
+
+def listen(address: tuple, rcvbuf: int = None) -> socket.socket:
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if rcvbuf:
+        # Accepted connections inherit it, so the leader's writes back up quickly.
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    listener.bind(address)
+    listener.listen(1024)
+    listener.setblocking(False)
+    return listener
+
+
+def receiver(port: int, ready, stop, results):
+    """
+    Accepts the connections of the healthy subscribers, decodes their frames and
+    sends back how long after it was due every offer arrived.
+    """
+    raise_fd_limit()
+    selector = selectors.DefaultSelector()
+    listener = listen(("0.0.0.0", port))
+    selector.register(listener, selectors.EVENT_READ)
+    ready.set()
+    latencies = []
+    while not stop.is_set():
+        for key, _ in selector.select(0.1):
+            if key.fileobj is listener:
+                try:
+                    conn, _ = listener.accept()
+                except BlockingIOError:
+                    continue
+                conn.setblocking(False)
+                selector.register(conn, selectors.EVENT_READ, utils.FrameDecoder())
+                continue
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            except ConnectionError:
+                data = b""
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            now = time.monotonic()
+            for frame in key.data.feed(data):
+                msg = wire_codec.decode(frame)
+                if not msg.get("warmup"):
+                    latencies.append(now - msg["due"])
+    results.put(latencies)
+    results.close()
+    results.join_thread()
+    os._exit(0)
+
+
+def staller(addresses: list, ready):
+    """
+    Accepts the connections of the stalled subscribers and never reads from them.
+    """
+    raise_fd_limit()
+    selector = selectors.DefaultSelector()
+    for address in addresses:
+        selector.register(listen(address, rcvbuf=4096), selectors.EVENT_READ)
+    held = []
+    ready.set()
+    while True:
+        for key, _ in selector.select():
+            try:
+                conn, _ = key.fileobj.accept()
+            except BlockingIOError:
+                continue
+            held.append(conn)
+
+
+def run(fraction: float, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    stalled = subscriber_addresses(int(args.subscribers * fraction), args.port + 1)
+    # The stalled subscribers listen on 127.2.x.y, away from the healthy ones.
+    stalled = [("127.2" + ip[len("127.1"):], port) for ip, port in stalled]
+    # Unreachable subscribers never accept the connection, so every attempt to
+    # reach them waits for the send timeout.
+    holes = [black_hole() for _ in range(int(args.subscribers * args.unreachable))]
+    unreachable = [listener.getsockname() for listener, _ in holes]
+    healthy = subscriber_addresses(args.subscribers - len(stalled) - len(unreachable), args.port)
+
+    ready, stop, results = context.Event(), context.Event(), context.Queue()
+    receiver_process = context.Process(target=receiver, args=(args.port, ready, stop, results), daemon=True)
+    receiver_process.start()
+    ready.wait(5)
+    staller_process = None
+    if stalled:
+        ready = context.Event()
+        staller_process = context.Process(target=staller, args=(stalled, ready), daemon=True)
+        staller_process.start()
+        ready.wait(5)
+
+    pool = SubscriberConnectionPool()
+    queues = DeliveryQueues(pool)
+    for address in stalled + unreachable + healthy:
+        queues.set_policy(address, args.policy, args.queue_size)
+
+    # The stalled and unreachable subscribers are spread over the list, not at one
+    # end of it.
+    subscribers = list(healthy)
+    for others in (stalled, unreachable):
+        for i, address in enumerate(others):
+            subscribers.insert(i * len(subscribers) // len(others), address)
+
+    padding = "x" * args.offer_size
+    publish_times = []
+    count = int(args.rate * args.seconds)
+    warmup = int(args.rate * args.warmup)
+    started = time.monotonic()
+    for i in range(count):
+        due = started + i / args.rate
+        time.sleep(max(0, due - time.monotonic()))
+        msg = {"businessType": "Food", "offer": padding, "due": due}
+        if i < warmup:
+            msg["warmup"] = True
+        payload = wire_codec.EncodedMessage(msg)
+        call = time.perf_counter()
+        queues.enqueue(subscribers, payload, "Food")
+        publish_times.append(time.perf_counter() - call)
+    publish_seconds = time.monotonic() - started
+
+    # Let the healthy subscribers receive what is still on its way.
+    time.sleep(args.settle)
+    stats = queues.get_stats()
+    stop.set()
+    latencies = results.get(timeout=30)
+    receiver_process.join(5)
+    if staller_process is not None:
+        staller_process.kill()
+        staller_process.join(1)
+    queues.shutdown()
+    pool.close_all()
+    for listener, filler in holes:
+        filler.close()
+        listener.close()
+
+    return {
+        "subscribers": args.subscribers,
+        "stalled": len(stalled),
+        "unreachable": len(unreachable),
+        "offers": count,
+        "publish_seconds": round(publish_seconds, 2),
+        "delivered_to_healthy": len(latencies),
+        "expected_to_healthy": max(count - warmup, 0) * len(healthy),
+        "publish_p99_ms": percentile(publish_times, 99) * 1000,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "latency_p999_ms": percentile(latencies, 99.9) * 1000,
+        "dropped": stats["dropped"],
+        "disconnects": stats["disconnects"],
+        "queued_depth": stats["depth"],
+    }
+
+
+def fan_out(count: int, args) -> dict:
+    hole, filler = black_hole()
+    subscribers = [hole.getsockname()] + subscriber_addresses(count - 1, args.port)
+    pool = SubscriberConnectionPool()
+    queues = DeliveryQueues(pool)
+    payload = wire_codec.EncodedMessage({"businessType": "Food", "offer": "x" * args.offer_size})
+    result = {"subscribers": count}
+    for phase in ("cold", "warm"):
+        report = queues.enqueue(subscribers, payload, "Food")
+        deadline = time.monotonic() + args.deadline
+        # The others are done long before the unreachable subscriber is given up on.
+        while report.delivered < count - 1 and not report.done.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        healthy = report.percentile(100)
+        report.done.wait(max(0, deadline - time.monotonic()))
+        result[phase] = {
+            "delivered": report.delivered,
+            "dropped": report.dropped,
+            "failed": report.failed,
+            "p50_ms": round(report.percentile(50) * 1000, 1),
+            "p99_ms": round(report.percentile(99) * 1000, 1),
+            "all_delivered_ms": round(healthy * 1000, 1),
+            "complete_ms": round(report.elapsed * 1000, 1) if report.done.is_set() else None,
+        }
+    queues.shutdown()
+    pool.close_all()
+    filler.close()
+    hole.close()
+    return result
+
+
+def main_fan_out(args):
+    ready = multiprocessing.Event()
+    sink_process = multiprocessing.Process(target=sink, args=(args.port, ready), daemon=True)
+    sink_process.start()
+    ready.wait(5)
+    results = [fan_out(count, args) for count in args.fanout]
+    sink_process.terminate()
+
+    print(
+        f"{'subs':>7}{'phase':>6}{'delivered':>10}{'failed':>8}{'p50 ms':>9}{'p99 ms':>9}"
+        f"{'all ms':>9}{'complete ms':>13}"
+    )
+    for result in results:
+        for phase in ("cold", "warm"):
+            row = result[phase]
+            complete = "-" if row["complete_ms"] is None else row["complete_ms"]
+            print(
+                f"{result['subscribers']:>7}{phase:>6}{row['delivered']:>10}{row['failed']:>8}"
+                f"{row['p50_ms']:>9}{row['p99_ms']:>9}{row['all_delivered_ms']:>9}{complete:>13}"
+            )
+    return results
+
+
+def main_stalled(args):
+    results = [run(fraction, args) for fraction in args.stalled]
+
+    print(
+        f"{'stalled':>7}{'unreachable':>13}{'delivered':>11}{'of':>8}{'publish p99':>13}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'p99.9 ms':>10}{'dropped':>9}{'disconnects':>13}"
+    )
+    for row in results:
+        print(
+            f"{row['stalled']:>7}{row['unreachable']:>13}{row['delivered_to_healthy']:>11}{row['expected_to_healthy']:>8}"
+            f"{row['publish_p99_ms']:>13.2f}{row['latency_p50_ms']:>9.2f}{row['latency_p99_ms']:>9.2f}"
+            f"{row['latency_p999_ms']:>10.2f}{row['dropped']:>9}{row['disconnects']:>13}"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-subscriber delivery queue benchmark")
+    parser.add_argument("-n", "--subscribers", type=int, default=100)
+    parser.add_argument("--stalled", type=float, nargs="+", default=[0, 0.05], help="Fractions of stalled subscribers")
+    parser.add_argument(
+        "--unreachable", type=float, default=0, help="Fraction of subscribers that cannot be connected to"
+    )
+    parser.add_argument("--rate", type=float, default=50, help="Offers published per second")
+    parser.add_argument("--seconds", type=float, default=8)
+    parser.add_argument(
+        "--warmup", type=float, default=0, help="Seconds at the start whose offers are not measured"
+    )
+    parser.add_argument(
+        "--offer-size", type=int, default=32768, help="Large enough to fill the send buffers of stalled subscribers"
+    )
+    parser.add_argument("--policy", default="drop-oldest")
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to wait for the last offers")
+    parser.add_argument("--port", type=int, default=18800)
+    parser.add_argument(
+        "--fanout", type=int, nargs="+", help="Measures one offer to this many subscribers, one of them unreachable"
+    )
+    parser.add_argument(
+        "--deadline", type=float, default=60, help="Seconds to wait for a --fanout offer to be resolved"
+    )
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    if args.fanout:
+        results = main_fan_out(args)
+    else:
+        results = main_stalled(args)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Measures heartbeat ACK latency on a node socket while the node is busy with
+messages whose handlers block, as ELECTION messages do while they connect out and
+publish requests do while they fan out. Compares the NodeDispatcher with the
+previous loop, which accepted and handled one connection at a time.
+
+The node runs in its own process. The blocking handlers sleep for --block-ms,
+and --load of their messages are sent a second; meanwhile a heartbeat is sent
+every 10 ms and the time to its ACK is recorded.
+
+Usage:
+    python3 src/benchmarks/dispatch_benchmark.py --load 0 50 200 --block-ms 20
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gossip_benchmark import percentile
+from constants.constants import Type
+from modules.node_dispatcher import NodeDispatcher
+from utils import utils
+
+
+def handlers(block: float) -> dict:
+    def heartbeat(msg):
+        return utils.build_message(1, Type["ACK"].value, 0, "127.0.0.1")
+
+    def blocking(msg):
+        time.sleep(block)
+
+    return {
+        Type["HEARTBEAT"]: (heartbeat, NodeDispatcher.INLINE),
+        Type["ELECTION"]: (blocking, NodeDispatcher.POOL),
+        Type["PUBLISH_DATA_TO_SUBSCRIBERS"]: (blocking, NodeDispatcher.POOL),
+    }
+
+
+def dispatcher_node(sock, block: float):
+    sys.stdout = open(os.devnull, "w")
+    dispatcher = NodeDispatcher(sock)
+    for message_type, (handler, mode) in handlers(block).items():
+        dispatcher.register(message_type, handler, mode)
+    dispatcher.serve_forever()
+
+
+def legacy_node(sock, block: float):
+    sys.stdout = open(os.devnull, "w")
+    table = {message_type.value: handler for message_type, (handler, _) in handlers(block).items()}
+    while True:
+        connection, _ = sock.accept()
+        msg = utils.parse_message(utils.recv_frame(connection))
+        reply = table[msg["type"]](msg)
+        if reply is not None:
+            utils.send_frame(connection, reply)
+        connection.close()
+
+
+def send(address: tuple, message_type: Type, wait_for_reply: bool = False):
+    with socket.create_connection(address) as sock:
+        utils.send_frame(sock, utils.build_message(2, message_type.value, 0, "127.0.0.1"))
+        if wait_for_reply:
+            utils.recv_frame(sock)
+
+
+def run(mode: str, load: float, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    sock = utils.initialize_socket("127.0.0.1")
+    sock.listen(1024)
+    address = sock.getsockname()
+    target = dispatcher_node if mode == "dispatcher" else legacy_node
+    process = context.Process(target=target, args=(sock, args.block_ms / 1000), daemon=True)
+    process.start()
+    sock.close()
+
+    stopped = Event()
+
+    def generate_load():
+        kinds = [Type["ELECTION"], Type["PUBLISH_DATA_TO_SUBSCRIBERS"]]
+        sent = 0
+        started = time.monotonic()
+        while not stopped.is_set():
+            time.sleep(max(0, started + sent / load - time.monotonic()))
+            try:
+                send(address, kinds[sent % 2])
+            except OSError:
+                pass
+            sent += 1
+
+    if load:
+        Thread(target=generate_load, daemon=True).start()
+    latencies = []
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        send(address, Type["HEARTBEAT"], wait_for_reply=True)
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+    stopped.set()
+    process.kill()
+    process.join(1)
+
+    return {
+        "mode": mode,
+        "load_per_sec": load,
+        "block_ms": args.block_ms,
+        "heartbeats": len(latencies),
+        "ack_p50_ms": percentile(latencies, 50) * 1000,
+        "ack_p99_ms": percentile(latencies, 99) * 1000,
+        "ack_max_ms": max(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Node socket dispatch benchmark")
+    parser.add_argument("--load", type=float, nargs="+", default=[0, 50, 200], help="Blocking messages per second")
+    parser.add_argument("--block-ms", type=float, default=20, help="How long a blocking handler takes")
+    parser.add_argument("--seconds", type=float, default=5, help="How long to send heartbeats for")
+    parser.add_argument("--mode", nargs="+", default=["legacy", "dispatcher"], choices=["legacy", "dispatcher"])
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(mode, load, args) for load in args.load for mode in args.mode]
+
+    print(f"{'mode':>11}{'load/s':>8}{'heartbeats':>12}{'ack p50 ms':>12}{'ack p99 ms':>12}{'ack max ms':>12}")
+    for row in results:
+        print(
+            f"{row['mode']:>11}{row['load_per_sec']:>8.0f}{row['heartbeats']:>12}"
+            f"{row['ack_p50_ms']:>12.2f}{row['ack_p99_ms']:>12.2f}{row['ack_max_ms']:>12.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Measures how long a cluster of N nodes takes to agree on a stable leader with the
+bully election, and how much CPU time the nodes spend on it. Every node runs in its
+own process and all of them start their election at the same time, like a cluster
+that was just started.
+
+A leader counts as stable once every node has it as leader and no node starts
+another election or announces another leader for --settle seconds.
+
+With --unreachable, that many more nodes are in the node list above the live ones,
+but their connects never complete, like hosts that silently drop packets. With
+--failover, the leader is killed once it is stable and the lowest node starts an
+election, as a follower that noticed the failure would; the failover time is how
+long the remaining nodes then take to agree on a new stable leader. It does not
+include the time to notice the failure.
+
+Usage:
+    python3 src/benchmarks/election_benchmark.py -n 3 10 25 50
+    python3 src/benchmarks/election_benchmark.py -n 30 --unreachable 10 --failover
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.delivery_benchmark import black_hole
+from constants.constants import OFFER_LOG_DIR_ENV, Type
+from modules.leader_election import BullyLeaderElection
+from utils import utils
+
+
+class MeasuredElection(BullyLeaderElection):
+    """
+    Reports elections and leader changes to the benchmark.
+    """
+
+    events = None
+
+    def initiate_election(self):
+        self.events.put(("election", self.nodeId, None, time.time()))
+        super().initiate_election()
+        if self.leaderID == self.nodeId:
+            self.events.put(("leader", self.nodeId, self.nodeId, time.time()))
+
+    def process_end_message(self, msg: dict):
+        super().process_end_message(msg)
+        self.events.put(("leader", self.nodeId, msg["id"], time.time()))
+
+    def watch_leader(self):
+        # Nodes do not start elections when the gossip membership declares the
+        # leader dead, because the benchmark starts the failover election itself.
+        Event().wait()
+
+
+def node(sock, node_id: int, nodes: list, inherited: list, directory: str, start, stop, events):
+    # Sockets of other nodes that came along with the fork. A node that was killed
+    # would otherwise still accept connections here.
+    for other in inherited:
+        if other is not sock:
+            other.close()
+    os.chdir(directory)
+    os.environ[OFFER_LOG_DIR_ENV] = os.path.join(directory, "offer_log")
+    sys.stdout = open(os.devnull, "w")
+
+    def report_cpu():
+        stop.recv()
+        events.put(("cpu", node_id, time.process_time(), time.time()))
+        events.close()
+        events.join_thread()
+        os._exit(0)
+
+    MeasuredElection.events = events
+    Thread(target=report_cpu, daemon=True).start()
+    start.wait()
+    # The leader's client port is 0 so the nodes that become leader do not compete
+    # for the same port.
+    MeasuredElection(
+        "127.0.0.1", sock.getsockname()[1], node_id, nodes, sock,
+        False, False, True, "127.0.0.1", 0,
+    )
+    Event().wait()
+
+
+def wait_for_stable(count: int, expected: int, leaders: dict, events, args) -> dict:
+    """
+    Reads node events until every live node has the expected leader and nothing
+    has happened for --settle seconds, or until --timeout.
+    """
+    elections = announcements = 0
+    stable_at = None
+    started = last_event = time.time()
+    deadline = started + args.timeout
+    while time.time() < deadline:
+        try:
+            kind, node_id, value, at = events.get(timeout=0.05)
+        except queue.Empty:
+            if stable_at is not None and time.time() - last_event >= args.settle:
+                break
+            continue
+        last_event = at
+        if kind == "election":
+            elections += 1
+        elif kind == "leader":
+            announcements += 1
+            leaders[node_id] = value
+        agreed = len(leaders) == count and all(leader == expected for leader in leaders.values())
+        stable_at = at if agreed else None
+    return {
+        "seconds": (stable_at - started) if stable_at else None,
+        "elections_started": elections,
+        "leader_announcements": announcements,
+    }
+
+
+def trigger_election(target: dict):
+    """
+    Sends an ELECTION message to a node, the way a lower node that noticed the
+    leader failure would. The node answers to a listener nobody reads from.
+    """
+    listener = utils.initialize_socket("127.0.0.1")
+    listener.listen(8)
+    ip, port = listener.getsockname()
+    with socket.create_connection((target["ip"], target["port"])) as sock:
+        utils.send_frame(sock, utils.build_message(1, Type["ELECTION"].value, port, ip))
+    return listener
+
+
+def run(count: int, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    sockets = []
+    for _ in range(count):
+        sock = utils.initialize_socket("127.0.0.1")
+        sock.listen(128)
+        sockets.append(sock)
+    holes = [black_hole() for _ in range(args.unreachable)]
+    addresses = [sock.getsockname() for sock in sockets] + [hole.getsockname() for hole, _ in holes]
+    nodes = [
+        {"ip": ip, "port": port, "id": 100 + i, "type": "generic", "interests": []}
+        for i, (ip, port) in enumerate(addresses)
+    ]
+    live = nodes[:count]
+    inherited = sockets + [end for pair in holes for end in pair]
+    directory = tempfile.mkdtemp(prefix="election_benchmark_", dir=args.dir)
+    start, events = context.Event(), context.Queue()
+    processes = {}
+    # A pipe per node rather than one Event: Event.set blocks forever if a node that
+    # was waiting on it has exited, which nodes do when they cannot reach anyone.
+    stops = []
+    for sock, entry in zip(sockets, live):
+        node_directory = os.path.join(directory, str(entry["id"]))
+        os.mkdir(node_directory)
+        stop, stop_sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=node,
+            args=(sock, entry["id"], nodes, inherited, node_directory, start, stop, events),
+            daemon=True,
+        )
+        process.start()
+        processes[entry["id"]] = process
+        stops.append(stop_sender)
+    for sock in sockets:
+        sock.close()
+
+    leaders = {}
+    start.set()
+    election = wait_for_stable(count, live[-1]["id"], leaders, events, args)
+    result = {
+        "nodes": len(nodes),
+        "unreachable": args.unreachable,
+        "stable": election["seconds"] is not None,
+        "seconds_to_stable_leader": election["seconds"],
+        "elections_started": election["elections_started"],
+        "leader_announcements": election["leader_announcements"],
+    }
+
+    if args.failover and result["stable"] and count > 2:
+        processes[live[-1]["id"]].kill()
+        del leaders[live[-1]["id"]]
+        listener = trigger_election(live[0])
+        failover = wait_for_stable(count - 1, live[-2]["id"], leaders, events, args)
+        listener.close()
+        result["failover_seconds"] = failover["seconds"]
+        result["failover_elections_started"] = failover["elections_started"]
+
+    for stop_sender in stops:
+        try:
+            stop_sender.send(True)
+        except OSError:
+            pass
+        stop_sender.close()
+    cpu = {}
+    collect_until = time.time() + 5
+    while len(cpu) < len(processes) and time.time() < collect_until:
+        try:
+            kind, node_id, value, _ = events.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if kind == "cpu":
+            cpu[node_id] = value
+    for process in processes.values():
+        process.join(0.5)
+        if process.is_alive():
+            process.kill()
+    for hole, filler in holes:
+        filler.close()
+        hole.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    result["cpu_seconds"] = sum(cpu.values())
+    result["cpu_seconds_per_node"] = sum(cpu.values()) / max(len(cpu), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bully leader election benchmark")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[3, 10, 25, 50], help="Live nodes")
+    parser.add_argument("-u", "--unreachable", type=int, default=0, help="Nodes that never answer a connect")
+    parser.add_argument("--failover", action="store_true", help="Kill the leader and measure the next election")
+    parser.add_argument("--settle", type=float, default=3, help="Quiet seconds before a leader counts as stable")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for a stable leader")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the nodes keep their offer logs")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(count, args) for count in args.nodes]
+
+    def seconds(value):
+        return f"{value:.2f}" if value is not None else "timeout"
+
+    print(
+        f"{'nodes':>6}{'down':>6}{'stable s':>10}{'elections':>11}{'announced':>11}"
+        f"{'failover s':>12}{'cpu s':>9}{'cpu s/node':>12}"
+    )
+    for row in results:
+        failover = seconds(row["failover_seconds"]) if "failover_seconds" in row else "-"
+        print(
+            f"{row['nodes']:>6}{row['unreachable']:>6}{seconds(row['seconds_to_stable_leader']):>10}"
+            f"{row['elections_started']:>11}{row['leader_announcements']:>11}{failover:>12}"
+            f"{row['cpu_seconds']:>9.2f}{row['cpu_seconds_per_node']:>12.3f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
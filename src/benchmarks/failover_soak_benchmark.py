@@ -0,0 +1,212 @@
+"""
+Forces many consecutive leader failovers on one node and reports its resident
+memory and thread count as they go, to show that failovers do not pile up threads
+or objects.
+
+The measured node runs in its own process and starts out alone, so it becomes the
+leader. Then, for every failover, a higher node joins through the gossip membership
+and announces itself as the new leader, and is killed once the measured node
+follows it. The measured node's gossip declares it dead, which makes the measured
+node run an election and take over as leader again; that is one failover. The
+failover time is from the kill until the measured node is leader again, so it
+includes the time the gossip membership takes to notice the failure.
+
+Usage:
+    python3 src/benchmarks/failover_soak_benchmark.py --failovers 1000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from threading import Event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gossip_benchmark import free_udp_ports, percentile
+from constants.constants import OFFER_LOG_DIR_ENV, MemberStatus, Type
+from modules.gossip import GossipMembership
+from modules.leader_election import BullyLeaderElection
+from utils import utils
+
+
+def rss_bytes() -> int:
+    """
+    Returns the resident set size of this process, or its peak where /proc is not
+    available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SoakElection(BullyLeaderElection):
+    """
+    Reports membership and leader changes to the benchmark, with the node's RSS and
+    thread count whenever it becomes leader.
+    """
+
+    events = None
+
+    def initiate_election(self):
+        super().initiate_election()
+        if self.leaderID == self.nodeId:
+            usage = {"rss": rss_bytes(), "threads": threading.active_count()}
+            self.events.put(("leader", self.nodeId, usage, time.time()))
+
+    def process_end_message(self, msg: dict):
+        super().process_end_message(msg)
+        self.events.put(("leader", msg["id"], None, time.time()))
+
+    def member_changed(self, node: dict, status: MemberStatus):
+        super().member_changed(node, status)
+        if status is MemberStatus.ALIVE:
+            self.events.put(("joined", node["id"], None, time.time()))
+
+
+def measured_node(sock, entry: dict, directory: str, events):
+    os.chdir(directory)
+    os.environ[OFFER_LOG_DIR_ENV] = os.path.join(directory, "offer_log")
+    sys.stdout = open(os.devnull, "w")
+    SoakElection.events = events
+    # The leader's client port is 0 so the node gets a free one.
+    SoakElection(
+        entry["ip"], entry["port"], entry["id"], [entry], sock,
+        False, False, True, "127.0.0.1", 0,
+    )
+
+
+def higher_node(entry: dict, nodes: list):
+    sys.stdout = open(os.devnull, "w")
+    GossipMembership(entry["id"], entry["ip"], entry["port"], nodes).start()
+    Event().wait()
+
+
+def wait_for(events, kind: str, node_id: int, until: float):
+    """
+    Reads node events until one of the given kind about the given node, or until the
+    deadline.
+
+    Returns:
+        tuple: The event's value and time, or None on timeout.
+    """
+    while time.time() < until:
+        try:
+            event_kind, event_id, value, at = events.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        if event_kind == kind and event_id == node_id:
+            return value, at
+    return None
+
+
+def run(args) -> dict:
+    context = multiprocessing.get_context("fork")
+    sock = utils.initialize_socket("127.0.0.1")
+    sock.listen(128)
+    measured = {"ip": "127.0.0.1", "port": sock.getsockname()[1], "id": 100}
+    higher = {"ip": "127.0.0.1", "port": free_udp_ports(1)[0], "id": 101}
+    directory = tempfile.mkdtemp(prefix="failover_soak_", dir=args.dir)
+    events = context.Queue()
+    node_process = context.Process(
+        target=measured_node, args=(sock, measured, directory, events), daemon=True
+    )
+    node_process.start()
+    sock.close()
+
+    samples = []
+    first = wait_for(events, "leader", measured["id"], time.time() + args.timeout)
+    if first is not None:
+        samples.append(dict(first[0], failover=0, seconds=None))
+    while first is not None and len(samples) <= args.failovers:
+        until = time.time() + args.timeout
+        process = context.Process(target=higher_node, args=(higher, [measured, higher]), daemon=True)
+        process.start()
+        if wait_for(events, "joined", higher["id"], until) is None:
+            process.kill()
+            break
+        # Sent the way the higher node would after winning its election.
+        with socket.create_connection((measured["ip"], measured["port"])) as conn:
+            utils.send_frame(
+                conn,
+                utils.build_message(higher["id"], Type["END"].value, higher["port"], higher["ip"]),
+            )
+        if wait_for(events, "leader", higher["id"], until) is None:
+            process.kill()
+            break
+        process.kill()
+        process.join()
+        killed_at = time.time()
+        taken_over = wait_for(events, "leader", measured["id"], until)
+        if taken_over is None:
+            break
+        usage, at = taken_over
+        samples.append(dict(usage, failover=len(samples), seconds=at - killed_at))
+        if args.verbose and len(samples) % args.report_every == 1:
+            print(f"failover {len(samples) - 1}: {usage}", file=sys.stderr)
+
+    node_process.kill()
+    node_process.join()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    failovers = [sample for sample in samples if sample["failover"] > 0]
+    seconds = [sample["seconds"] for sample in failovers]
+    return {
+        "failovers": len(failovers),
+        "completed": len(failovers) == args.failovers,
+        "failover_p50_seconds": percentile(seconds, 50),
+        "failover_p99_seconds": percentile(seconds, 99),
+        "rss_start": samples[0]["rss"] if samples else None,
+        "rss_end": samples[-1]["rss"] if samples else None,
+        "threads_start": samples[0]["threads"] if samples else None,
+        "threads_end": samples[-1]["threads"] if samples else None,
+        "samples": [
+            {key: sample[key] for key in ("failover", "rss", "threads")}
+            for sample in samples
+            if sample["failover"] % args.report_every == 0 or sample is samples[-1]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Leader failover soak benchmark")
+    parser.add_argument("--failovers", type=int, default=1000, help="Consecutive leader failovers")
+    parser.add_argument("--report-every", type=int, default=100, help="Failovers between two reported samples")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a single failover")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the node keeps its offer log")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Prints progress to stderr")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    print(f"{'failover':>9}{'rss MB':>10}{'threads':>9}")
+    for sample in result["samples"]:
+        print(f"{sample['failover']:>9}{sample['rss'] / 2**20:>10.1f}{sample['threads']:>9}")
+    print(
+        f"{result['failovers']} failovers"
+        f"{'' if result['completed'] else ' (stopped early: a failover timed out)'}, "
+        f"p50 {result['failover_p50_seconds']:.3f} s, p99 {result['failover_p99_seconds']:.3f} s"
+    )
+    if result["samples"]:
+        print(
+            f"RSS grew by {(result['rss_end'] - result['rss_start']) / 2**20:.1f} MB, "
+            f"threads went from {result['threads_start']} to {result['threads_end']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures how the gossip membership's wait for a ping's ACK copes with jitter: a
+fixed GOSSIP_PING_TIMEOUT against the wait the phi accrual failure detector learns
+from the member's earlier round trips.
+
+The simulation pings a member over and over. Its round trips are --base seconds plus
+an exponentially distributed delay with mean --jitter, so there is a long tail. A
+ping is late when its ACK arrives after the direct wait, which makes the node ask
+other members to probe, and a false suspicion when the ACK arrives after the
+suspicion deadline: the end of the period for the fixed timeout, and the end of the
+period or twice the direct wait, whichever is later, with phi. The wait before a
+member that died is suspected is printed as the cost of waiting longer.
+
+Usage:
+    python3 src/benchmarks/failure_detector_benchmark.py -t 4 8 12 -j 0 0.01 0.03 0.1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gossip_benchmark import percentile
+from constants.constants import GOSSIP_MAX_PING_TIMEOUT, GOSSIP_PERIOD, GOSSIP_PING_TIMEOUT
+from modules.failure_detector import PhiAccrualFailureDetector
+
+
+def simulate(threshold, jitter: float, args) -> dict:
+    """
+    Args:
+        threshold (float): The phi threshold, or None for the fixed timeout.
+        jitter (float): Mean of the delay added to the base round trip.
+    """
+    rng = random.Random(args.seed)
+    detector = PhiAccrualFailureDetector(threshold=threshold or 8)
+    late = suspicions = 0
+    deadlines = []
+    for _ in range(args.pings):
+        if threshold is None:
+            timeout = GOSSIP_PING_TIMEOUT
+            deadline = GOSSIP_PERIOD
+        else:
+            timeout = min(max(detector.timeout(), GOSSIP_PING_TIMEOUT), GOSSIP_MAX_PING_TIMEOUT)
+            deadline = max(GOSSIP_PERIOD, 2 * timeout)
+        deadlines.append(deadline)
+        round_trip = args.base + (rng.expovariate(1 / jitter) if jitter else 0.0)
+        if round_trip > min(timeout, GOSSIP_PERIOD / 2):
+            late += 1
+        if round_trip > deadline:
+            suspicions += 1
+        detector.record(round_trip)
+    return {
+        "threshold": threshold,
+        "jitter_ms": jitter * 1000,
+        "pings": args.pings,
+        "late_acks": late,
+        "false_suspicions": suspicions,
+        "suspect_after_p50_ms": percentile(deadlines, 50) * 1000,
+        "suspect_after_max_ms": max(deadlines) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gossip ping timeout benchmark, fixed against phi accrual")
+    parser.add_argument("-t", "--thresholds", type=float, nargs="+", default=[4, 8, 12])
+    parser.add_argument(
+        "-j", "--jitter", type=float, nargs="+", default=[0, 0.01, 0.03, 0.1], help="Mean extra delay, seconds"
+    )
+    parser.add_argument("--base", type=float, default=0.0005, help="Round trip without jitter, seconds")
+    parser.add_argument("--pings", type=int, default=200000, help="Simulated pings per threshold and jitter")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [simulate(threshold, jitter, args) for jitter in args.jitter for threshold in [None] + args.thresholds]
+
+    print(f"{args.pings} pings, {args.base * 1000:.1f} ms round trip plus exponential jitter")
+    print(f"{'timeout':>9}{'jitter ms':>11}{'late ACKs':>11}{'false suspicions':>18}{'suspect p50 ms':>16}{'max ms':>8}")
+    for row in results:
+        timeout = "fixed" if row["threshold"] is None else f"phi {row['threshold']:.0f}"
+        print(
+            f"{timeout:>9}{row['jitter_ms']:>11.0f}{row['late_acks']:>11}{row['false_suspicions']:>18}"
+            f"{row['suspect_after_p50_ms']:>16.0f}{row['suspect_after_max_ms']:>8.0f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Measures how long the GeoIndex takes to find the subscribers near an offer, against
+the number of subscriber points and their radius. Subscribers are spread around a
+handful of city centres; offers are published at random points in the same cities.
+For the smaller sizes it also times checking the distance to every subscriber.
+
+Usage:
+    python3 src/benchmarks/geo_benchmark.py -n 10000 100000 1000000 -r 1 5 25
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants.constants import EARTH_RADIUS_KM
+from modules.geo_index import GeoIndex, KM_PER_DEGREE
+
+CITIES = [(52.52, 13.40), (48.14, 11.58), (50.11, 8.68), (53.55, 9.99), (51.23, 6.78)]
+
+
+def random_point(rng: random.Random, spread_km: float) -> tuple:
+    lat, lon = rng.choice(CITIES)
+    lat += rng.gauss(0, spread_km) / KM_PER_DEGREE
+    lon += rng.gauss(0, spread_km) / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+    return lat, lon
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run(points: list, radius: float, offers: list, args) -> dict:
+    index = GeoIndex()
+    start = time.perf_counter()
+    for key, (lat, lon) in enumerate(points):
+        index.add(key, lat, lon, radius)
+    build = time.perf_counter() - start
+
+    latencies = []
+    matches = 0
+    for lat, lon in offers:
+        start = time.perf_counter()
+        matches += len(index.query(lat, lon))
+        latencies.append(time.perf_counter() - start)
+
+    result = {
+        "subscribers": len(points),
+        "radius_km": radius,
+        "add_us": build / len(points) * 1e6,
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+        "matches_avg": matches / len(offers),
+        "scan_us": None,
+    }
+    if len(points) <= args.max_scan:
+        sample = offers[:20]
+        start = time.perf_counter()
+        for lat, lon in sample:
+            [key for key, (s_lat, s_lon) in enumerate(points) if distance_km(lat, lon, s_lat, s_lon) <= radius]
+        result["scan_us"] = (time.perf_counter() - start) / len(sample) * 1e6
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geospatial subscription matching benchmark")
+    parser.add_argument("-n", "--subscribers", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("-r", "--radius", type=float, nargs="+", default=[1, 5, 25])
+    parser.add_argument("--spread", type=float, default=15, help="Spread of each city in km")
+    parser.add_argument("--offers", type=int, default=2000)
+    parser.add_argument("--max-scan", type=int, default=100000, help="Largest size to also scan linearly")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    offers = [random_point(rng, args.spread) for _ in range(args.offers)]
+    results = []
+    for count in args.subscribers:
+        points = [random_point(rng, args.spread) for _ in range(count)]
+        for radius in args.radius:
+            results.append(run(points, radius, offers, args))
+
+    print(f"{'subs':>9}{'radius km':>10}{'matches':>10}{'p50 us':>10}{'p99 us':>10}{'scan us':>12}{'add us':>8}")
+    for row in results:
+        scan = f"{row['scan_us']:.0f}" if row["scan_us"] is not None else "-"
+        print(
+            f"{row['subscribers']:>9}{row['radius_km']:>10g}{row['matches_avg']:>10.1f}"
+            f"{row['p50_us']:>10.0f}{row['p99_us']:>10.0f}{scan:>12}{row['add_us']:>8.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Measures how long the SWIM gossip membership takes to notice that a node died and
+to let every other node know, and how many gossip messages each node handles, for
+growing cluster sizes. Every node runs in its own process.
+
+Once the nodes have run for --warmup seconds, --kills nodes are killed one after
+another, the highest ID first, as the leader would be. For each, the detection time
+is how long until some node suspects it and the dissemination time how long until
+every remaining node has it as dead. Suspicions of nodes that were not killed are
+counted as false. At the end the nodes' views are compared; a single distinct view
+means they all agree.
+
+The leader heartbeats that gossip replaces had the leader send 10 * (n - 1)
+messages a second; the leader's own gossip load is printed for comparison.
+
+Usage:
+    python3 src/benchmarks/gossip_benchmark.py -n 4 8 16 32 64 --kills 3
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.gossip import GossipMembership
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+
+def free_udp_ports(count: int) -> list:
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def node(entry: dict, nodes: list, start, stop, events):
+    sys.stdout = open(os.devnull, "w")
+
+    def member_changed(member: dict, status):
+        events.put(("change", entry["id"], (member["id"], status.name), time.time()))
+
+    gossip = GossipMembership(entry["id"], entry["ip"], entry["port"], nodes, member_changed)
+    start.wait()
+    gossip.start()
+    started = time.time()
+    stop.recv()
+    stats = gossip.get_stats()
+    stats["seconds"] = time.time() - started
+    stats["cpu"] = time.process_time()
+    stats["digest"] = gossip.digest()
+    events.put(("stats", entry["id"], stats, time.time()))
+    events.close()
+    events.join_thread()
+    os._exit(0)
+
+
+def drain(events, until: float, on_event) -> bool:
+    """
+    Passes node events to on_event until it returns True or until the deadline.
+    """
+    while time.time() < until:
+        try:
+            event = events.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        if on_event(*event):
+            return True
+    return False
+
+
+def run(count: int, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    nodes = [
+        {"ip": "127.0.0.1", "port": port, "id": 100 + i}
+        for i, port in enumerate(free_udp_ports(count))
+    ]
+    start, events = context.Event(), context.Queue()
+    processes, stops = {}, {}
+    for entry in nodes:
+        stop, stop_sender = context.Pipe(duplex=False)
+        process = context.Process(target=node, args=(entry, nodes, start, stop, events), daemon=True)
+        process.start()
+        processes[entry["id"]] = process
+        stops[entry["id"]] = stop_sender
+    start.set()
+
+    killed = set()
+    false_suspicions = []
+
+    def count_false(kind, observer, value, at):
+        if kind == "change" and value[1] != "ALIVE" and value[0] not in killed:
+            false_suspicions.append((observer, value))
+        return False
+
+    drain(events, time.time() + args.warmup, count_false)
+
+    detections, first_dead, disseminations = [], [], []
+    for victim in sorted(processes, reverse=True)[: min(args.kills, count - 2)]:
+        killed.add(victim)
+        live = set(processes) - killed
+        processes[victim].kill()
+        killed_at = time.time()
+        suspected, dead = [], {}
+
+        def track(kind, observer, value, at):
+            count_false(kind, observer, value, at)
+            if kind != "change" or value[0] != victim:
+                return False
+            if value[1] == "SUSPECT":
+                suspected.append(at)
+            elif value[1] == "DEAD" and observer in live:
+                dead[observer] = at
+            return len(dead) == len(live)
+
+        drain(events, killed_at + args.timeout, track)
+        detections.append(min(suspected + list(dead.values()) or [float("nan")]) - killed_at)
+        first_dead.append(min(dead.values() or [float("nan")]) - killed_at)
+        disseminations.append(
+            (max(dead.values()) - killed_at) if len(dead) == len(live) else float("nan")
+        )
+        drain(events, time.time() + args.settle, count_false)
+
+    stats = {}
+
+    def collect(kind, node_id, value, at):
+        if kind == "stats":
+            stats[node_id] = value
+        else:
+            count_false(kind, node_id, value, at)
+        return len(stats) == len(processes) - len(killed)
+
+    for node_id, stop_sender in stops.items():
+        if node_id not in killed:
+            stop_sender.send(True)
+        stop_sender.close()
+    drain(events, time.time() + 10, collect)
+    for process in processes.values():
+        process.join(0.5)
+        if process.is_alive():
+            process.kill()
+
+    rates = {
+        node_id: (value["sent"] + value["received"]) / value["seconds"]
+        for node_id, value in stats.items()
+    }
+    leader = max(stats) if stats else None
+    return {
+        "nodes": count,
+        "killed": len(killed),
+        "detection_ms": [round(value * 1000) for value in detections],
+        "first_dead_ms": [round(value * 1000) for value in first_dead],
+        "dissemination_ms": [round(value * 1000) for value in disseminations],
+        "false_suspicions": len(false_suspicions),
+        "distinct_views": len({value["digest"] for value in stats.values()}),
+        "messages_per_sec_mean": sum(rates.values()) / max(len(rates), 1),
+        "messages_per_sec_max": max(rates.values(), default=0.0),
+        "leader_messages_per_sec": rates.get(leader, 0.0),
+        "previous_leader_heartbeats_per_sec": 10 * (count - len(killed) - 1),
+        "cpu_seconds_per_node": sum(value["cpu"] for value in stats.values()) / max(len(stats), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SWIM gossip membership benchmark")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--kills", type=int, default=3, help="Nodes killed one after another")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds before the first kill")
+    parser.add_argument("--settle", type=float, default=1, help="Seconds between kills")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for every node to notice a kill")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(count, args) for count in args.nodes]
+
+    print(
+        f"{'nodes':>6}{'detect ms':>11}{'dead ms':>9}{'all know ms':>13}{'false':>7}{'views':>7}"
+        f"{'msg/s/node':>12}{'max':>7}{'leader':>8}{'before':>8}"
+    )
+    for row in results:
+        print(
+            f"{row['nodes']:>6}{percentile(row['detection_ms'], 50):>11}{percentile(row['first_dead_ms'], 50):>9}"
+            f"{percentile(row['dissemination_ms'], 50):>13}{row['false_suspicions']:>7}{row['distinct_views']:>7}"
+            f"{row['messages_per_sec_mean']:>12.1f}{row['messages_per_sec_max']:>7.1f}"
+            f"{row['leader_messages_per_sec']:>8.1f}{row['previous_leader_heartbeats_per_sec']:>8}"
+        )
+    print("Times are medians over the kills; 'before' is the leader's heartbeats/s without gossip")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
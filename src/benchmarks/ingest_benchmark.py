@@ -0,0 +1,152 @@
+"""
+Compares subscriber registrations per second on the leader's client port for the
+blocking PubSub.listen_to_client loop and the asyncio ingest server.
+
+Usage:
+    python3 src/benchmarks/ingest_benchmark.py -n 5000 -c 50
+    python3 src/benchmarks/ingest_benchmark.py -n 5000 -c 50 --idle-clients 1
+"""
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sys
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import pub_sub_handler
+from modules.pub_sub_handler import PubSub
+from utils import utils as helper
+
+
+def registration_frame(index: int, interest: str) -> bytes:
+    msg = {
+        "client_type": "subscriber",
+        "ip": "127.0.0.1",
+        "port": 20000 + index,
+        "interests": [interest],
+    }
+    return helper.encode_frame(json.dumps(msg).encode("utf-8"))
+
+
+def registered_count(interest: str) -> int:
+    return pub_sub_handler.subscriptions.subscriber_count(interest)
+
+
+def wait_for_port(ip: str, port: int, timeout: float = 5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((ip, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on {ip}:{port} did not start")
+
+
+def client(ip: str, port: int, frames: list, persistent: bool, stop: Event):
+    if persistent:
+        with socket.create_connection((ip, port)) as sock:
+            sock.sendall(b"".join(frames))
+            # Half-close so the server sees EOF only after reading every request.
+            sock.shutdown(socket.SHUT_WR)
+            sock.recv(1)
+        return
+    for frame in frames:
+        if stop.is_set():
+            return
+        with socket.create_connection((ip, port)) as sock:
+            sock.sendall(frame)
+
+
+def run(name: str, ip: str, port: int, args, persistent: bool) -> dict:
+    # Each run registers under its own interest so stragglers from an earlier,
+    # timed out run are not counted.
+    interest = name
+    wait_for_port(ip, port)
+    # The readiness probe above counts as one (empty) client for the blocking loop.
+    time.sleep(0.2)
+
+    idle = [socket.create_connection((ip, port)) for _ in range(args.idle_clients)]
+
+    frames = [registration_frame(i, interest) for i in range(args.registrations)]
+    per_client = [frames[i :: args.clients] for i in range(args.clients)]
+    stop = Event()
+    threads = [
+        Thread(target=client, args=(ip, port, chunk, persistent, stop), daemon=True)
+        for chunk in per_client
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    deadline = start + args.timeout
+    while (
+        registered_count(interest) < args.registrations
+        and time.perf_counter() < deadline
+    ):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    done = registered_count(interest)
+
+    stop.set()
+    for sock in idle:
+        sock.close()
+
+    return {
+        "server": name,
+        "registrations": done,
+        "timed_out": done < args.registrations,
+        "elapsed_s": round(elapsed, 4),
+        "registrations_per_s": round(done / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client ingest benchmark")
+    parser.add_argument("-n", "--registrations", type=int, default=5000)
+    parser.add_argument("-c", "--clients", type=int, default=50)
+    parser.add_argument(
+        "--idle-clients",
+        type=int,
+        default=0,
+        help="Connections that are opened but never send anything",
+    )
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--ip", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        blocking = PubSub(-1, 0, args.ip, [], args.ip, args.port)
+        Thread(target=blocking.listen_to_client, daemon=True).start()
+        results.append(run("blocking loop", args.ip, args.port, args, False))
+
+        ingest = PubSub(-1, 0, args.ip, [], args.ip, args.port + 1)
+        ingest_thread = Thread(target=ingest.serve_clients, daemon=True)
+        ingest_thread.start()
+        results.append(run("asyncio, connection per request", args.ip, args.port + 1, args, False))
+        results.append(run("asyncio, persistent connections", args.ip, args.port + 1, args, True))
+        ingest.ingest_server.stop()
+        ingest_thread.join(5)
+
+    print(f"{'server':<34}{'registrations':>14}{'seconds':>10}{'reg/s':>12}")
+    for result in results:
+        flag = " (timed out)" if result["timed_out"] else ""
+        print(
+            f"{result['server']:<34}{result['registrations']:>14}"
+            f"{result['elapsed_s']:>10}{result['registrations_per_s']:>12}{flag}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measures what recording metrics costs on the hot path: ns per counter increment,
+gauge set and histogram observation, from one thread and from several at once,
+against an empty loop. Also measures how long a scrape of the metrics endpoint
+takes with many labelled series.
+
+Usage:
+    python3 src/benchmarks/metrics_benchmark.py --threads 1 8 --series 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.metrics import MetricsRegistry, MetricsServer
+
+
+def ns_per_op(record, threads: int, ops: int) -> float:
+    def loop():
+        for i in range(ops):
+            record(i)
+
+    workers = [Thread(target=loop) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (ops * threads) * 1e9
+
+
+def run(threads: int, args) -> dict:
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "Counter")
+    labelled = registry.counter("bench_labelled_total", "Counter", ("outcome",)).labels("sent")
+    gauge = registry.gauge("bench_gauge", "Gauge")
+    histogram = registry.histogram("bench_seconds", "Histogram")
+
+    baseline = ns_per_op(lambda i: None, threads, args.ops)
+    return {
+        "threads": threads,
+        "empty_loop_ns": baseline,
+        "counter_ns": ns_per_op(lambda i: counter.inc(), threads, args.ops) - baseline,
+        "labelled_counter_ns": ns_per_op(lambda i: labelled.inc(), threads, args.ops) - baseline,
+        "gauge_ns": ns_per_op(gauge.set, threads, args.ops) - baseline,
+        "histogram_ns": ns_per_op(lambda i: histogram.observe(i * 1e-6), threads, args.ops) - baseline,
+    }
+
+
+def scrape(args) -> dict:
+    registry = MetricsRegistry()
+    histogram = registry.histogram("bench_seconds", "Histogram", ("series",))
+    for series in range(args.series):
+        histogram.labels(series).observe(series * 1e-4)
+    server = MetricsServer(0, registry=registry)
+    server.start()
+    url = f"http://127.0.0.1:{server.port}/metrics"
+    timings = []
+    for _ in range(args.scrapes):
+        started = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            body = response.read()
+        timings.append(time.perf_counter() - started)
+    server.stop()
+    return {
+        "series": args.series,
+        "lines": body.count(b"\n"),
+        "bytes": len(body),
+        "scrape_ms": sorted(timings)[len(timings) // 2] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics recording and scrape benchmark")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--ops", type=int, default=200000, help="Operations per thread")
+    parser.add_argument("--series", type=int, default=1000, help="Labelled histogram series to scrape")
+    parser.add_argument("--scrapes", type=int, default=20)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(threads, args) for threads in args.threads]
+    scraped = scrape(args)
+
+    print(f"{'threads':>8}{'counter ns':>12}{'labelled ns':>13}{'gauge ns':>10}{'histogram ns':>14}")
+    for row in results:
+        print(
+            f"{row['threads']:>8}{row['counter_ns']:>12.0f}{row['labelled_counter_ns']:>13.0f}"
+            f"{row['gauge_ns']:>10.0f}{row['histogram_ns']:>14.0f}"
+        )
+    print(
+        f"Scrape of {scraped['series']} histogram series ({scraped['lines']} lines, "
+        f"{scraped['bytes']} bytes): {scraped['scrape_ms']:.1f} ms"
+    )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"recording": results, "scrape": scraped}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
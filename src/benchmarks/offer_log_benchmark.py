@@ -0,0 +1,94 @@
+"""
+Measures offer log appends/sec and append latency for each fsync policy, with one
+and with several publisher threads appending at the same time. The log is written
+to a temporary directory under --dir, which should be on the disk you care about
+(fsync on tmpfs costs nothing).
+
+Usage:
+    python3 src/benchmarks/offer_log_benchmark.py -w 1 8 32 --duration 3
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from threading import Barrier, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.offer_log import FSYNC_POLICIES, OfferLog
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+
+def run(policy: str, writers: int, args) -> dict:
+    directory = tempfile.mkdtemp(prefix="offer_log_benchmark_", dir=args.dir)
+    log = OfferLog(directory, fsync=policy)
+    payload = b"x" * args.payload
+    latencies = [[] for _ in range(writers)]
+    start_line = Barrier(writers + 1)
+    deadline = [0.0]
+
+    def writer(samples: list):
+        start_line.wait()
+        while time.perf_counter() < deadline[0]:
+            started = time.perf_counter()
+            log.append_many([payload] * args.batch)
+            samples.append(time.perf_counter() - started)
+
+    threads = [Thread(target=writer, args=(samples,)) for samples in latencies]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + args.duration
+    started = time.perf_counter()
+    start_line.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = log.get_stats()
+    log.close()
+    shutil.rmtree(directory)
+    samples = [sample for per_writer in latencies for sample in per_writer]
+    return {
+        "fsync": policy,
+        "writers": writers,
+        "appends_per_sec": stats["next_offset"] / elapsed,
+        "fsyncs_per_sec": stats["fsyncs"] / elapsed,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offer log append benchmark")
+    parser.add_argument("-w", "--writers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("-f", "--fsync", nargs="+", default=list(FSYNC_POLICIES), choices=FSYNC_POLICIES)
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--payload", type=int, default=200, help="Bytes per offer")
+    parser.add_argument("--batch", type=int, default=1, help="Offers per append call")
+    parser.add_argument("--dir", default=".", help="Where to create the log")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(policy, writers, args) for policy in args.fsync for writers in args.writers]
+
+    print(f"{'fsync':<10}{'writers':>8}{'appends/s':>12}{'fsyncs/s':>10}{'p50 us':>10}{'p99 us':>10}")
+    for row in results:
+        print(
+            f"{row['fsync']:<10}{row['writers']:>8}{row['appends_per_sec']:>12.0f}"
+            f"{row['fsyncs_per_sec']:>10.0f}{row['p50_us']:>10.0f}{row['p99_us']:>10.0f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
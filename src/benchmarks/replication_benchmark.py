@@ -0,0 +1,220 @@
+"""
+Measures how far replicas of a node's subscriptions lag behind it and how many
+bytes the replication costs. One node makes subscription changes at --rate changes
+a second, alternating subscribes and unsubscribes, and every replica runs in its
+own process and applies them as they arrive over its peer link. The lag of a change
+is the time from recording it to a replica having applied it.
+
+Afterwards a replica that joins late is brought up to date from a snapshot of
+--subscribers subscribers with --interests interests each, and the time and bytes
+that takes are reported too, with how many of the subscribers the replica has.
+With large interest sets the snapshot is split into more messages than
+REPLICATION_SNAPSHOT_CHUNK alone would give, so each fits in MAX_MESSAGE_SIZE.
+
+Usage:
+    python3 src/benchmarks/replication_benchmark.py --changes 10000 --rate 2000 --codec binary json
+    python3 src/benchmarks/replication_benchmark.py --changes 100 --subscribers 1000 --interests 30
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gossip_benchmark import percentile
+from constants.constants import ErrorCode, Type
+from modules.peer_links import PeerLinkManager
+from modules.subscription_replication import SubscriptionReplicator
+from utils import codec as wire_codec
+from utils import utils
+
+
+class CountingDecoder(utils.FrameDecoder):
+    """
+    Counts the bytes read from the link, frame headers included.
+    """
+
+    received = 0
+
+    def feed(self, data: bytes) -> list:
+        self.received += len(data)
+        return super().feed(data)
+
+
+def replica(sock, node_id: int, codec: str, expected: int, events):
+    """
+    Applies the changes another node replicates to it and reports when each
+    sequence number was applied, and the bytes received.
+    """
+    sys.stdout = open(os.devnull, "w")
+    replicator = SubscriptionReplicator(node_id, PeerLinkManager(node_id, "127.0.0.1"), list)
+    connection, _ = sock.accept()
+    decoder = CountingDecoder()
+    decoder.next_frame(connection)
+    utils.send_frame(
+        connection, utils.create_server_message(node_id, Type["ACK"].value, {"codec": codec})
+    )
+    applied = {}
+    while len(applied) < expected:
+        data = decoder.next_frame(connection)
+        if data is None or data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+            break
+        msg = utils.parse_message(data)
+        replicator.apply(msg)
+        now = time.time()
+        if msg["type"] == Type["SUBSCRIPTION_SNAPSHOT"].value:
+            if msg["last"]:
+                applied[msg["seq"]] = now
+        else:
+            applied.setdefault(msg["seq"], now)
+    replicas = replicator.get_stats()["replicas"]
+    events.put((node_id, {"applied": applied, "bytes": decoder.received, "replicas": replicas}))
+    events.close()
+    events.join_thread()
+    os._exit(0)
+
+
+def start_replicas(context, ids: list, codec: str, expected: int, events) -> list:
+    nodes, processes = [], []
+    for node_id in ids:
+        sock = utils.initialize_socket("127.0.0.1")
+        sock.listen(1)
+        process = context.Process(
+            target=replica, args=(sock, node_id, codec, expected, events), daemon=True
+        )
+        process.start()
+        processes.append(process)
+        nodes.append({"ip": "127.0.0.1", "port": sock.getsockname()[1], "id": node_id})
+        sock.close()
+    return nodes, processes
+
+
+def collect(events, count: int, timeout: float) -> dict:
+    results = {}
+    deadline = time.time() + timeout
+    while len(results) < count and time.time() < deadline:
+        try:
+            node_id, result = events.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        results[node_id] = result
+    return results
+
+
+def run(codec: str, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    events = context.Queue()
+    subscribers = {}
+
+    def snapshot():
+        return [(address, topics, {"codecs": ["json"]}) for address, topics in subscribers.items()]
+
+    links = PeerLinkManager(1, "127.0.0.1")
+    source = SubscriptionReplicator(1, links, snapshot)
+    nodes, processes = start_replicas(
+        context, list(range(2, 2 + args.replicas)), codec, args.changes, events
+    )
+    links.update_membership(nodes)
+
+    recorded = {}
+    interval = 1 / args.rate
+    started = time.monotonic()
+    for change in range(args.changes):
+        time.sleep(max(0, started + change * interval - time.monotonic()))
+        address = ("127.0.0.1", 20000 + change // 2)
+        topics = [f"type{change % 50}/offers", "food/#"]
+        if change % 2 == 0:
+            subscribers[address] = set(topics)
+            source.record("subscribe", address, topics, {"codecs": ["binary", "json"]})
+        else:
+            subscribers.pop(address, None)
+            source.record("unsubscribe", address, topics)
+        recorded[source.seq] = time.time()
+    results = collect(events, args.replicas, args.timeout)
+    for process in processes:
+        process.join(1)
+
+    lags = [
+        applied_at - recorded[seq]
+        for result in results.values()
+        for seq, applied_at in result["applied"].items()
+    ]
+    delta_bytes = [result["bytes"] for result in results.values()]
+
+    # A replica that joins late catches up from a snapshot.
+    for i in range(args.subscribers):
+        subscribers[("127.0.1.1", 30000 + i)] = {"food/#"} | {
+            f"type{(i + interest) % 50}/offers/district{interest}" for interest in range(args.interests - 1)
+        }
+    late, late_processes = start_replicas(context, [2 + args.replicas], codec, 1, events)
+    links.update_membership(nodes + late)
+    snapshot_started = time.time()
+    source.sync(late[0]["id"])
+    late_result = collect(events, 1, args.timeout).get(late[0]["id"])
+    for process in late_processes:
+        process.join(1)
+    links.close_all()
+
+    return {
+        "codec": codec,
+        "replicas": args.replicas,
+        "changes": args.changes,
+        "rate": args.rate,
+        "applied": len(lags),
+        "lag_p50_ms": percentile(lags, 50) * 1000,
+        "lag_p99_ms": percentile(lags, 99) * 1000,
+        "lag_max_ms": max(lags, default=0) * 1000,
+        "bytes_per_1k_changes_per_replica": (
+            sum(delta_bytes) / len(delta_bytes) / args.changes * 1000 if delta_bytes else 0
+        ),
+        "snapshot_subscribers": len(subscribers),
+        "snapshot_seconds": (
+            max(late_result["applied"].values()) - snapshot_started if late_result else None
+        ),
+        "snapshot_bytes": late_result["bytes"] if late_result else None,
+        "snapshot_replicated": (
+            late_result["replicas"].get(1, {}).get("subscribers") if late_result else None
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Subscription replication benchmark")
+    parser.add_argument("--changes", type=int, default=10000, help="Subscription changes to replicate")
+    parser.add_argument("--rate", type=float, default=2000, help="Changes per second")
+    parser.add_argument("--replicas", type=int, default=2, help="Nodes the changes are replicated to")
+    parser.add_argument("--subscribers", type=int, default=10000, help="Subscribers in the late snapshot")
+    parser.add_argument("--interests", type=int, default=2, help="Interests of each snapshot subscriber")
+    parser.add_argument("--codec", nargs="+", default=["binary", "json"], choices=sorted(wire_codec.CODECS))
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the replicas")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(codec, args) for codec in args.codec]
+
+    print(
+        f"{'codec':>7}{'applied':>9}{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}"
+        f"{'KB/1k chg':>11}{'snapshot s':>12}{'snapshot KB':>13}{'replicated':>12}"
+    )
+    for row in results:
+        snapshot_seconds = f"{row['snapshot_seconds']:.3f}" if row["snapshot_seconds"] is not None else "timeout"
+        snapshot_kb = f"{row['snapshot_bytes'] / 1024:.0f}" if row["snapshot_bytes"] is not None else "-"
+        print(
+            f"{row['codec']:>7}{row['applied']:>9}{row['lag_p50_ms']:>12.2f}{row['lag_p99_ms']:>12.2f}"
+            f"{row['lag_max_ms']:>12.2f}{row['bytes_per_1k_changes_per_replica'] / 1024:>11.1f}"
+            f"{snapshot_seconds:>12}{snapshot_kb:>13}"
+            f"{str(row['snapshot_replicated']) + '/' + str(row['snapshot_subscribers']):>12}"
+        )
+    print("KB/1k chg is per replica; applied counts changes over all replicas")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
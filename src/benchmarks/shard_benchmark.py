@@ -0,0 +1,209 @@
+"""
+Measures offer throughput when business types are sharded over 1, 3 and 9 server
+nodes. Every node runs in its own process with a PubSub and the subscribers of the
+business types it owns, which are served by a sink in a separate process. A
+publisher sends batches of offers over many business types straight to their
+owners, the way Publisher does once it has the shard ring.
+
+Besides wall-clock throughput, the capacity is the number of offers divided by the
+CPU time of the busiest node: the throughput the cluster would reach if every node
+had a core of its own. On a machine with fewer cores than nodes only the capacity
+can scale. The share is the fraction of offers the busiest node handled; 1/N is a
+perfect spread.
+
+Usage:
+    python3 src/benchmarks/shard_benchmark.py -n 1 3 9 --offers 50000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.delivery_benchmark import raise_fd_limit, sink, subscriber_addresses
+from constants.constants import DEFAULT_ID, OFFER_LOG_DIR_ENV, ErrorCode, Type
+from modules import pub_sub_handler
+from modules.peer_links import PeerLink
+from modules.pub_sub_handler import PubSub
+from modules.shard_ring import ShardRing
+from utils import codec as wire_codec
+from utils import utils
+
+
+def node(sock, entry: dict, nodes: list, subscribers: dict, directory: str, events):
+    """
+    Subscribes the subscribers of the business types this node owns, then
+    publishes the offers sent to it until it gets a PING, and reports how many it
+    published and the CPU time that took.
+    """
+    os.chdir(directory)
+    os.environ[OFFER_LOG_DIR_ENV] = os.path.join(directory, "offer_log")
+    sys.stdout = open(os.devnull, "w")
+    raise_fd_limit()
+    # No node is leader, so every node logs the offers of its shards itself.
+    pub_sub = PubSub(DEFAULT_ID, entry["id"], entry["ip"], nodes, entry["ip"], 0)
+    for business_type, addresses in subscribers.items():
+        if pub_sub.shards.owner(business_type)["id"] == entry["id"]:
+            for address in addresses:
+                pub_sub_handler.subscriptions.subscribe(address, [business_type])
+    events.put(("ready", entry["id"], None))
+
+    connection, _ = sock.accept()
+    decoder = utils.FrameDecoder()
+    hello = utils.parse_message(decoder.next_frame(connection))
+    codec = wire_codec.negotiate(hello.get("codecs"))
+    utils.send_frame(
+        connection, utils.create_server_message(entry["id"], Type["ACK"].value, {"codec": codec})
+    )
+    published = 0
+    cpu = time.process_time()
+    while True:
+        data = decoder.next_frame(connection)
+        if data is None or data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+            break
+        data = utils.parse_message(data)
+        if data["type"] == Type["PING"].value:
+            break
+        pub_sub.route_offers(data["offers"])
+        published += len(data["offers"])
+    events.put(("done", entry["id"], {"published": published, "cpu": time.process_time() - cpu}))
+    pub_sub.close_offer_log()
+    events.close()
+    events.join_thread()
+    os._exit(0)
+
+
+def run(count: int, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    sockets = []
+    for _ in range(count):
+        sock = utils.initialize_socket("127.0.0.1")
+        sock.listen(8)
+        sockets.append(sock)
+    nodes = [
+        {"ip": "127.0.0.1", "port": sock.getsockname()[1], "id": 100 + i}
+        for i, sock in enumerate(sockets)
+    ]
+    business_types = [f"type{i}/offers" for i in range(args.types)]
+    addresses = subscriber_addresses(args.types * args.subscribers, args.port)
+    subscribers = {
+        business_type: addresses[i * args.subscribers:(i + 1) * args.subscribers]
+        for i, business_type in enumerate(business_types)
+    }
+    directory = tempfile.mkdtemp(prefix="shard_benchmark_", dir=args.dir)
+    events = context.Queue()
+    processes = []
+    for sock, entry in zip(sockets, nodes):
+        node_directory = os.path.join(directory, str(entry["id"]))
+        os.mkdir(node_directory)
+        process = context.Process(
+            target=node,
+            args=(sock, entry, nodes, subscribers, node_directory, events),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+    for sock in sockets:
+        sock.close()
+
+    def collect(kind: str) -> dict:
+        results = {}
+        deadline = time.time() + args.timeout
+        while len(results) < count and time.time() < deadline:
+            try:
+                event_kind, node_id, value = events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if event_kind == kind:
+                results[node_id] = value
+        return results
+
+    collect("ready")
+    ring = ShardRing(nodes)
+    links = {entry["id"]: PeerLink(DEFAULT_ID, "127.0.0.1", entry) for entry in nodes}
+    offer = "x" * args.offer_size
+    started = time.time()
+    for first in range(0, args.offers, args.batch):
+        by_owner = {}
+        for i in range(first, min(first + args.batch, args.offers)):
+            business_type = business_types[i % len(business_types)]
+            entry = {"businessType": business_type, "offer": offer}
+            by_owner.setdefault(ring.owner(business_type)["id"], []).append(entry)
+        for node_id, entries in by_owner.items():
+            msg = wire_codec.EncodedMessage({"type": Type["SHARD_FORWARD"].value, "offers": entries})
+            # Waits rather than drops when a node falls behind.
+            links[node_id].queue.put(msg)
+    for link in links.values():
+        link.queue.put(utils.build_message(DEFAULT_ID, Type["PING"].value, 0, "127.0.0.1"))
+        link.close()
+    done = collect("done")
+    elapsed = time.time() - started
+
+    for process in processes:
+        process.join(1)
+        if process.is_alive():
+            process.kill()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    published = sum(result["published"] for result in done.values())
+    busiest = max(done.values(), key=lambda result: result["cpu"], default=None)
+    return {
+        "nodes": count,
+        "offers": args.offers,
+        "published": published,
+        "seconds": elapsed,
+        "offers_per_sec": published / elapsed if elapsed else 0,
+        "capacity_per_sec": published / busiest["cpu"] if busiest and busiest["cpu"] else 0,
+        "busiest_share": max(result["published"] for result in done.values()) / published if published else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded offer throughput benchmark")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[1, 3, 9], help="Server nodes")
+    parser.add_argument("--offers", type=int, default=50000, help="Offers to publish")
+    parser.add_argument("--batch", type=int, default=100, help="Offers per publisher batch")
+    parser.add_argument("--types", type=int, default=90, help="Business types")
+    parser.add_argument("--subscribers", type=int, default=5, help="Subscribers per business type")
+    parser.add_argument("--offer-size", type=int, default=200)
+    parser.add_argument("--port", type=int, default=18600, help="Port of the subscriber sink")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for the nodes")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the nodes keep their offer logs")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    ready = multiprocessing.Event()
+    sink_process = multiprocessing.Process(target=sink, args=(args.port, ready), daemon=True)
+    sink_process.start()
+    ready.wait(5)
+
+    results = [run(count, args) for count in args.nodes]
+    sink_process.terminate()
+
+    base = results[0]["capacity_per_sec"] / results[0]["nodes"] if results else 0
+    print(
+        f"{'nodes':>6}{'published':>11}{'offers/s':>11}{'capacity/s':>12}"
+        f"{'scaling':>9}{'busiest share':>15}"
+    )
+    for row in results:
+        scaling = row["capacity_per_sec"] / base if base else 0
+        print(
+            f"{row['nodes']:>6}{row['published']:>11}{row['offers_per_sec']:>11.0f}"
+            f"{row['capacity_per_sec']:>12.0f}{scaling:>9.2f}{row['busiest_share']:>15.2f}"
+        )
+    print("scaling is the capacity relative to a single node; linear is the node count")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
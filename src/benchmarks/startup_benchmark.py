@@ -0,0 +1,175 @@
+"""
+Measures how long a cluster takes from starting its processes to serving: the
+register and N server nodes are started at the same time, each in its own process,
+and the leader's client port is asked for the shard ring until it answers, and
+then until the ring has all N nodes. With the register's old fixed join window
+neither could happen before it had been idle for 10 seconds.
+
+Once the cluster serves, one more node is started and then stopped, and the time
+until the leader's ring has it, and no longer has it, is reported as well.
+
+The processes are forked, so the times do not include interpreter startup.
+
+Usage:
+    python3 src/benchmarks/startup_benchmark.py -n 1 3 9
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants.constants import OFFER_LOG_DIR_ENV, ErrorCode, Type
+from modules.registration import Register
+from modules.server_node import ServerNode
+from utils import codec as wire_codec
+from utils import utils
+
+
+def register(config_path: str, directory: str):
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, "w")
+    Register(False, config_path).receive_connection_request()
+
+
+def server_node(config_path: str, directory: str, leader_port: int):
+    os.chdir(directory)
+    os.environ[OFFER_LOG_DIR_ENV] = os.path.join(directory, "offer_log")
+    sys.stdout = open(os.devnull, "w")
+    node = ServerNode(False, True, config_path, False)
+    node.leader_port = leader_port
+    node.start_server()
+
+
+def ring_size(leader_port: int):
+    """
+    Returns:
+        int: The number of nodes on the leader's shard ring, or None if no leader
+        serves clients yet.
+    """
+    request = wire_codec.encode({"type": Type["SHARD_LOOKUP"].value})
+    try:
+        with socket.create_connection(("127.0.0.1", leader_port), timeout=1) as sock:
+            utils.send_frame(sock, request)
+            reply = utils.recv_frame(sock)
+    except OSError:
+        return None
+    if not reply or reply is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+        return None
+    return len(utils.parse_message(reply).get("nodes") or [])
+
+
+def register_listening(port: int) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+
+def wait_for(condition, leader_port: int, started: float, timeout: float):
+    """
+    Polls the leader until condition holds for the size of its ring.
+
+    Returns:
+        float: Seconds since started, or None on timeout.
+    """
+    while time.time() - started < timeout:
+        size = ring_size(leader_port)
+        if condition(size):
+            return time.time() - started
+        time.sleep(0.005)
+    return None
+
+
+def run(count: int, args) -> dict:
+    context = multiprocessing.get_context("fork")
+    directory = tempfile.mkdtemp(prefix="startup_benchmark_", dir=args.dir)
+    config_path = os.path.join(directory, "config.json")
+    with open(config_path, "w") as config_file:
+        json.dump(
+            {
+                "register": {"ip": "127.0.0.1", "port": args.register_port},
+                "node": {"ip": "127.0.0.1"},
+                "leader": {"ip": "127.0.0.1", "port": args.leader_port},
+            },
+            config_file,
+        )
+
+    def start(target, *extra):
+        process = context.Process(target=target, args=(config_path, directory, *extra), daemon=True)
+        process.start()
+        return process
+
+    started = time.time()
+    processes = [start(register)]
+    # Nodes that find the register not listening yet exit, as they would on the
+    # command line, so they are started once it is.
+    while not register_listening(args.register_port):
+        time.sleep(0.001)
+    processes += [start(server_node, args.leader_port) for _ in range(count)]
+
+    serving = wait_for(lambda size: size is not None, args.leader_port, started, args.timeout)
+    complete = wait_for(lambda size: size == count, args.leader_port, started, args.timeout)
+
+    result = {
+        "nodes": count,
+        "seconds_to_serving": serving,
+        "seconds_to_all_nodes": complete,
+    }
+    if complete is not None:
+        join_started = time.time()
+        late = start(server_node, args.leader_port)
+        result["join_seconds"] = wait_for(
+            lambda size: size == count + 1, args.leader_port, join_started, args.timeout
+        )
+        leave_started = time.time()
+        late.kill()
+        result["leave_seconds"] = wait_for(
+            lambda size: size == count, args.leader_port, leave_started, args.timeout
+        )
+        processes.append(late)
+
+    for process in processes:
+        process.kill()
+        process.join(1)
+    shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster startup benchmark")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[1, 3, 9], help="Server nodes")
+    parser.add_argument("--register-port", type=int, default=18700)
+    parser.add_argument("--leader-port", type=int, default=18790, help="The leader's client port")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the cluster")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the nodes keep their offer logs")
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(count, args) for count in args.nodes]
+
+    def seconds(value):
+        return f"{value:.3f}" if value is not None else "timeout"
+
+    print(f"{'nodes':>6}{'serving s':>11}{'all nodes s':>13}{'join s':>9}{'leave s':>9}")
+    for row in results:
+        print(
+            f"{row['nodes']:>6}{seconds(row['seconds_to_serving']):>11}"
+            f"{seconds(row['seconds_to_all_nodes']):>13}{seconds(row.get('join_seconds')):>9}"
+            f"{seconds(row.get('leave_seconds')):>9}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
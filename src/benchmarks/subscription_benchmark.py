@@ -0,0 +1,157 @@
+"""
+Compares the SubscriptionIndex with the previous dict of lists on a large
+subscription table (by default 100k subscribers with 10 interests each, i.e. 1M
+subscriptions across 10k business types): building the table, subscribers
+registering again, reading the subscribers of a business type for fan-out and
+removing subscribers.
+
+Usage:
+    python3 src/benchmarks/subscription_benchmark.py --subscribers 100000 --types 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.subscription_index import SubscriptionIndex
+
+
+def generate(args) -> list:
+    rng = random.Random(args.seed)
+    types = [f"type-{i}" for i in range(args.types)]
+    return [
+        (("10.{}.{}.{}".format(i >> 16 & 255, i >> 8 & 255, i & 255), 8000), rng.sample(types, args.interests))
+        for i in range(args.subscribers)
+    ]
+
+
+def legacy_subscribe(table: dict, address: tuple, interests: list):
+    subscriber_info = {"ip": address[0], "port": address[1]}
+    for interest in interests:
+        if interest not in table:
+            table[interest] = []
+        table[interest].append(subscriber_info)
+
+
+def legacy_remove(table: dict, address: tuple):
+    subscriber_info = {"ip": address[0], "port": address[1]}
+    for subscribers in table.values():
+        while subscriber_info in subscribers:
+            subscribers.remove(subscriber_info)
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Subscription table benchmark")
+    parser.add_argument("--subscribers", type=int, default=100000)
+    parser.add_argument("--types", type=int, default=10000)
+    parser.add_argument("--interests", type=int, default=10, help="Interests per subscriber")
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--removals", type=int, default=10000)
+    parser.add_argument("--legacy-removals", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    subscribers = generate(args)
+    rng = random.Random(args.seed)
+    lookups = [f"type-{rng.randrange(args.types)}" for _ in range(args.lookups)]
+    removed = rng.sample(subscribers, args.removals)
+    count = len(subscribers) * args.interests
+    results = {"subscribers": len(subscribers), "business_types": args.types, "subscriptions": count}
+
+    index = SubscriptionIndex()
+    legacy = {}
+
+    def index_build():
+        for address, interests in subscribers:
+            index.subscribe(address, interests)
+
+    def legacy_build():
+        for address, interests in subscribers:
+            legacy_subscribe(legacy, address, interests)
+
+    build = timed(index_build)
+    legacy_time = timed(legacy_build)
+    results["subscribe_ns"] = {"index": build / count * 1e9, "legacy": legacy_time / count * 1e9}
+
+    # Every subscriber registers a second time with the same interests.
+    timed(index_build)
+    timed(legacy_build)
+    results["after_reregistration"] = {
+        "index": index.get_stats()["subscriptions"],
+        "legacy": sum(len(entries) for entries in legacy.values()),
+    }
+
+    def index_lookups(cached: bool):
+        if not cached:
+            index.snapshots.clear()
+        for topic in lookups:
+            index.snapshot(topic)
+
+    def legacy_lookups():
+        for topic in lookups:
+            [(info["ip"], info["port"]) for info in legacy.get(topic, [])]
+
+    results["snapshot_us"] = {
+        "index_cold": timed(lambda: index_lookups(False)) / len(lookups) * 1e6,
+        "index_cached": timed(lambda: index_lookups(True)) / len(lookups) * 1e6,
+        "legacy": timed(legacy_lookups) / len(lookups) * 1e6,
+    }
+
+    def index_removals():
+        for address, _ in removed:
+            index.unsubscribe(address)
+
+    def legacy_removals():
+        for address, _ in removed[: args.legacy_removals]:
+            legacy_remove(legacy, address)
+
+    results["remove_subscriber_us"] = {
+        "index": timed(index_removals) / len(removed) * 1e6,
+        "legacy": timed(legacy_removals) / args.legacy_removals * 1e6,
+    }
+    results["index_stats"] = index.get_stats()
+
+    print(
+        f"{results['subscriptions']} subscriptions, {results['subscribers']} subscribers, "
+        f"{results['business_types']} business types"
+    )
+    print(f"{'':<34}{'index':>14}{'dict of lists':>16}")
+    rows = [
+        ("subscribe (ns/subscription)", results["subscribe_ns"]["index"], results["subscribe_ns"]["legacy"]),
+        (
+            "subscriptions after re-register",
+            results["after_reregistration"]["index"],
+            results["after_reregistration"]["legacy"],
+        ),
+        ("snapshot, cold (us)", results["snapshot_us"]["index_cold"], results["snapshot_us"]["legacy"]),
+        ("snapshot, cached (us)", results["snapshot_us"]["index_cached"], results["snapshot_us"]["legacy"]),
+        (
+            "remove subscriber (us)",
+            results["remove_subscriber_us"]["index"],
+            results["remove_subscriber_us"]["legacy"],
+        ),
+    ]
+    for label, new, old in rows:
+        if isinstance(new, int):
+            print(f"{label:<34}{new:>14}{old:>16}")
+        else:
+            print(f"{label:<34}{new:>14.1f}{old:>16.1f}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measures how long it takes to resolve the subscribers of a published topic such as
+food/pizza/downtown when subscriptions use wildcard patterns, for the TopicTrie and
+for checking every pattern in turn, as the number of patterns grows. Also reports
+the cost of a cached SubscriptionIndex snapshot.
+
+Usage:
+    python3 src/benchmarks/topic_benchmark.py -n 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.subscription_index import SubscriptionIndex
+from modules.topic_trie import TopicTrie
+
+
+def random_pattern(rng: random.Random, args) -> str:
+    levels = [f"c{rng.randrange(args.fanout)}" for _ in range(rng.randint(1, args.depth))]
+    roll = rng.random()
+    if roll < 0.1:
+        levels[rng.randrange(len(levels))] = "*"
+    elif roll < 0.2:
+        levels[-1] = "#"
+    return "/".join(levels)
+
+
+def random_topic(rng: random.Random, args) -> str:
+    return "/".join(f"c{rng.randrange(args.fanout)}" for _ in range(args.depth))
+
+
+def per_op_us(func, items: list) -> float:
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def run(count: int, args) -> dict:
+    rng = random.Random(args.seed)
+    patterns = list({random_pattern(rng, args) for _ in range(count)})
+    topics = [random_topic(rng, args) for _ in range(args.lookups)]
+
+    trie = TopicTrie()
+    index = SubscriptionIndex()
+    for i, pattern in enumerate(patterns):
+        trie.insert(pattern)
+        index.subscribe((f"10.0.{i // 250 % 250}.{i % 250}", 9000 + i // 62500), [pattern])
+
+    def linear(topic):
+        return [pattern for pattern in patterns if TopicTrie.matches(pattern, topic)]
+
+    # The linear scan is slow, so it only resolves a sample of the topics.
+    sample = topics[: max(1, min(len(topics), 2000000 // len(patterns)))]
+    for topic in sample[:100]:
+        assert sorted(trie.match(topic)) == sorted(linear(topic))
+
+    index_topics = topics[: args.lookups]
+    return {
+        "patterns": len(patterns),
+        "trie_us": per_op_us(trie.match, topics),
+        "linear_us": per_op_us(linear, sample),
+        "snapshot_cold_us": per_op_us(index.snapshot, index_topics),
+        "snapshot_cached_us": per_op_us(index.snapshot, index_topics),
+        "matched_avg": sum(len(trie.match(topic)) for topic in sample) / len(sample),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Topic pattern matching benchmark")
+    parser.add_argument("-n", "--patterns", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--depth", type=int, default=3, help="Levels in a published topic")
+    parser.add_argument("--fanout", type=int, default=100, help="Distinct names per level")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(count, args) for count in args.patterns]
+
+    print(
+        f"{'patterns':>9}{'matched':>9}{'trie us':>10}{'linear us':>12}"
+        f"{'snapshot us':>13}{'cached us':>11}"
+    )
+    for row in results:
+        print(
+            f"{row['patterns']:>9}{row['matched_avg']:>9.1f}{row['trie_us']:>10.1f}"
+            f"{row['linear_us']:>12.1f}{row['snapshot_cold_us']:>13.1f}{row['snapshot_cached_us']:>11.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares the ClusterTopology with the previous list of node dicts: finding a node
+by ID and by address, and finding the nodes with a higher ID the way an election
+does, for clusters of 10 to 1000 nodes.
+
+Usage:
+    python3 src/benchmarks/topology_benchmark.py -n 10 100 1000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.cluster_topology import ClusterTopology
+
+
+def legacy_index_by_id(node_id: int, nodes: list) -> int:
+    i = 0
+    for j in nodes:
+        if j.get("id") == node_id:
+            return i
+        i += 1
+    return 0
+
+
+def legacy_id_by_port(port: int, nodes: list) -> int:
+    for node in nodes:
+        if node.get("port") == port:
+            return node.get("id")
+    return 0
+
+
+def per_op_us(func, items: list) -> float:
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def run(count: int, args) -> dict:
+    rng = random.Random(args.seed)
+    ids = rng.sample(range(1, 100000), count)
+    nodes = sorted(
+        (
+            {"id": node_id, "ip": "127.0.0.1", "port": 20000 + i, "type": "generic", "interests": []}
+            for i, node_id in enumerate(ids)
+        ),
+        key=lambda node: node["id"],
+    )
+    topology = ClusterTopology(nodes)
+    lookups = [rng.choice(nodes) for _ in range(args.lookups)]
+
+    def legacy_higher(node):
+        return nodes[legacy_index_by_id(node["id"], nodes) + 1:]
+
+    return {
+        "nodes": count,
+        "by_id_us": per_op_us(lambda node: topology.get(node["id"]), lookups),
+        "legacy_by_id_us": per_op_us(lambda node: legacy_index_by_id(node["id"], nodes), lookups),
+        "by_address_us": per_op_us(lambda node: topology.find(node["ip"], node["port"]), lookups),
+        "legacy_by_address_us": per_op_us(lambda node: legacy_id_by_port(node["port"], nodes), lookups),
+        "higher_us": per_op_us(lambda node: topology.higher_than(node["id"]), lookups),
+        "legacy_higher_us": per_op_us(legacy_higher, lookups),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster topology lookup benchmark")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Writes the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(count, args) for count in args.nodes]
+
+    print(
+        f"{'nodes':>6}{'by id us':>10}{'legacy':>9}{'by addr us':>12}{'legacy':>9}"
+        f"{'higher us':>11}{'legacy':>9}"
+    )
+    for row in results:
+        print(
+            f"{row['nodes']:>6}{row['by_id_us']:>10.2f}{row['legacy_by_id_us']:>9.2f}"
+            f"{row['by_address_us']:>12.2f}{row['legacy_by_address_us']:>9.2f}"
+            f"{row['higher_us']:>11.2f}{row['legacy_higher_us']:>9.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
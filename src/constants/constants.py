@@ -1,3 +1,4 @@
+import os
 from enum import Enum, auto
 
 HEARTBEAT_TIME = 5
@@ -9,10 +10,137 @@ BUFF_SIZE = 1024
 DEFAULT_ID = -1
 
 REGISTER = 4
-SOCKET_TIMEOUT = 10
+# Seconds the register waits on a node that does not read its topology updates
+REGISTER_PUSH_TIMEOUT = 2
+
+# Client ingest server on the leader
+INGEST_WORKERS = 4
+INGEST_BACKLOG = 1024
+
+# Leader to subscriber connection pool
+POOL_IDLE_TIMEOUT = 300
+POOL_CONNECT_TIMEOUT = 2
+
+# Connect/send timeout for one offer to one subscriber
+FANOUT_SEND_TIMEOUT = 1
+
+# Every subscriber has its own queue of at most DELIVERY_QUEUE_SIZE offers, drained
+# by DELIVERY_WORKERS threads DELIVERY_DRAIN_BATCH offers at a time. A subscriber that
+# does not read is retried every DELIVERY_RETRY_INTERVAL, and what happens to offers
+# that find its queue full is set by its policy, DELIVERY_POLICY by default. A send
+# that fails is retried with a backoff doubling from DELIVERY_RETRY_INTERVAL up to
+# DELIVERY_MAX_RETRY_INTERVAL, and the subscriber is disconnected after
+# DELIVERY_MAX_FAILURES failures in a row. Retries are sent by DELIVERY_RETRY_WORKERS
+# threads of their own
+DELIVERY_POLICIES = ("drop-oldest", "drop-newest", "coalesce", "disconnect")
+DELIVERY_POLICY = "drop-oldest"
+DELIVERY_QUEUE_SIZE = 1000
+DELIVERY_WORKERS = 16
+DELIVERY_DRAIN_BATCH = 64
+DELIVERY_RETRY_INTERVAL = 0.05
+DELIVERY_MAX_RETRY_INTERVAL = 5
+DELIVERY_MAX_FAILURES = 8
+DELIVERY_RETRY_WORKERS = 8
+
+# Long-lived links between server nodes
+PEER_QUEUE_SIZE = 10000
+PEER_WRITE_BATCH = 256
+PEER_CONNECT_TIMEOUT = 2
+PEER_RECONNECT_DELAY = 0.5
+
+# Messages to the node socket that can block are handled by DISPATCH_WORKERS
+# threads, with at most DISPATCH_QUEUE_SIZE waiting or running
+DISPATCH_WORKERS = 8
+DISPATCH_QUEUE_SIZE = 1024
+DISPATCH_REPLY_TIMEOUT = 1
+
+# Bully election messages, sent to all peers at the same time
+ELECTION_CONNECT_TIMEOUT = 1
+ELECTION_FANOUT_WORKERS = 32
+# Peers not reached by then count as down
+ELECTION_FANOUT_DEADLINE = 2
+
+# SWIM gossip membership, over UDP on the same port number as the node. Every
+# GOSSIP_PERIOD each node pings one member and waits for its ACK as long as the
+# member's phi accrual failure detector allows, between GOSSIP_PING_TIMEOUT and
+# GOSSIP_MAX_PING_TIMEOUT; then GOSSIP_INDIRECT_PROBES other members ping it on its
+# behalf
+GOSSIP_PERIOD = 0.1
+GOSSIP_PING_TIMEOUT = 0.04
+GOSSIP_MAX_PING_TIMEOUT = 0.5
+GOSSIP_INDIRECT_PROBES = 3
+# A suspected member is declared dead after GOSSIP_SUSPICION_MULT * log10(n) periods
+# (at least GOSSIP_SUSPICION_MULT) unless it refutes the suspicion, and every
+# membership update is piggybacked on GOSSIP_RETRANSMIT_MULT * log10(n + 1) messages
+GOSSIP_SUSPICION_MULT = 4
+GOSSIP_RETRANSMIT_MULT = 4
+GOSSIP_MAX_PIGGYBACK = 16
+# Dead members are forgotten this many seconds after they died, once their death is
+# no longer being gossiped
+GOSSIP_DEAD_RETENTION = 60
+GOSSIP_MAX_DATAGRAM = 65507
+
+# Phi accrual failure detector, fed with the round trips of the ACKs to a member's
+# gossip pings. A ping is late once phi exceeds PHI_THRESHOLD. PHI_FIRST_ESTIMATE is
+# the round trip assumed before any ACK arrived
+PHI_THRESHOLD = 8
+PHI_WINDOW = 100
+PHI_MIN_STD_DEVIATION = 0.005
+PHI_ACCEPTABLE_PAUSE = 0
+PHI_FIRST_ESTIMATE = 0.02
 MAX = 1000
 MIN = 1
 
+# Business types are sharded over the server nodes by the first level of the topic,
+# on a consistent-hash ring with SHARD_VNODES points per node
+SHARD_VNODES = 64
+# Publishers ask the leader for the ring again after this many seconds
+SHARD_REFRESH_INTERVAL = 5
+
+# Subscription changes are replicated to every other node as numbered deltas. The
+# last REPLICATION_DELTA_RETAIN are kept for replicas that missed some; a replica
+# further behind gets a snapshot, at most REPLICATION_SNAPSHOT_CHUNK subscribers per
+# message, fewer if they would not fit in MAX_MESSAGE_SIZE
+REPLICATION_DELTA_RETAIN = 1024
+REPLICATION_SNAPSHOT_CHUNK = 100
+REPLICATION_SYNC_RETRY = 1
+
+# Business type topics such as food/pizza/downtown; * matches one level, # the rest
+TOPIC_SEPARATOR = "/"
+TOPIC_SINGLE_LEVEL = "*"
+TOPIC_MULTI_LEVEL = "#"
+# Number of published topics whose resolved subscribers are cached
+SNAPSHOT_CACHE_SIZE = 4096
+
+# Offers near a subscriber: grid levels for the geospatial index, by cell size in km
+GEO_CELL_SIZES_KM = tuple(0.25 * 2 ** level for level in range(13))
+EARTH_RADIUS_KM = 6371.0
+
+# Offer log on the leader. OFFER_LOG_FSYNC is one of "always" (fsync every append),
+# "batch" (appenders wait for a shared fsync), "interval" (fsync every
+# OFFER_LOG_FSYNC_INTERVAL seconds) or "never" (left to the OS). The log is kept in
+# src/offer_log, wherever the node is started from, unless the environment variable
+# named by OFFER_LOG_DIR_ENV gives another directory
+OFFER_LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "offer_log")
+OFFER_LOG_DIR_ENV = "LBN_OFFER_LOG_DIR"
+OFFER_LOG_SEGMENT_BYTES = 64 * 1024 * 1024
+OFFER_LOG_INDEX_INTERVAL = 4096
+OFFER_LOG_FSYNC = "batch"
+OFFER_LOG_FSYNC_INTERVAL = 1
+
+# Subscriber catch-up from the offer log: history is sent in batches of at most
+# CATCH_UP_BATCH offers and CATCH_UP_MAX_BYTES bytes by CATCH_UP_WORKERS threads
+CATCH_UP_WORKERS = 2
+CATCH_UP_BATCH = 500
+CATCH_UP_MAX_BYTES = 32 * 1024
+
+# Metrics are served in the Prometheus text format on METRICS_HOST, on the port given
+# to the runner. Latency histograms count observations in these buckets, in seconds
+METRICS_HOST = "127.0.0.1"
+METRICS_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
 
 class Type(Enum):
     ELECTION = 0
@@ -28,10 +156,36 @@ class Type(Enum):
     UPDATE_BUSINESS_TYPE = 10
     PUBLISH_OFFER = auto()
     UPDATE_INTERESTS = auto()
+    PEER_LINK = auto()
+    PUBLISH_BATCH = auto()
+    CATCH_UP = auto()
+    GOSSIP_PING = auto()
+    GOSSIP_PING_REQ = auto()
+    GOSSIP_ACK = auto()
+    SHARD_LOOKUP = auto()
+    SHARD_FORWARD = auto()
+    SUBSCRIPTION_DELTA = auto()
+    SUBSCRIPTION_SNAPSHOT = auto()
+    SUBSCRIPTION_SYNC = auto()
+    TOPOLOGY_UPDATE = auto()
+
+
+# Member states in the gossip membership view
+class MemberStatus(Enum):
+    ALIVE = 0
+    SUSPECT = 1
+    DEAD = 2
 
 # New default configurations
 DEFAULT_BUSINESS_TYPE = "General"
-MAX_MESSAGE_SIZE = 4096
+MAX_MESSAGE_SIZE = 64 * 1024
+
+# Publisher batching: a batch is sent when it is full or BATCH_WINDOW seconds old
+BATCH_WINDOW = 0.05
+BATCH_MAX_OFFERS = 500
+BATCH_MAX_BYTES = 32 * 1024
+# Offers a publisher holds for the leader while their shard owner is unreachable
+REROUTE_MAX_OFFERS = 10000
 
 # New error codes
 class ErrorCode(Enum):
@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+
+from constants.constants import CATCH_UP_BATCH, CATCH_UP_MAX_BYTES, CATCH_UP_WORKERS, Type
+from utils import codec as wire_codec
+
+
+class CatchUpJob:
+    def __init__(
+        self,
+        address: tuple,
+        offsets,
+        live_from: int,
+        accept=None,
+        log: str = None,
+        node: int = None,
+        owners: list = None,
+    ):
+        """
+        The offers one subscriber missed on one node.
+
+        Args:
+            address (tuple): The (ip, port) of the subscriber.
+            offsets (iterable): Offer log offsets to send, in increasing order.
+            live_from (int): The first offset the subscriber gets by live delivery.
+            accept (callable): Called with each offer; offers it rejects are skipped.
+            log (str): The name of the offer log the offsets are in.
+            node (int): The ID of the node sending the offers.
+            owners (list): The IDs of every node that sends the subscriber a
+                catch-up, so it knows when all of them are done.
+        """
+        self.address = address
+        self.offsets = offsets
+        self.live_from = live_from
+        self.accept = accept
+        self.log = log
+        self.node = node
+        self.owners = owners or ([node] if node is not None else [])
+        self.cancelled = Event()
+        self.sent = 0
+        self.batches = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+
+class CatchUpStreamer:
+    def __init__(self, pool, workers: int = CATCH_UP_WORKERS):
+        """
+        Sends subscribers the offers they missed, read from the offer log.
+
+        Jobs run on their own small thread pool and send through the subscriber
+        connection pool one bounded batch at a time, so a long catch-up only holds a
+        subscriber's connection for one batch at a time and never occupies the
+        fan-out workers that deliver live offers.
+
+        Args:
+            pool (SubscriberConnectionPool): Connections to the subscribers.
+            workers (int): The number of catch-ups that run at the same time.
+        """
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="catch-up")
+        self.jobs = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def merge_offsets(streams: list):
+        """
+        Merges sorted offset streams, e.g. one per matching business type, into one
+        sorted stream without duplicates.
+        """
+        return (offset for offset, _ in itertools.groupby(heapq.merge(*streams)))
+
+    def start(self, offer_log, job: CatchUpJob):
+        """
+        Starts a catch-up, cancelling the subscriber's previous one if it is still
+        running.
+
+        Returns:
+            Future: Resolves to the job once it has finished.
+        """
+        with self.lock:
+            previous = self.jobs.get(job.address)
+            if previous is not None:
+                previous.cancelled.set()
+            self.jobs[job.address] = job
+        return self.executor.submit(self.run, offer_log, job)
+
+    def run(self, offer_log, job: CatchUpJob) -> CatchUpJob:
+        batch = []
+        batch_bytes = 0
+        try:
+            while not job.cancelled.is_set():
+                chunk = list(itertools.islice(job.offsets, CATCH_UP_BATCH))
+                if not chunk:
+                    break
+                for offset, timestamp, payload in offer_log.read_offsets(chunk):
+                    try:
+                        entry = wire_codec.decode(payload)
+                    except wire_codec.CodecError:
+                        continue
+                    if job.accept is not None and not job.accept(entry):
+                        continue
+                    entry["offset"] = offset
+                    entry["timestamp"] = timestamp
+                    size = len(payload) + 40
+                    if batch and (
+                        len(batch) >= CATCH_UP_BATCH or batch_bytes + size > CATCH_UP_MAX_BYTES
+                    ):
+                        self.send(job, batch, False)
+                        batch, batch_bytes = [], 0
+                    batch.append(entry)
+                    batch_bytes += size
+            if not job.cancelled.is_set():
+                self.send(job, batch, True)
+        except OSError as e:
+            print(f"Catch-up for subscriber {job.address} stopped: {e}")
+        finally:
+            job.elapsed = time.monotonic() - job.started
+            with self.lock:
+                if self.jobs.get(job.address) is job:
+                    del self.jobs[job.address]
+        print(
+            f"Catch-up for subscriber {job.address}: {job.sent} offers in {job.batches} "
+            f"batches, {job.elapsed * 1000:.1f} ms"
+        )
+        return job
+
+    def send(self, job: CatchUpJob, offers: list, done: bool):
+        msg = {
+            "type": Type["CATCH_UP"].value,
+            "offers": offers,
+            "done": done,
+            "live_from": job.live_from,
+            "log": job.log,
+            "node": job.node,
+            "owners": job.owners,
+        }
+        self.pool.send(job.address, wire_codec.EncodedMessage(msg))
+        job.sent += len(offers)
+        job.batches += 1
+
+    def active(self) -> int:
+        with self.lock:
+            return len(self.jobs)
+
+    def shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancelled.set()
+        self.executor.shutdown(wait=False)
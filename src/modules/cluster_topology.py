@@ -0,0 +1,157 @@
+from bisect import bisect_right, insort
+from threading import Lock
+
+
+class NodeRecord:
+    __slots__ = ("id", "ip", "port", "type", "interests")
+
+    def __init__(self, node_id: int, ip: str, port: int, node_type: str = "generic", interests=()):
+        """
+        One server node in the cluster topology.
+
+        Args:
+            node_id (int): The ID of the node.
+            ip (str): The IP address of the node.
+            port (int): The port of the node.
+            node_type (str): The node type it registered with.
+            interests (list): The business types it registered with.
+        """
+        self.id = node_id
+        self.ip = ip
+        self.port = port
+        self.type = node_type
+        self.interests = list(interests)
+
+    @property
+    def address(self) -> tuple:
+        return (self.ip, self.port)
+
+    def as_node(self) -> dict:
+        return {
+            "id": self.id,
+            "ip": self.ip,
+            "port": self.port,
+            "type": self.type,
+            "interests": self.interests,
+        }
+
+
+class ClusterTopology:
+    def __init__(self, nodes=()):
+        """
+        The server nodes this node knows of, indexed by ID and by address, with the
+        IDs kept sorted for the bully election. One instance is shared by the
+        election, the gossip membership callback and PubSub, so they all see the
+        same nodes; it is only changed through add and remove.
+
+        Args:
+            nodes (iterable): Node entries with id, ip, port and optionally type
+                and interests.
+        """
+        self.lock = Lock()
+        self.by_id = {}
+        self.by_address = {}
+        self.ids = []
+        # Incremented whenever a node is added, removed or moves, so readers can
+        # tell whether anything changed since they last looked.
+        self.version = 0
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: dict) -> bool:
+        """
+        Adds a node, or updates the address of a node with the same ID. A node
+        that was at the same address under another ID is removed.
+
+        Returns:
+            bool: True if the topology changed.
+        """
+        record = NodeRecord(
+            node["id"], node["ip"], node["port"], node.get("type", "generic"), node.get("interests", ())
+        )
+        with self.lock:
+            current = self.by_id.get(record.id)
+            if current is not None and current.address == record.address:
+                return False
+            stale = self.by_address.get(record.address)
+            if stale is not None:
+                self.discard(stale.id)
+            if current is not None:
+                self.discard(current.id)
+            self.by_id[record.id] = record
+            self.by_address[record.address] = record
+            insort(self.ids, record.id)
+            self.version += 1
+            return True
+
+    def remove(self, node_id: int):
+        """
+        Returns:
+            NodeRecord: The node that was removed, or None if it was not known.
+        """
+        with self.lock:
+            record = self.discard(node_id)
+            if record is not None:
+                self.version += 1
+            return record
+
+    def discard(self, node_id: int):
+        # Called with the lock held.
+        record = self.by_id.pop(node_id, None)
+        if record is None:
+            return None
+        del self.by_address[record.address]
+        del self.ids[bisect_right(self.ids, node_id) - 1]
+        return record
+
+    def get(self, node_id: int):
+        """
+        Returns:
+            NodeRecord: The node with this ID, or None if there is none.
+        """
+        return self.by_id.get(node_id)
+
+    def find(self, ip: str, port: int):
+        """
+        Returns:
+            NodeRecord: The node at this address, or None if there is none.
+        """
+        return self.by_address.get((ip, port))
+
+    def higher_than(self, node_id: int) -> list:
+        """
+        Returns:
+            list: The nodes with a higher ID, in ID order.
+        """
+        with self.lock:
+            return [self.by_id[i] for i in self.ids[bisect_right(self.ids, node_id):]]
+
+    def highest(self):
+        """
+        Returns:
+            NodeRecord: The node with the highest ID, or None if there are none.
+        """
+        with self.lock:
+            return self.by_id[self.ids[-1]] if self.ids else None
+
+    def records(self) -> list:
+        """
+        Returns:
+            list: All nodes, in ID order.
+        """
+        with self.lock:
+            return [self.by_id[i] for i in self.ids]
+
+    def node_list(self) -> list:
+        """
+        Returns:
+            list: All nodes as entries with id, ip, port, type and interests, in ID
+            order, the form the register sends them in.
+        """
+        return [record.as_node() for record in self.records()]
+
+    def __contains__(self, node_id: int) -> bool:
+        return node_id in self.by_id
+
+    def __len__(self) -> int:
+        return len(self.by_id)
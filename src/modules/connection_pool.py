@@ -0,0 +1,242 @@
+import select
+import socket
+import time
+from threading import Event, Lock, Thread
+
+from constants.constants import POOL_CONNECT_TIMEOUT, POOL_IDLE_TIMEOUT
+from utils import codec as wire_codec
+from utils import utils as helper
+
+
+class PooledConnection:
+    def __init__(self, address: tuple):
+        self.address = address
+        self.sock = None
+        self.lock = Lock()
+        self.last_used = time.monotonic()
+        self.codec = wire_codec.DEFAULT_CODEC
+        # True from a connect that failed until one succeeds.
+        self.connect_failed = False
+
+
+class SubscriberConnectionPool:
+    def __init__(
+        self,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        connect_timeout: float = POOL_CONNECT_TIMEOUT,
+    ):
+        """
+        Long-lived connections from the leader to subscribers, keyed by (ip, port).
+
+        A connection is opened the first time a subscriber is sent something and is
+        reused for every later message. A connection found closed by the subscriber is
+        re-established on the next send, and connections that have not been used for
+        idle_timeout seconds are closed by a background reaper.
+
+        Args:
+            idle_timeout (float): Seconds after which an unused connection is closed.
+            connect_timeout (float): Timeout for connecting and sending to a subscriber.
+        """
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.connections = {}
+        self.lock = Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "reconnects": 0,
+            "evictions": 0,
+            "failures": 0,
+        }
+        self.closed = Event()
+
+        reaper = Thread(target=self.reap_idle_connections)
+        reaper.daemon = True
+        reaper.start()
+
+    def set_codec(self, address: tuple, codec: str):
+        """
+        Records the wire codec negotiated with a subscriber.
+        """
+        self.get_entry(address).codec = codec
+
+    def get_entry(self, address: tuple) -> PooledConnection:
+        address = (address[0], address[1])
+        with self.lock:
+            entry = self.connections.get(address)
+            if entry is None:
+                entry = PooledConnection(address)
+                self.connections[address] = entry
+        return entry
+
+    def send(self, address: tuple, payload, timeout: float = None):
+        """
+        Sends a payload as one frame over the pooled connection to a subscriber.
+
+        Args:
+            address (tuple): The (ip, port) of the subscriber.
+            payload (bytes | EncodedMessage): The message. An EncodedMessage is
+                encoded with the codec negotiated with the subscriber.
+            timeout (float): Overrides connect_timeout for this send.
+
+        Raises:
+            OSError: If the subscriber cannot be reached.
+        """
+        if timeout is None:
+            timeout = self.connect_timeout
+
+        entry = self.get_entry(address)
+        if not isinstance(payload, bytes):
+            payload = payload.encode_for(entry.codec)
+        frame = helper.encode_frame(payload)
+
+        with entry.lock:
+            # Subscribers never write to this connection, so readable means closed.
+            reused = entry.sock is not None and not helper.is_socket_closed(entry.sock)
+            if entry.sock is not None and not reused:
+                self.count("reconnects")
+                self.close_socket(entry)
+
+            if reused:
+                self.count("hits")
+            else:
+                try:
+                    self.connect(entry, timeout)
+                except OSError:
+                    self.count("failures")
+                    raise
+
+            try:
+                entry.sock.settimeout(timeout)
+                entry.sock.sendall(frame)
+            except OSError:
+                self.close_socket(entry)
+                if not reused:
+                    self.count("failures")
+                    raise
+                # The subscriber dropped a connection we believed healthy; retry once.
+                self.count("reconnects")
+                try:
+                    self.connect(entry, timeout)
+                    entry.sock.sendall(frame)
+                except OSError:
+                    self.close_socket(entry)
+                    self.count("failures")
+                    raise
+            entry.last_used = time.monotonic()
+
+    def writable(self, address: tuple) -> bool:
+        """
+        Tells whether a frame can be sent to a subscriber without waiting, that is
+        unless its connection is open and the subscriber stopped reading from it, or
+        the last attempt to connect to it failed.
+        """
+        entry = self.get_entry(address)
+        sock = entry.sock
+        if sock is None:
+            return not entry.connect_failed
+        try:
+            poller = select.poll()
+            poller.register(sock, select.POLLOUT)
+            return bool(poller.poll(0))
+        except (OSError, ValueError):
+            # Closed in the meantime; send reconnects.
+            return True
+
+    def connect_failed(self, address: tuple) -> bool:
+        """
+        Tells whether the last attempt to connect to a subscriber failed.
+        """
+        return self.get_entry(address).connect_failed
+
+    def connect(self, entry: PooledConnection, timeout: float):
+        self.count("misses")
+        try:
+            entry.sock = socket.create_connection(entry.address, timeout=timeout)
+        except OSError:
+            # Counted as a failure by send, once for the whole send.
+            entry.sock = None
+            entry.connect_failed = True
+            raise
+        entry.connect_failed = False
+        entry.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close_socket(self, entry: PooledConnection):
+        if entry.sock is not None:
+            try:
+                entry.sock.close()
+            except OSError:
+                pass
+            entry.sock = None
+
+    def count(self, stat: str):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def evict_idle(self) -> int:
+        """
+        Closes connections that have been idle for longer than idle_timeout.
+
+        Returns:
+            int: The number of connections closed.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [
+                entry
+                for entry in self.connections.values()
+                if entry.sock is not None and entry.last_used < cutoff
+            ]
+        evicted = 0
+        for entry in idle:
+            # Skip connections that are busy sending; they are not idle.
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                # The entry itself is kept so the negotiated codec survives.
+                if entry.sock is not None and entry.last_used < cutoff:
+                    evicted += 1
+                    self.close_socket(entry)
+            finally:
+                entry.lock.release()
+        with self.lock:
+            self.stats["evictions"] += evicted
+        return evicted
+
+    def reap_idle_connections(self):
+        while not self.closed.wait(max(self.idle_timeout / 2, 0.1)):
+            self.evict_idle()
+
+    def remove(self, address: tuple):
+        """
+        Closes and forgets the connection to a subscriber.
+        """
+        with self.lock:
+            entry = self.connections.pop((address[0], address[1]), None)
+        if entry is not None:
+            with entry.lock:
+                self.close_socket(entry)
+
+    def close_all(self):
+        """
+        Closes every pooled connection and stops the reaper.
+        """
+        self.closed.set()
+        with self.lock:
+            entries = list(self.connections.values())
+            self.connections.clear()
+        for entry in entries:
+            with entry.lock:
+                self.close_socket(entry)
+
+    def get_stats(self) -> dict:
+        """
+        Returns:
+            dict: hits, misses (new connections), reconnects, evictions, failures and
+            the number of currently open sockets.
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            entries = list(self.connections.values())
+        stats["open_sockets"] = sum(1 for entry in entries if entry.sock is not None)
+        return stats
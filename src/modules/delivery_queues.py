@@ -0,0 +1,468 @@
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from constants.constants import (
+    DELIVERY_DRAIN_BATCH,
+    DELIVERY_MAX_FAILURES,
+    DELIVERY_MAX_RETRY_INTERVAL,
+    DELIVERY_POLICIES,
+    DELIVERY_POLICY,
+    DELIVERY_QUEUE_SIZE,
+    DELIVERY_RETRY_INTERVAL,
+    DELIVERY_RETRY_WORKERS,
+    DELIVERY_WORKERS,
+    FANOUT_SEND_TIMEOUT,
+)
+from .metrics import REGISTRY
+
+SENDS = REGISTRY.counter("lbn_delivery_sends_total", "Messages sent from the delivery queues", ("result",))
+SENT, FAILED, DROPPED = SENDS.labels("sent"), SENDS.labels("failed"), SENDS.labels("dropped")
+DELIVERY_SECONDS = REGISTRY.histogram(
+    "lbn_delivery_seconds", "Time from queueing a message for a subscriber until it was sent"
+)
+
+
+class DeliveryReport:
+    def __init__(self, label: str, subscribers: int):
+        """
+        What became of one offer queued for its subscribers.
+
+        enqueue counts how many copies it queued, coalesced into a queued one or
+        disconnected the subscriber for. Every copy is then resolved once: delivered
+        when it was sent, dropped when the subscriber's policy dropped it, failed
+        when it could not be sent or its queue was dropped. Once the last copy is
+        resolved, elapsed is filled in and done is set.
+
+        Args:
+            label (str): What was queued, usually the business type.
+            subscribers (int): The number of subscribers the offer was meant for.
+        """
+        self.label = label
+        self.subscribers = subscribers
+        self.queued = 0
+        self.coalesced = 0
+        self.disconnected = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        # Seconds from queueing until each delivered copy was sent.
+        self.latencies = []
+        self.started = time.monotonic()
+        # Copies not resolved yet, and one more that enqueue holds until it has
+        # queued them all.
+        self.pending = subscribers + 1
+        self.lock = Lock()
+        self.done = Event()
+
+    def resolve(self, outcome: str = None, latency: float = None) -> bool:
+        """
+        Counts one copy of the offer as delivered, dropped or failed.
+
+        Returns:
+            bool: True if it was the last copy.
+        """
+        with self.lock:
+            if outcome:
+                setattr(self, outcome, getattr(self, outcome) + 1)
+            if latency is not None:
+                self.latencies.append(latency)
+            self.pending -= 1
+            if self.pending:
+                return False
+            self.elapsed = time.monotonic() - self.started
+        self.done.set()
+        return True
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns the p-th percentile (0-100) of the delivery latencies in seconds.
+        """
+        with self.lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def __str__(self):
+        if not self.done.is_set():
+            return (
+                f"Queued {self.label} for {self.queued}/{self.subscribers} subscribers, "
+                f"{self.coalesced} coalesced, {self.disconnected} disconnected"
+            )
+        return (
+            f"Delivery report for {self.label}: {self.delivered}/{self.subscribers} delivered, "
+            f"{self.dropped} dropped, {self.failed} failed, {self.elapsed * 1000:.1f} ms"
+        )
+
+
+class SubscriberQueue:
+    def __init__(self, address: tuple, policy: str, size: int):
+        """
+        The messages waiting to be sent to one subscriber.
+
+        Args:
+            address (tuple): The (ip, port) of the subscriber.
+            policy (str): What happens to a message that finds the queue full, one
+                of DELIVERY_POLICIES.
+            size (int): The number of messages the queue holds.
+        """
+        self.address = address
+        self.policy = policy
+        self.size = size
+        # [business type, payload, time queued, DeliveryReport]
+        self.messages = deque()
+        self.lock = Lock()
+        # True while a worker drains the queue, or it waits for the subscriber to
+        # be writable again.
+        self.scheduled = False
+        self.stalled = False
+        # Sends that failed in a row, and when the next attempt is due.
+        self.failures = 0
+        self.retry_at = 0.0
+        self.stats = {"queued": 0, "sent": 0, "dropped": 0, "coalesced": 0, "failed": 0, "max_depth": 0}
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["depth"] = len(self.messages)
+            stats["policy"] = self.policy
+            stats["size"] = self.size
+            stats["stalled"] = self.stalled
+            return stats
+
+
+class DeliveryQueues:
+    def __init__(
+        self,
+        pool,
+        on_disconnect=None,
+        on_complete=None,
+        workers: int = DELIVERY_WORKERS,
+        send_timeout: float = FANOUT_SEND_TIMEOUT,
+    ):
+        """
+        Delivers offers through a bounded queue per subscriber, so that a subscriber
+        that reads slowly only delays its own offers.
+
+        Publishing only puts the offer on the queue of every subscriber and returns.
+        Queues that have messages are drained by a pool of workers, at most
+        DELIVERY_DRAIN_BATCH messages at a time before other queues get a turn. A
+        subscriber whose connection has no room for more is not written to, so no
+        worker waits on it; its queue is left until the connection is writable
+        again, which is checked every DELIVERY_RETRY_INTERVAL. A message whose send
+        fails stays at the head of the queue and is tried again after a backoff that
+        starts at DELIVERY_RETRY_INTERVAL and doubles up to
+        DELIVERY_MAX_RETRY_INTERVAL; after DELIVERY_MAX_FAILURES failed sends in a
+        row the subscriber is disconnected as below. Retries are sent by
+        DELIVERY_RETRY_WORKERS threads of their own, so subscribers that cannot be
+        reached only take a worker for their first failed send. While it waits its queue fills
+        up, and once it is full every new message is handled by the
+        subscriber's policy:
+
+        - drop-oldest: the oldest queued message is dropped for the new one.
+        - drop-newest: the new message is dropped.
+        - coalesce: the new message replaces the queued one of the same business
+          type, so the subscriber gets the latest offer of every type; if there is
+          none, the oldest message is dropped.
+        - disconnect: the queue is dropped and on_disconnect is called with the
+          subscriber's address.
+
+        Args:
+            pool (SubscriberConnectionPool): Connections to the subscribers.
+            on_disconnect (callable): Called with the address of a subscriber that
+                is disconnected by its policy or because it cannot be reached.
+            on_complete (callable): Called with the DeliveryReport of an offer once
+                every copy of it was delivered, dropped or failed.
+            workers (int): The number of threads draining queues.
+            send_timeout (float): Connect/send timeout for a single message.
+        """
+        self.pool = pool
+        self.on_disconnect = on_disconnect
+        self.on_complete = on_complete
+        self.send_timeout = send_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery")
+        self.retry_executor = ThreadPoolExecutor(
+            max_workers=DELIVERY_RETRY_WORKERS, thread_name_prefix="delivery-retry"
+        )
+        self.queues = {}
+        self.lock = Lock()
+        self.waiting = set()
+        self.stats = {"disconnects": 0}
+        self.closed = Event()
+
+        retry = Thread(target=self.retry_stalled)
+        retry.daemon = True
+        retry.start()
+
+    def set_policy(self, address: tuple, policy: str = None, size: int = None):
+        """
+        Sets the policy and queue size of a subscriber, DELIVERY_POLICY and
+        DELIVERY_QUEUE_SIZE if not given. Messages already queued are kept.
+
+        Raises:
+            ValueError: If the policy is not one of DELIVERY_POLICIES.
+        """
+        policy = policy or DELIVERY_POLICY
+        if policy not in DELIVERY_POLICIES:
+            raise ValueError(f"Unknown delivery policy {policy}, expected one of {DELIVERY_POLICIES}")
+        queue = self.get_queue(address)
+        with queue.lock:
+            queue.policy = policy
+            queue.size = max(1, int(size or DELIVERY_QUEUE_SIZE))
+
+    def get_queue(self, address: tuple) -> SubscriberQueue:
+        address = (address[0], address[1])
+        with self.lock:
+            queue = self.queues.get(address)
+            if queue is None:
+                queue = SubscriberQueue(address, DELIVERY_POLICY, DELIVERY_QUEUE_SIZE)
+                self.queues[address] = queue
+        return queue
+
+    def remove(self, address: tuple):
+        """
+        Drops a subscriber's queue, with the messages still on it.
+        """
+        with self.lock:
+            queue = self.queues.pop((address[0], address[1]), None)
+            self.waiting.discard(queue)
+        if queue is None:
+            return
+        with queue.lock:
+            dropped = list(queue.messages)
+            queue.messages.clear()
+        for message in dropped:
+            self.resolve(message[3], "failed")
+
+    def enqueue(self, subscribers: list, payload, label: str = "") -> DeliveryReport:
+        """
+        Puts a message on the queue of every subscriber, applying their policies to
+        the queues that are full, and returns without waiting for it to be sent.
+
+        Args:
+            subscribers (list): (ip, port) addresses of the subscribers.
+            payload (bytes | EncodedMessage): The message.
+            label (str): The business type of the message, which coalesce goes by.
+
+        Returns:
+            DeliveryReport: Counts of queued, coalesced and disconnected so far; the
+            rest is filled in as the message is sent.
+        """
+        report = DeliveryReport(label, len(subscribers))
+        disconnected = []
+        evicted = []
+        now = time.monotonic()
+        for address in subscribers:
+            queue = self.get_queue(address)
+            with queue.lock:
+                outcome = self.put(queue, [label, payload, now, report], evicted)
+                if outcome in ("queued", "displaced") and not queue.scheduled:
+                    queue.scheduled = True
+                    self.schedule(queue)
+            if outcome in ("queued", "displaced"):
+                report.queued += 1
+            elif outcome == "coalesced":
+                report.coalesced += 1
+            elif outcome == "dropped":
+                self.resolve(report, "dropped")
+            else:
+                report.disconnected += 1
+                self.resolve(report, "failed")
+                disconnected.append(address)
+            for message in evicted:
+                self.resolve(message[3], "failed" if outcome == "disconnected" else "dropped")
+            evicted.clear()
+
+        for address in disconnected:
+            self.disconnect(address, "is too slow")
+        self.resolve(report)
+        return report
+
+    def resolve(self, report: DeliveryReport, outcome: str = None, latency: float = None):
+        if report.resolve(outcome, latency) and self.on_complete is not None:
+            self.on_complete(report)
+
+    def disconnect(self, address: tuple, reason: str):
+        print(f"Subscriber {address} {reason}, disconnecting it")
+        self.remove(address)
+        with self.lock:
+            self.stats["disconnects"] += 1
+        if self.on_disconnect is not None:
+            self.on_disconnect(address)
+
+    @staticmethod
+    def put(queue: SubscriberQueue, message: list, evicted: list) -> str:
+        # Called with the queue's lock held. The messages it takes off the queue are
+        # appended to evicted.
+        messages = queue.messages
+        if len(messages) < queue.size:
+            messages.append(message)
+            queue.stats["queued"] += 1
+            queue.stats["max_depth"] = max(queue.stats["max_depth"], len(messages))
+            return "queued"
+        if queue.policy == "disconnect":
+            evicted.extend(messages)
+            messages.clear()
+            return "disconnected"
+        if queue.policy == "drop-newest":
+            queue.stats["dropped"] += 1
+            return "dropped"
+        if queue.policy == "coalesce":
+            for index, queued in enumerate(messages):
+                if queued[0] == message[0]:
+                    evicted.append(queued)
+                    messages[index] = message
+                    queue.stats["coalesced"] += 1
+                    return "coalesced"
+        evicted.append(messages.popleft())
+        messages.append(message)
+        queue.stats["dropped"] += 1
+        queue.stats["queued"] += 1
+        return "displaced"
+
+    def drain(self, queue: SubscriberQueue):
+        """
+        Sends up to DELIVERY_DRAIN_BATCH messages from a queue, then hands the
+        queue back to the pool if there are more. Stops at a subscriber that has no
+        room for more until retry_stalled finds it writable, and at a send that
+        failed until its backoff is over; the message is only taken off the queue
+        once it was sent. A message that can never be sent, such as one larger than
+        MAX_MESSAGE_SIZE, is dropped. Every message taken off the queue is resolved
+        in its DeliveryReport.
+        """
+        for _ in range(DELIVERY_DRAIN_BATCH):
+            with queue.lock:
+                if not queue.messages:
+                    queue.scheduled = False
+                    return
+                message = queue.messages[0]
+                _, payload, queued_at, report = message
+                retrying = queue.failures > 0
+            # A retry after a failure is itself the check whether the subscriber
+            # can be reached again.
+            if not retrying and not self.pool.writable(queue.address):
+                if self.pool.connect_failed(queue.address):
+                    self.send_failed(queue, "the last connect failed")
+                else:
+                    self.wait(queue)
+                return
+            try:
+                self.pool.send(queue.address, payload, self.send_timeout)
+                outcome = "sent"
+            except socket.timeout as e:
+                outcome, error = "failed", e
+            except ValueError as e:
+                outcome = "dropped"
+                print(f"Dropping a message for subscriber {queue.address}: {e}")
+            except Exception as e:
+                outcome, error = "failed", e
+            if outcome == "failed":
+                self.send_failed(queue, error)
+                return
+            with queue.lock:
+                queue.stats[outcome] += 1
+                queue.failures = 0
+                # The message may have been dropped or replaced in the meantime, and
+                # then it was resolved already.
+                taken = bool(queue.messages) and queue.messages[0] is message
+                if taken:
+                    queue.messages.popleft()
+            if outcome == "sent":
+                latency = time.monotonic() - queued_at
+                SENT.inc()
+                DELIVERY_SECONDS.observe(latency)
+                if taken:
+                    self.resolve(report, "delivered", latency)
+            else:
+                DROPPED.inc()
+                if taken:
+                    self.resolve(report, "failed")
+        self.schedule(queue)
+
+    def schedule(self, queue: SubscriberQueue):
+        """
+        Hands a queue to the workers, or to the retry workers after a failed send.
+        """
+        if queue.failures:
+            self.retry_executor.submit(self.drain, queue)
+        else:
+            self.executor.submit(self.drain, queue)
+
+    def wait(self, queue: SubscriberQueue):
+        """
+        Leaves a queue to retry_stalled, which hands it back to the pool once the
+        subscriber is writable or the queue's backoff is over.
+        """
+        with queue.lock:
+            queue.stalled = True
+        with self.lock:
+            if self.queues.get(queue.address) is queue:
+                self.waiting.add(queue)
+
+    def send_failed(self, queue: SubscriberQueue, error):
+        """
+        Keeps the message at the head of the queue for a retry after a backoff, or
+        disconnects the subscriber after DELIVERY_MAX_FAILURES failures in a row.
+        """
+        FAILED.inc()
+        with queue.lock:
+            queue.stats["failed"] += 1
+            queue.failures += 1
+            failures = queue.failures
+            backoff = min(DELIVERY_RETRY_INTERVAL * 2 ** (failures - 1), DELIVERY_MAX_RETRY_INTERVAL)
+            queue.retry_at = time.monotonic() + backoff
+        if failures >= DELIVERY_MAX_FAILURES:
+            self.disconnect(queue.address, f"cannot be reached after {failures} attempts ({error})")
+            return
+        if failures == 1:
+            print(f"Error sending data to subscriber {queue.address}, retrying: {error}")
+        self.wait(queue)
+
+    def retry_stalled(self):
+        while not self.closed.wait(DELIVERY_RETRY_INTERVAL):
+            with self.lock:
+                waiting = list(self.waiting)
+            now = time.monotonic()
+            for queue in waiting:
+                with queue.lock:
+                    failures, retry_at = queue.failures, queue.retry_at
+                if failures and now < retry_at:
+                    continue
+                if not failures and not self.pool.writable(queue.address):
+                    continue
+                with self.lock:
+                    self.waiting.discard(queue)
+                with queue.lock:
+                    queue.stalled = False
+                self.schedule(queue)
+
+    def get_stats(self) -> dict:
+        """
+        Returns:
+            dict: Totals over all queues, and the stats of every queue that holds
+            messages or has dropped any.
+        """
+        with self.lock:
+            queues = list(self.queues.values())
+            stats = dict(self.stats, subscribers=len(queues), stalled=len(self.waiting))
+        totals = {"depth": 0, "queued": 0, "sent": 0, "dropped": 0, "coalesced": 0, "failed": 0}
+        backlog = {}
+        for queue in queues:
+            queue_stats = queue.get_stats()
+            for key in totals:
+                totals[key] += queue_stats[key]
+            if queue_stats["depth"] or queue_stats["dropped"] or queue_stats["coalesced"]:
+                backlog[f"{queue.address[0]}:{queue.address[1]}"] = queue_stats
+        stats.update(totals)
+        stats["queues"] = backlog
+        return stats
+
+    def shutdown(self):
+        self.closed.set()
+        self.executor.shutdown(wait=False)
+        self.retry_executor.shutdown(wait=False)
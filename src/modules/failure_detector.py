@@ -0,0 +1,184 @@
+import math
+import time
+from collections import deque
+from threading import Lock
+
+from constants.constants import (
+    PHI_ACCEPTABLE_PAUSE,
+    PHI_FIRST_ESTIMATE,
+    PHI_MIN_STD_DEVIATION,
+    PHI_THRESHOLD,
+    PHI_WINDOW,
+)
+
+
+class PhiAccrualFailureDetector:
+    def __init__(
+        self,
+        threshold: float = PHI_THRESHOLD,
+        window: int = PHI_WINDOW,
+        min_std_deviation: float = PHI_MIN_STD_DEVIATION,
+        acceptable_pause: float = PHI_ACCEPTABLE_PAUSE,
+        first_estimate: float = PHI_FIRST_ESTIMATE,
+    ):
+        """
+        Decides whether a node is down from how long it is taking to hear from it,
+        compared with how long it took so far (the phi accrual failure detector of
+        Hayashibara et al.). The gossip membership feeds it the round trips of the
+        ACKs to its pings of a member; the intervals between heartbeats work the
+        same way.
+
+        Intervals are assumed to be normally distributed with the mean and standard
+        deviation of the last window intervals. Phi is -log10 of the probability
+        that the current wait is even longer than that, so phi 8 means the node is
+        down unless a one in 10^8 delay is happening. Because the distribution is
+        learnt, a node whose answers jitter is given more time than one whose
+        answers are regular.
+
+        Args:
+            threshold (float): The phi above which the node is suspected.
+            window (int): The number of recent intervals the statistics use.
+            min_std_deviation (float): Lower bound for the standard deviation, in
+                seconds, so a run of perfectly regular intervals does not make the
+                detector suspect a node after a tiny delay.
+            acceptable_pause (float): Seconds added to the mean interval, for pauses
+                that are expected but not reflected in the history.
+            first_estimate (float): The interval assumed before any has been seen.
+        """
+        self.threshold = threshold
+        self.min_std_deviation = min_std_deviation
+        self.acceptable_pause = acceptable_pause
+        self.first_estimate = first_estimate
+        self.intervals = deque(maxlen=window)
+        self.total = 0.0
+        self.squares = 0.0
+        self.last = None
+        self.lock = Lock()
+        # Phi only depends on how many standard deviations the wait is above the
+        # mean, so the deviations at which it reaches the threshold are fixed.
+        low, high = 0.0, 64.0
+        for _ in range(60):
+            middle = (low + high) / 2
+            if self.phi_of(middle, 0.0, 1.0) >= threshold:
+                high = middle
+            else:
+                low = middle
+        self.threshold_deviations = high
+        self.reset()
+        # Nobody is watched until the first reset.
+        self.last = None
+
+    def reset(self, now: float = None):
+        """
+        Forgets the history, e.g. when another node becomes leader, and starts
+        watching the node as if a heartbeat had just arrived.
+        """
+        with self.lock:
+            self.intervals.clear()
+            self.total = 0.0
+            self.squares = 0.0
+            deviation = self.first_estimate / 4
+            self.add(self.first_estimate - deviation)
+            self.add(self.first_estimate + deviation)
+            self.last = time.monotonic() if now is None else now
+
+    def clear(self):
+        """
+        Stops suspecting the node until the next reset, e.g. while an election is
+        running or when this node is the leader itself.
+        """
+        with self.lock:
+            self.last = None
+
+    def add(self, interval: float):
+        # Called with the lock held.
+        if len(self.intervals) == self.intervals.maxlen:
+            oldest = self.intervals[0]
+            self.total -= oldest
+            self.squares -= oldest * oldest
+        self.intervals.append(interval)
+        self.total += interval
+        self.squares += interval * interval
+
+    def heartbeat(self, now: float = None):
+        """
+        Records that a heartbeat, or any other message, arrived from the node.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.last is None:
+                return
+            if now > self.last:
+                self.add(now - self.last)
+            self.last = now
+
+    def record(self, interval: float):
+        """
+        Records an interval measured by the caller, such as the round trip of a
+        ping, including one that came too late to count.
+        """
+        with self.lock:
+            self.add(max(interval, 0.0))
+
+    @staticmethod
+    def phi_of(elapsed: float, mean: float, std_deviation: float) -> float:
+        """
+        Returns -log10 of the probability that a normally distributed interval is
+        longer than elapsed, using a logistic approximation of the normal CDF.
+        Written so that it neither overflows nor takes the log of zero far from the
+        mean.
+        """
+        y = (elapsed - mean) / std_deviation
+        exponent = y * (1.5976 + 0.070566 * y * y)
+        if elapsed > mean:
+            return exponent / math.log(10) + math.log10(1.0 + math.exp(-exponent))
+        return math.log10(1.0 + math.exp(exponent))
+
+    def statistics(self) -> tuple:
+        # Called with the lock held.
+        count = len(self.intervals)
+        mean = self.total / count
+        variance = max(self.squares / count - mean * mean, 0.0)
+        return mean, max(math.sqrt(variance), self.min_std_deviation)
+
+    def phi(self, now: float = None) -> float:
+        """
+        Returns:
+            float: How strongly the node is suspected to be down right now, 0 if the
+            detector is cleared.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.last is None:
+                return 0.0
+            mean, std_deviation = self.statistics()
+            elapsed = now - self.last
+        return self.phi_of(elapsed, mean + self.acceptable_pause, std_deviation)
+
+    def timeout(self) -> float:
+        """
+        Returns:
+            float: How long a wait for the node can last before phi reaches the
+            threshold, e.g. how long to wait for the ACK to a ping.
+        """
+        with self.lock:
+            mean, std_deviation = self.statistics()
+        return mean + self.acceptable_pause + self.threshold_deviations * std_deviation
+
+    def is_available(self, now: float = None) -> bool:
+        return self.phi(now) < self.threshold
+
+    def get_stats(self, now: float = None) -> dict:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            mean, std_deviation = self.statistics()
+            samples = len(self.intervals)
+            elapsed = None if self.last is None else now - self.last
+        return {
+            "phi": self.phi(now),
+            "mean_interval": mean,
+            "std_deviation": std_deviation,
+            "samples": samples,
+            "since_last_heartbeat": elapsed,
+            "timeout": self.timeout(),
+        }
@@ -0,0 +1,188 @@
+import math
+from threading import Lock
+
+from constants.constants import EARTH_RADIUS_KM, GEO_CELL_SIZES_KM
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+class GridLevel:
+    def __init__(self, cell_km: float):
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.columns = math.ceil(360 / self.cell_deg)
+        self.cells = {}
+        self.max_radius_km = 0.0
+
+    def cell_of(self, lat: float, lon: float) -> tuple:
+        row = int((lat + 90) // self.cell_deg)
+        column = int((lon + 180) // self.cell_deg) % self.columns
+        return row, column
+
+    def cells_near(self, lat: float, lon: float) -> list:
+        """
+        Returns the cells that can hold a point within max_radius_km of (lat, lon).
+        """
+        row, column = self.cell_of(lat, lon)
+        radius_deg = self.max_radius_km / KM_PER_DEGREE
+        rows = math.ceil(radius_deg / self.cell_deg)
+        # Circles get wider in longitude away from the equator.
+        widest = min(abs(lat) + radius_deg, 90.0)
+        cos_lat = math.cos(math.radians(widest))
+        if cos_lat < 1e-9 or radius_deg / cos_lat >= 180:
+            columns = range(self.columns)
+        else:
+            span = math.ceil(radius_deg / cos_lat / self.cell_deg)
+            if 2 * span + 1 >= self.columns:
+                columns = range(self.columns)
+            else:
+                columns = [(column + offset) % self.columns for offset in range(-span, span + 1)]
+        return [
+            (r, c) for r in range(row - rows, row + rows + 1) for c in columns
+        ]
+
+
+class GeoIndex:
+    def __init__(self, cell_sizes_km: tuple = GEO_CELL_SIZES_KM):
+        """
+        Subscriber locations with a radius, for finding the subscribers an offer at a
+        given point is near enough to.
+
+        Subscribers are kept in a grid of latitude/longitude cells. There is one grid
+        per cell size, and a subscriber goes into the grid with the largest cells
+        that are no larger than its radius. In each grid, a subscriber in range of a
+        point is in one of the cells within the grid's largest radius of the point's
+        cell, usually no more than two cells away. A query only looks at those cells and
+        then checks the exact great-circle distance, so its cost depends on how many
+        subscribers are nearby, not on how many there are in total.
+
+        Args:
+            cell_sizes_km (tuple): The cell sizes of the grids, smallest first.
+        """
+        self.levels = [GridLevel(size) for size in cell_sizes_km]
+        self.entries = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def validate(lat: float, lon: float, radius_km: float = None):
+        """
+        Raises:
+            ValueError: If the coordinates or the radius are out of range.
+        """
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            raise ValueError(f"Invalid coordinates: {lat}, {lon}")
+        if radius_km is not None and not radius_km > 0:
+            raise ValueError(f"Invalid radius: {radius_km}")
+
+    def level_for(self, radius_km: float) -> GridLevel:
+        chosen = self.levels[0]
+        for level in self.levels:
+            if level.cell_km > radius_km:
+                break
+            chosen = level
+        return chosen
+
+    def add(self, key, lat: float, lon: float, radius_km: float):
+        """
+        Adds a subscriber, or moves it if it is already in the index.
+
+        Args:
+            key: Identifies the subscriber, e.g. its (ip, port).
+            lat (float): Latitude in degrees.
+            lon (float): Longitude in degrees.
+            radius_km (float): Offers within this distance are delivered.
+        """
+        self.validate(lat, lon, radius_km)
+        level = self.level_for(radius_km)
+        cell = level.cell_of(lat, lon)
+        lat_rad = math.radians(lat)
+        # Comparing haversine terms avoids an asin and a sqrt per candidate.
+        threshold = math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi) / 2) ** 2
+        entry = (lat_rad, math.radians(lon), math.cos(lat_rad), threshold)
+        with self.lock:
+            self.discard(key)
+            level.cells.setdefault(cell, {})[key] = entry
+            level.max_radius_km = max(level.max_radius_km, radius_km)
+            self.entries[key] = (level, cell)
+
+    def remove(self, key) -> bool:
+        """
+        Returns:
+            bool: False if the subscriber was not in the index.
+        """
+        with self.lock:
+            return self.discard(key)
+
+    def discard(self, key) -> bool:
+        # Called with the lock held.
+        located = self.entries.pop(key, None)
+        if located is None:
+            return False
+        level, cell = located
+        members = level.cells[cell]
+        del members[key]
+        if not members:
+            del level.cells[cell]
+        return True
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def query(self, lat: float, lon: float) -> list:
+        """
+        Returns:
+            list: The keys of the subscribers whose radius includes the point.
+        """
+        self.validate(lat, lon)
+        lat_rad = math.radians(lat)
+        lon_rad = math.radians(lon)
+        cos_lat = math.cos(lat_rad)
+        sin = math.sin
+        found = []
+        with self.lock:
+            for level in self.levels:
+                if not level.cells:
+                    continue
+                for cell in level.cells_near(lat, lon):
+                    members = level.cells.get(cell)
+                    if not members:
+                        continue
+                    for key, (s_lat, s_lon, s_cos, threshold) in members.items():
+                        a = (
+                            sin((s_lat - lat_rad) / 2) ** 2
+                            + cos_lat * s_cos * sin((s_lon - lon_rad) / 2) ** 2
+                        )
+                        if a <= threshold:
+                            found.append(key)
+        return found
+
+    def covers(self, key, lat: float, lon: float) -> bool:
+        """
+        Returns:
+            bool: Whether the point is within the subscriber's radius. True if the
+            subscriber has no location.
+        """
+        with self.lock:
+            located = self.entries.get(key)
+            if located is None:
+                return True
+            level, cell = located
+            s_lat, s_lon, s_cos, threshold = level.cells[cell][key]
+        lat_rad = math.radians(lat)
+        a = (
+            math.sin((s_lat - lat_rad) / 2) ** 2
+            + math.cos(lat_rad) * s_cos * math.sin((s_lon - math.radians(lon)) / 2) ** 2
+        )
+        return a <= threshold
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "subscribers": len(self.entries),
+                "levels": {
+                    level.cell_km: len(level.cells) for level in self.levels if level.cells
+                },
+            }
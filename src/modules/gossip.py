@@ -0,0 +1,555 @@
+import math
+import random
+import socket
+import time
+from queue import Queue
+from threading import Condition, Lock, Thread
+
+from constants.constants import (
+    GOSSIP_DEAD_RETENTION,
+    GOSSIP_INDIRECT_PROBES,
+    GOSSIP_MAX_DATAGRAM,
+    GOSSIP_MAX_PIGGYBACK,
+    GOSSIP_MAX_PING_TIMEOUT,
+    GOSSIP_PERIOD,
+    GOSSIP_PING_TIMEOUT,
+    GOSSIP_RETRANSMIT_MULT,
+    GOSSIP_SUSPICION_MULT,
+    MemberStatus,
+    Type,
+)
+from utils import codec as wire_codec
+from .failure_detector import PhiAccrualFailureDetector
+from .metrics import REGISTRY
+
+# Gossip pings take the place of heartbeats: their round trip, and the pings that
+# got no ACK in time, show how healthy the links to the other nodes are.
+PROBES = REGISTRY.counter(
+    "lbn_gossip_probes_total", "Members probed, by how the probe was answered", ("result",)
+)
+PROBE_DIRECT, PROBE_INDIRECT, PROBE_MISSED = (
+    PROBES.labels("direct"), PROBES.labels("indirect"), PROBES.labels("missed")
+)
+PING_RTT = REGISTRY.histogram(
+    "lbn_gossip_ping_rtt_seconds", "Round trip of a gossip ping answered directly, late or not"
+)
+PING_TIMEOUTS = REGISTRY.counter(
+    "lbn_gossip_ping_timeouts_total", "Gossip pings not answered within the ping timeout"
+)
+SUSPICIONS = REGISTRY.counter("lbn_gossip_suspicions_total", "Members suspected after a missed probe")
+
+
+class Member:
+    def __init__(self, node_id: int, ip: str, port: int, status: MemberStatus, incarnation: int):
+        """
+        One node as this node currently sees it.
+
+        Args:
+            node_id (int): The ID of the node.
+            ip (str): The IP address of the node.
+            port (int): The port of the node, for TCP and for gossip over UDP.
+            status (MemberStatus): Whether the node is alive, suspected or dead.
+            incarnation (int): Raised only by the node itself, to refute suspicion.
+                A status with a higher incarnation overrides one with a lower.
+        """
+        self.id = node_id
+        self.ip = ip
+        self.port = port
+        self.status = status
+        self.incarnation = incarnation
+        self.suspected_at = None
+        self.dead_at = None
+        # Learns the round trips of the node's ACKs, to tell how long to wait for one.
+        self.detector = PhiAccrualFailureDetector()
+
+    def as_node(self) -> dict:
+        return {"id": self.id, "ip": self.ip, "port": self.port}
+
+    def as_update(self) -> list:
+        return [self.id, self.ip, self.port, self.status.value, self.incarnation]
+
+
+class GossipMembership:
+    def __init__(
+        self,
+        own_id: int,
+        own_ip: str,
+        own_port: int,
+        nodes: list,
+        on_change=None,
+        period: float = GOSSIP_PERIOD,
+        ping_timeout: float = GOSSIP_PING_TIMEOUT,
+        indirect_probes: int = GOSSIP_INDIRECT_PROBES,
+    ):
+        """
+        SWIM membership (Das et al.): every period this node pings one member, picked
+        round-robin from a shuffled list so every member is probed within two passes.
+        How long it waits for the ACK is learnt from the member's earlier round trips
+        by a phi accrual failure detector, so a member whose answers jitter is given
+        more time than one that answers regularly. If the member does not answer in
+        that time, indirect_probes other members are asked to ping it, so that a
+        single slow or lossy path does not make it look dead. A member nobody could
+        reach by the end of the period, or twice the direct wait if that is later, is
+        suspected. The suspicion is piggybacked on the following messages, and the
+        member refutes it with a higher incarnation if it gets to hear about it;
+        otherwise it is declared dead once the suspicion timeout runs out.
+
+        Membership updates are not sent on their own: each one rides on the next
+        pings and ACKs this node sends, GOSSIP_RETRANSMIT_MULT * log10(n + 1) times,
+        and every node that applies it passes it on in turn, so it reaches all nodes
+        in O(log n) periods. Every node sends and receives about the same number of
+        messages per period whatever the cluster size, and the leader no more than
+        any other.
+
+        Gossip is sent over UDP, on the node's port number.
+
+        Args:
+            own_id (int): The ID of this node.
+            own_ip (str): The IP address of this node.
+            own_port (int): The port of this node.
+            nodes (list): The initial node list, including this node.
+            on_change (callable): Called with the node's entry and its new
+                MemberStatus whenever a member joins, is suspected, dies or comes back.
+                It runs on a thread of its own, in the order of the changes, so a slow
+                callback does not hold up the gossip.
+            period (float): Seconds between two probes.
+            ping_timeout (float): The least seconds to wait for a direct ACK before
+                probing indirectly, however fast the member answered so far.
+            indirect_probes (int): The number of members asked to probe indirectly.
+        """
+        self.own_id = own_id
+        self.address = (own_ip, own_port)
+        self.on_change = on_change
+        self.period = period
+        self.ping_timeout = ping_timeout
+        self.indirect_probes = indirect_probes
+
+        self.members = {
+            node["id"]: Member(node["id"], node["ip"], node["port"], MemberStatus.ALIVE, 0)
+            for node in nodes
+        }
+        self.members.setdefault(
+            own_id, Member(own_id, own_ip, own_port, MemberStatus.ALIVE, 0)
+        )
+        # Incremented whenever the view changes, so readers can tell it did.
+        self.version = 0
+        # Member ID -> [update, times sent], the updates still being piggybacked.
+        self.updates = {}
+        self.probe_order = []
+        self.seq = 0
+        # The seq of the probe in progress and, once its ACK arrived, in acked. ACKs
+        # to other seqs are too late to count and are not kept.
+        self.probing = None
+        self.acked = set()
+        # Direct pings whose ACK has not arrived: seq -> (member, sent), so that the
+        # round trip of an ACK is learnt even when it comes too late.
+        self.pings = {}
+        # Indirect probes in progress: seq -> (requesting address, its seq, started).
+        self.forwarded = {}
+        self.stats = {
+            "sent": 0,
+            "received": 0,
+            "pings": 0,
+            "ping_reqs": 0,
+            "indirect_acks": 0,
+            "suspicions": 0,
+            "refutations": 0,
+        }
+        self.lock = Lock()
+        self.ack_received = Condition(self.lock)
+        self.sock = None
+        self.running = False
+        # (node, status) changes waiting for on_change.
+        self.changes = Queue()
+
+        REGISTRY.gauge(
+            "lbn_gossip_live_members",
+            "Members not declared dead, this node included",
+            function=lambda: len(self.live_nodes()),
+        )
+
+    def start(self):
+        """
+        Binds the gossip socket and starts probing. Announces this node as alive, so
+        that nodes that had it as dead from a previous run take it back.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(self.address)
+        self.running = True
+        with self.lock:
+            self.queue_update(self.members[self.own_id])
+        for target in (self.receive_messages, self.probe_members, self.report_changes):
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.changes.put(None)
+        if self.sock is not None:
+            self.sock.close()
+
+    def get_view(self) -> dict:
+        """
+        Returns:
+            dict: The version of the view and, for every member this node knows
+            of, its address, status and incarnation.
+        """
+        with self.lock:
+            return {
+                "version": self.version,
+                "members": {
+                    member.id: {
+                        "ip": member.ip,
+                        "port": member.port,
+                        "status": member.status.name,
+                        "incarnation": member.incarnation,
+                    }
+                    for member in self.members.values()
+                },
+            }
+
+    def digest(self) -> int:
+        """
+        Returns:
+            int: A hash of the members' statuses and incarnations. Two nodes with the
+            same digest have the same view, whatever their local versions.
+        """
+        with self.lock:
+            return hash(
+                tuple(
+                    sorted((m.id, m.status.value, m.incarnation) for m in self.members.values())
+                )
+            )
+
+    def live_nodes(self) -> list:
+        """
+        Returns:
+            list: The entries of the members that are not dead, including this node,
+            sorted by ID. Suspected members are included until they are declared dead.
+        """
+        with self.lock:
+            return [
+                member.as_node()
+                for member in sorted(self.members.values(), key=lambda m: m.id)
+                if member.status is not MemberStatus.DEAD
+            ]
+
+    def status_of(self, node_id: int):
+        with self.lock:
+            member = self.members.get(node_id)
+            return member.status if member is not None else None
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["version"] = self.version
+            stats["pending_updates"] = len(self.updates)
+            return stats
+
+    def probe_members(self):
+        while self.running:
+            started = time.monotonic()
+            try:
+                self.probe(started)
+            except OSError as e:
+                if not self.running:
+                    break
+                print(f"Gossip probe failed: {e}")
+            self.expire_suspicions()
+            time.sleep(max(0.0, started + self.period - time.monotonic()))
+
+    def probe(self, started: float):
+        """
+        Pings the next member and, if it does not answer in time, asks others to
+        ping it. Suspects it if no ACK arrived by the end of the period.
+        """
+        with self.lock:
+            target = self.next_target()
+            if target is None:
+                return
+            seq = self.next_seq()
+            self.probing = seq
+            self.stats["pings"] += 1
+            timeout = min(max(target.detector.timeout(), self.ping_timeout), GOSSIP_MAX_PING_TIMEOUT)
+            sent = time.monotonic()
+            self.pings[seq] = (target, sent)
+        self.send((target.ip, target.port), Type["GOSSIP_PING"], {"seq": seq})
+
+        # Leaves at least half the period to the indirect probes.
+        direct_wait = min(timeout, self.period / 2)
+        with self.ack_received:
+            if self.ack_received.wait_for(lambda: seq in self.acked, timeout=direct_wait):
+                self.end_probe()
+                PROBE_DIRECT.inc()
+                return
+            PING_TIMEOUTS.inc()
+            helpers = [
+                member
+                for member in self.members.values()
+                if member.id not in (self.own_id, target.id)
+                and member.status is MemberStatus.ALIVE
+            ]
+            helpers = random.sample(helpers, min(self.indirect_probes, len(helpers)))
+            self.stats["ping_reqs"] += len(helpers)
+        for helper in helpers:
+            self.send(
+                (helper.ip, helper.port),
+                Type["GOSSIP_PING_REQ"],
+                {"seq": seq, "target": [target.ip, target.port]},
+            )
+
+        # An indirect probe takes two round trips, and a late direct ACK still counts.
+        deadline = max(started + self.period, sent + 2 * timeout)
+        with self.ack_received:
+            remaining = deadline - time.monotonic()
+            acked = self.ack_received.wait_for(lambda: seq in self.acked, timeout=max(0.0, remaining))
+            self.end_probe()
+            (PROBE_INDIRECT if acked else PROBE_MISSED).inc()
+            if acked or target.status is not MemberStatus.ALIVE:
+                return
+            print(f"Gossip: suspecting node {target.id}, it did not answer a ping")
+            self.stats["suspicions"] += 1
+            SUSPICIONS.inc()
+            changed = self.apply(
+                [target.id, target.ip, target.port, MemberStatus.SUSPECT.value, target.incarnation]
+            )
+        self.notify(changed)
+
+    def end_probe(self):
+        # Called with the lock held.
+        self.probing = None
+        self.acked.clear()
+
+    def next_target(self):
+        # Called with the lock held.
+        while True:
+            if not self.probe_order:
+                self.probe_order = [
+                    member_id
+                    for member_id, member in self.members.items()
+                    if member_id != self.own_id and member.status is not MemberStatus.DEAD
+                ]
+                if not self.probe_order:
+                    return None
+                random.shuffle(self.probe_order)
+            member = self.members.get(self.probe_order.pop())
+            if member is not None and member.status is not MemberStatus.DEAD:
+                return member
+
+    def next_seq(self) -> int:
+        # Called with the lock held.
+        self.seq += 1
+        return self.seq
+
+    def suspicion_timeout(self) -> float:
+        scale = max(1.0, math.log10(max(1, len(self.members))))
+        return GOSSIP_SUSPICION_MULT * scale * self.period
+
+    def expire_suspicions(self):
+        """
+        Declares dead the suspected members that did not refute in time, and forgets
+        pings and indirect probes that never got an answer and members that have been
+        dead for GOSSIP_DEAD_RETENTION. By then their death has long stopped being
+        gossiped, so no node still passes on an older update that would bring them
+        back; a member that restarts announces itself with a new update.
+        """
+        now = time.monotonic()
+        changed = []
+        with self.lock:
+            timeout = self.suspicion_timeout()
+            for member in list(self.members.values()):
+                if member.status is MemberStatus.SUSPECT and now - member.suspected_at >= timeout:
+                    print(f"Gossip: node {member.id} did not refute the suspicion, declaring it dead")
+                    changed += self.apply(
+                        [member.id, member.ip, member.port, MemberStatus.DEAD.value, member.incarnation]
+                    )
+                elif (
+                    member.status is MemberStatus.DEAD
+                    and now - member.dead_at >= GOSSIP_DEAD_RETENTION
+                    and member.id not in self.updates
+                ):
+                    del self.members[member.id]
+                    self.version += 1
+            for seq, (_, _, forwarded_at) in list(self.forwarded.items()):
+                if now - forwarded_at > self.period:
+                    del self.forwarded[seq]
+            for seq, (_, sent) in list(self.pings.items()):
+                if now - sent > GOSSIP_MAX_PING_TIMEOUT * 2:
+                    del self.pings[seq]
+        self.notify(changed)
+
+    def apply(self, update: list) -> list:
+        """
+        Merges a membership update into the view. A member's status is replaced by
+        one with a higher incarnation, or by a stronger status (suspect over alive,
+        dead over both) with the same incarnation. An update that suspects this node
+        is refuted with a higher incarnation instead. Updates that change the view are
+        passed on. Called with the lock held.
+
+        Args:
+            update (list): [id, ip, port, status, incarnation].
+
+        Returns:
+            list: The (node, status) changes to report to on_change.
+        """
+        node_id, ip, port, status, incarnation = update
+        status = MemberStatus(status)
+        member = self.members.get(node_id)
+
+        if node_id == self.own_id:
+            if incarnation < member.incarnation or (
+                incarnation == member.incarnation and status is MemberStatus.ALIVE
+            ):
+                return []
+            # Refutes the suspicion, or takes over the incarnation from before a
+            # restart that the other nodes still have.
+            if status is MemberStatus.ALIVE:
+                member.incarnation = incarnation
+            else:
+                member.incarnation = incarnation + 1
+                self.stats["refutations"] += 1
+            self.version += 1
+            self.queue_update(member)
+            return []
+
+        if member is None:
+            member = Member(node_id, ip, port, status, incarnation)
+            self.members[node_id] = member
+        elif incarnation > member.incarnation or (
+            incarnation == member.incarnation and status.value > member.status.value
+        ):
+            member.ip, member.port = ip, port
+            member.status, member.incarnation = status, incarnation
+        else:
+            return []
+
+        member.suspected_at = time.monotonic() if status is MemberStatus.SUSPECT else None
+        member.dead_at = time.monotonic() if status is MemberStatus.DEAD else None
+        self.version += 1
+        self.queue_update(member)
+        return [(member.as_node(), status)]
+
+    def learn(self, node: dict, status: MemberStatus):
+        """
+        Merges a change that this node heard of from outside the gossip, such as from
+        the register, into the view as if it had been gossiped, and passes it on.
+
+        Args:
+            node (dict): The member's ID, IP address and port.
+            status (MemberStatus): Its new status.
+        """
+        if node["id"] == self.own_id:
+            return
+        with self.lock:
+            member = self.members.get(node["id"])
+            incarnation = member.incarnation if member is not None else 0
+            changed = self.apply([node["id"], node["ip"], node["port"], status.value, incarnation])
+        self.notify(changed)
+
+    def queue_update(self, member: Member):
+        # Called with the lock held. Replaces an older update about the same member.
+        self.updates[member.id] = [member.as_update(), 0]
+
+    def piggyback(self) -> list:
+        """
+        Picks the updates sent the fewest times so far for the next message, and
+        drops those that have been sent often enough. Called with the lock held.
+        """
+        if not self.updates:
+            return []
+        limit = GOSSIP_RETRANSMIT_MULT * math.ceil(math.log10(len(self.members) + 1))
+        chosen = sorted(self.updates.items(), key=lambda item: item[1][1])[:GOSSIP_MAX_PIGGYBACK]
+        for member_id, entry in chosen:
+            entry[1] += 1
+            if entry[1] >= limit:
+                del self.updates[member_id]
+        return [entry[0] for _, entry in chosen]
+
+    def send(self, address: tuple, message_type: Type, fields: dict, extra: list = None):
+        with self.lock:
+            updates = self.piggyback()
+            self.stats["sent"] += 1
+        if extra:
+            updates = updates + extra
+        msg = {"type": message_type.value, "id": self.own_id, "updates": updates}
+        msg.update(fields)
+        try:
+            self.sock.sendto(wire_codec.encode(msg), address)
+        except OSError as e:
+            if self.running:
+                print(f"Gossip to {address} failed: {e}")
+
+    def notify(self, changed: list):
+        if self.on_change is None:
+            return
+        for change in changed:
+            self.changes.put(change)
+
+    def report_changes(self):
+        while True:
+            change = self.changes.get()
+            if change is None:
+                break
+            try:
+                self.on_change(*change)
+            except Exception as e:
+                print(f"Gossip: handling the change of node {change[0]['id']} failed: {e}")
+
+    def receive_messages(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(GOSSIP_MAX_DATAGRAM)
+            except OSError:
+                break
+            try:
+                self.process_message(wire_codec.decode(data), address)
+            except (KeyError, TypeError, ValueError):
+                print(f"Dropping malformed gossip from {address}")
+
+    def process_message(self, msg: dict, address: tuple):
+        """
+        Applies the updates a gossip message carries, then answers it.
+
+        Args:
+            msg (dict): The decoded message.
+            address (tuple): Where it came from.
+        """
+        changed = []
+        extra = None
+        with self.lock:
+            self.stats["received"] += 1
+            for update in msg.get("updates", ()):
+                changed += self.apply(update)
+            sender = self.members.get(msg.get("id"))
+            # A node that was declared dead and restarted only learns that it has
+            # to refute it from the node it pings.
+            if sender is not None and sender.status is MemberStatus.DEAD:
+                extra = [sender.as_update()]
+
+            if msg["type"] == Type["GOSSIP_ACK"].value:
+                request = self.forwarded.pop(msg["seq"], None)
+                ping = self.pings.get(msg["seq"])
+                # An indirect ACK comes from the helper, with the same seq.
+                if ping is not None and ping[0].id == msg["id"]:
+                    del self.pings[msg["seq"]]
+                    round_trip = time.monotonic() - ping[1]
+                    ping[0].detector.record(round_trip)
+                    PING_RTT.observe(round_trip)
+                if request is None and msg["seq"] == self.probing:
+                    self.acked.add(msg["seq"])
+                    self.ack_received.notify_all()
+            elif msg["type"] == Type["GOSSIP_PING_REQ"].value:
+                seq = self.next_seq()
+                self.forwarded[seq] = (address, msg["seq"], time.monotonic())
+        self.notify(changed)
+
+        if msg["type"] == Type["GOSSIP_PING"].value:
+            self.send(address, Type["GOSSIP_ACK"], {"seq": msg["seq"]}, extra)
+        elif msg["type"] == Type["GOSSIP_PING_REQ"].value:
+            self.send(tuple(msg["target"]), Type["GOSSIP_PING"], {"seq": seq})
+        elif msg["type"] == Type["GOSSIP_ACK"].value and request is not None:
+            requester, requester_seq, _ = request
+            with self.lock:
+                self.stats["indirect_acks"] += 1
+            self.send(requester, Type["GOSSIP_ACK"], {"seq": requester_seq})
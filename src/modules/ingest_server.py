@@ -0,0 +1,122 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from constants.constants import (
+    INGEST_BACKLOG,
+    INGEST_WORKERS,
+    MAX_MESSAGE_SIZE,
+)
+from utils import utils as helper
+
+
+class ClientIngestServer:
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        handler,
+        workers: int = INGEST_WORKERS,
+        backlog: int = INGEST_BACKLOG,
+    ):
+        """
+        asyncio server for the leader's client port.
+
+        Every publisher and subscriber connection gets its own coroutine, so a slow
+        client only holds up its own connection. Connections stay open until the
+        client closes them and may carry any number of framed requests. Decoding and
+        processing of a request run on a thread pool instead of the event loop.
+
+        Args:
+            ip (str): The IP address to listen on.
+            port (int): The port to listen on.
+            handler (callable): Called with the payload of every frame received.
+                Whatever bytes it returns are sent back to the client as a frame.
+            workers (int): The number of threads processing requests.
+            backlog (int): The listen backlog of the server socket.
+        """
+        self.ip = ip
+        self.port = port
+        self.handler = handler
+        self.backlog = backlog
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ingest"
+        )
+        self.ready = Event()
+        self.open_connections = 0
+        self.requests_handled = 0
+        self.loop = None
+        self.stopped = None
+
+    def serve_forever(self):
+        """
+        Runs the server on a new event loop until stop is called.
+        """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(
+            self.handle_connection,
+            self.ip,
+            self.port,
+            backlog=self.backlog,
+            reuse_address=True,
+        )
+        print(f"Ingest server is accepting clients on {self.ip}:{self.port}\n")
+        self.ready.set()
+        async with server:
+            await self.stopped.wait()
+
+    def stop(self):
+        """
+        Stops the server from another thread.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Reads frames from one client until it disconnects and hands each of them to
+        the handler. Requests from the same connection are processed, and answered,
+        in order.
+        """
+        self.open_connections += 1
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(helper.FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                (length,) = helper.FRAME_HEADER.unpack(header)
+                if length > MAX_MESSAGE_SIZE:
+                    print("Dropping client message: size exceeds MAX_MESSAGE_SIZE")
+                    await self.skip(reader, length)
+                    continue
+                payload = await reader.readexactly(length)
+                reply = await self.loop.run_in_executor(self.executor, self.handler, payload)
+                if reply is not None:
+                    writer.write(helper.encode_frame(reply))
+                    await writer.drain()
+                self.requests_handled += 1
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"Client connection closed: {e}")
+        except Exception as e:
+            print(f"Exception occurred while handling client: {e}")
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+    async def skip(self, reader, length: int):
+        """
+        Reads and discards the payload of an oversized frame without buffering it.
+        """
+        while length:
+            chunk = await reader.read(min(length, 64 * 1024))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", length)
+            length -= len(chunk)
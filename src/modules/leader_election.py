@@ -4,19 +4,37 @@ import signal as sign
 import socket
 import sys
 import time
-from threading import Thread, Lock, Event
-from .heartbeat import HeartBeat
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Condition, Thread, Lock, Event
+from .cluster_topology import ClusterTopology
+from .gossip import GossipMembership
+from .metrics import REGISTRY
+from .node_dispatcher import NodeDispatcher
 
 from constants.constants import (
     TOTAL_DELAY,
-    BUFF_SIZE,
     DEFAULT_ID,
+    ELECTION_CONNECT_TIMEOUT,
+    ELECTION_FANOUT_DEADLINE,
+    ELECTION_FANOUT_WORKERS,
     HEARTBEAT_TIME,
+    ErrorCode,
+    MemberStatus,
     Type,
 )
+from utils import codec as wire_codec
 from utils import utils
 from .pub_sub_handler import PubSub
 
+ELECTIONS = REGISTRY.counter(
+    "lbn_elections_total", "Elections this node ran, by whether it became the leader", ("outcome",)
+)
+ELECTION_SECONDS = REGISTRY.histogram(
+    "lbn_election_seconds", "Time from starting an election until the leader was known", ("outcome",)
+)
+LEADER_CHANGES = REGISTRY.counter("lbn_leader_changes_total", "Times this node saw the leader change")
+HEARTBEATS = REGISTRY.counter("lbn_heartbeats_received_total", "Heartbeats received while leader")
+
 
 class BullyLeaderElection:
     def __init__(
@@ -31,6 +49,9 @@ class BullyLeaderElection:
         is_bully_algorithm: bool,
         leader_node_ip: str,
         leader_node_port: int,
+        register_socket: socket = None,
+        register_decoder: utils.FrameDecoder = None,
+        topology_version: int = 0,
     ):
         self.checkedNodesLength = 0
 
@@ -39,19 +60,41 @@ class BullyLeaderElection:
         self.nodeIP = current_node_ip
         self.nodePort = current_node_port
         self.nodeId = id
-        self.nodes = nodes_topology_entities
+        # Shared with PubSub, and kept in line with the gossip membership by
+        # member_changed.
+        self.topology = ClusterTopology(nodes_topology_entities)
         self.socket = socket
         self.algo = is_bully_algorithm
         self.leaderIP = leader_node_ip
         self.leaderPort = leader_node_port
+        # The connection this node registered on. The register pushes the nodes that
+        # join and leave over it, numbered with the version of the node list.
+        self.register_socket = register_socket
+        self.register_decoder = register_decoder or utils.FrameDecoder()
+        self.topology_version = topology_version
 
         self.leaderID = DEFAULT_ID
         self.coordinatorport = DEFAULT_ID
+        # The last leader this node learned of; leaderID is reset during elections.
+        self.known_leader = DEFAULT_ID
         self.lock = Lock()
+        # Signalled when an ANSWER or END message arrives, so an election waiting for
+        # one wakes up as soon as it does instead of polling.
+        self.election_state = Condition(self.lock)
+        self.election_executor = ThreadPoolExecutor(
+            max_workers=ELECTION_FANOUT_WORKERS, thread_name_prefix="election"
+        )
+        # Elections are run one at a time by run_elections, which waits on this until
+        # one is requested.
+        self.election_due = Condition(self.lock)
+        self.election_requested = False
+        self.client_thread = None
 
         self.delay = delay_time_interval
         self.verbose = log_data
         self.is_leader_elected = Event()
+        # Set when the gossip membership declares the leader dead, see watch_leader.
+        self.leader_lost = Event()
 
         sign.signal(sign.SIGINT, self.handler)
 
@@ -63,138 +106,222 @@ class BullyLeaderElection:
             self.leaderID,
             self.nodeId,
             self.leaderIP,
-            self.nodes,
+            self.topology,
             self.nodeIP,
             self.leaderPort,
         )
 
-        thread = Thread(target=self.monitor_connections)
-        thread.daemon = True
-        thread.start()
+        self.gossip = GossipMembership(
+            self.nodeId, self.nodeIP, self.nodePort, self.topology.node_list(), self.member_changed
+        )
+        self.gossip.start()
+
+        REGISTRY.gauge(
+            "lbn_is_leader", "1 if this node is the leader", function=lambda: int(self.leaderID == self.nodeId)
+        )
+        REGISTRY.gauge("lbn_cluster_nodes", "Nodes in this node's topology", function=lambda: len(self.topology))
+
+        # Handles the messages other nodes send to the node socket.
+        self.dispatcher = NodeDispatcher(self.socket)
+        self.register_handlers()
 
-        self.initiate_election()
+        targets = [self.dispatcher.serve_forever, self.run_elections]
+        if self.register_socket is not None:
+            targets.append(self.follow_register)
+        for target in targets:
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+        self.request_election()
         print("Waiting for leader to be elected.")
         self.is_leader_elected.wait()
         print("Leader election is complete.\nThe leader id is: ", self.leaderID)
-        print("Starting heartbeat")
-        HeartBeat(
-            self.nodeIP,
-            self.nodePort,
-            self.nodeId,
-            self.nodes,
-            self.socket,
-            self.verbose,
-            self.delay,
-            self.algo,
-            self.leaderIP,
-            self.leaderPort,
-            self.leaderID,
-            self.lock,
-            self.algoFlag,
-        )
+        self.watch_leader()
+
+    def request_election(self):
+        """
+        Has run_elections start an election, unless one is already due.
+        """
+        with self.election_due:
+            self.election_requested = True
+            self.election_due.notify_all()
+
+    def run_elections(self):
+        """
+        Runs the requested elections one after another, for as long as the node runs,
+        so elections and failovers do not start threads of their own.
+        """
+        while True:
+            with self.election_due:
+                self.election_due.wait_for(lambda: self.election_requested)
+                self.election_requested = False
+            self.initiate_election()
+
+    def watch_leader(self):
+        """
+        Requests an election whenever the gossip membership declares the leader dead.
+        Runs on the thread that created the node, for as long as the node runs.
+        """
+        while True:
+            self.leader_lost.wait()
+            with self.lock:
+                # Cleared if another leader was elected in the meantime.
+                if not self.leader_lost.is_set():
+                    continue
+                self.leader_lost.clear()
+            print("Leader node is down according to the gossip membership")
+            self.request_election()
+
     def initiate_election(self):
         """
         Initiates a leader election. If this node has the highest ID among the nodes that are still up, it becomes the leader.
         Then, it sends an END message to all other nodes to inform them that the election is over and it is the new leader.
-        Finally, it starts a new thread to listen to clients.
+        Finally, it starts the thread that listens to clients, unless it is already running.
         """
         print("Starting leader election")
+        started = time.monotonic()
         self.lock.acquire()
-        current_position = utils.find_index_by_identifier(self.nodeId, self.nodes) + 1
-        print("Current node's position is: ", current_position)
-        print("The nodes in the list are: ", self.nodes)
+        higher = self.topology.higher_than(self.nodeId)
+        print("The nodes with a higher ID are: ", [node.id for node in higher])
         self.algoFlag = True
         self.coordinatorMessageFlag = False
+        self.leader_lost.clear()
 
-        if (current_position != len(self.nodes)) and (
-            self.low_id_node(current_position) == 0
-        ):
+        if higher and self.low_id_node(higher) == 0:
+            ELECTIONS.labels("lost").inc()
+            ELECTION_SECONDS.labels("lost").observe(time.monotonic() - started)
             return
 
         self.leaderID = self.nodeId
         self.algoFlag = False
+        self.pub_sub.set_leader_id(self.leaderID)
 
         print(
             "Leader election is complete. The leader details are: ",
             {"ip": self.nodeIP, "port": self.nodePort, "id": self.nodeId},
         )
 
-        close = False
-        for node in range(len(self.nodes) - 1):
-            sock = utils.initialize_socket(self.nodeIP)
-            if node == (current_position - 1):
-                continue
-            try:
-                sock.connect((self.nodes[node]["ip"], self.nodes[node]["port"]))
-                close = True
-                self.forward_message(self.nodes[node], self.nodeId, Type["END"], sock)
-                sock.close()
-            except ConnectionRefusedError:
-                sock.close()
-                continue
-
-        if not close:
+        highest = self.topology.highest()
+        others = [
+            node
+            for node in self.topology.records()
+            if node.id != self.nodeId and node is not highest
+        ]
+        self.lock.release()
+        reached = self.send_to_nodes(others, Type["END"])
+        self.lock.acquire()
+        if others and reached == 0:
             self.socket.close()
             os._exit(1)
+        self.is_leader_elected.set()
+        ELECTIONS.labels("won").inc()
+        ELECTION_SECONDS.labels("won").observe(time.monotonic() - started)
+        self.leader_known(self.nodeId)
 
-        self.pub_sub.set_leader_id(self.leaderID)
-
-        client_thread = Thread(target=self.pub_sub.listen_to_client)
-        client_thread.daemon = True
-        client_thread.start()
+        if self.client_thread is None or not self.client_thread.is_alive():
+            self.client_thread = Thread(target=self.pub_sub.serve_clients)
+            self.client_thread.daemon = True
+            self.client_thread.start()
 
         self.lock.release()
 
     def forward_message(
-        self, node: dict, nodeId: int, message_type: Type, conn: socket
+        self, address: tuple, nodeId: int, message_type: Type, conn: socket
     ):
         """
         Forwards a message to a node.
 
         Args:
             :param message_type: The type of the message.
-            :param node:  The node to forward the message to.
+            :param address:  The address of the node to forward the message to.
             :param conn: The socket to use to send the message.
             :param nodeId: The ID of the node that is forwarding the message.
         """
 
         utils.delay(self.delay, TOTAL_DELAY)
-        dest = (node["ip"], node["port"])
         msg = utils.build_message(
             nodeId, message_type.value, self.nodePort, self.nodeIP
         )
         try:
-            conn.send(msg)
+            utils.send_frame(conn, msg)
         except ConnectionResetError:
             return
 
+    def send_to_node(self, address: tuple, message_type: Type) -> bool:
+        """
+        Connects to a node and sends it a message, giving up after
+        ELECTION_CONNECT_TIMEOUT for the connect and for the send.
+
+        Returns:
+            bool: True if the message was sent.
+        """
+        try:
+            with socket.create_connection(
+                address,
+                timeout=ELECTION_CONNECT_TIMEOUT,
+                source_address=(self.nodeIP, 0),
+            ) as sock:
+                self.forward_message(address, self.nodeId, message_type, sock)
+            return True
+        except OSError:
+            return False
+
+    def send_to_nodes(self, nodes: list, message_type: Type) -> int:
+        """
+        Sends a message to several nodes at the same time. Nodes that have not been
+        reached after ELECTION_FANOUT_DEADLINE count as down, so how long this takes
+        does not depend on how many of them are.
+
+        Args:
+            nodes (list): The NodeRecords of the nodes to send the message to.
+            message_type (Type): The type of the message.
+
+        Returns:
+            int: The number of nodes the message was sent to.
+        """
+        futures = [
+            self.election_executor.submit(self.send_to_node, node.address, message_type)
+            for node in nodes
+        ]
+        done, pending = wait(futures, timeout=ELECTION_FANOUT_DEADLINE)
+        for future in pending:
+            future.cancel()
+        return sum(1 for future in done if future.result())
+
     def wait_for_longer(self):
         """
         Waits for a certain amount of time (TOTAL_DELAY) for a coordinator message. If a coordinator message is received during this time,
         it sets the algorithm flag and the coordinator message flag to False and returns 0. If no coordinator message is received,
         it sets the algorithm flag to False and returns 1.
+
+        Must be called with the lock held. The lock is released while waiting, and is
+        released on return if a coordinator message was received and held otherwise.
         """
-        timeout_value = time.time() + TOTAL_DELAY
-        while time.time() < timeout_value:
-            self.lock.acquire()
-            if self.coordinatorMessageFlag == True:
-                self.algoFlag = False
-                self.coordinatorMessageFlag = False
-                self.lock.release()
-                return 0
+        if self.election_state.wait_for(
+            lambda: self.coordinatorMessageFlag, timeout=TOTAL_DELAY
+        ):
+            self.algoFlag = False
+            self.coordinatorMessageFlag = False
             self.lock.release()
+            return 0
 
-        self.lock.acquire()
         self.algoFlag = False
         return 1
 
+    def leader_known(self, leader_id: int):
+        # Called with the lock held.
+        if leader_id != self.known_leader:
+            self.known_leader = leader_id
+            LEADER_CHANGES.inc()
+
     def message_answered(self):
         """
         Decreases the number of checked nodes by 1.
         """
-        self.lock.acquire()
-        self.checkedNodesLength -= 1
-        self.lock.release()
+        with self.election_state:
+            self.checkedNodesLength -= 1
+            self.election_state.notify_all()
 
     def process_end_message(self, msg: dict):
         """
@@ -203,174 +330,246 @@ class BullyLeaderElection:
         Args:
             msg (dict): The END message.
         """
-        self.lock.acquire()
-        self.coordinatorport = msg["port"]
-        self.leaderID = msg["id"]
-        self.leaderIP = msg["ip"]
-        self.leaderPort = msg["port"]
-        self.is_leader_elected.set()
-        self.coordinatorMessageFlag = True
-        self.lock.release()
+        with self.election_state:
+            self.leader_known(msg["id"])
+            self.coordinatorport = msg["port"]
+            self.leaderID = msg["id"]
+            self.leaderIP = msg["ip"]
+            self.leaderPort = msg["port"]
+            self.is_leader_elected.set()
+            self.coordinatorMessageFlag = True
+            self.leader_lost.clear()
+            self.pub_sub.set_leader_id(self.leaderID)
+            self.election_state.notify_all()
 
     def process_election_message(self, msg: dict):
         """
         Processes an ELECTION message. Sends an ANSWER message to the sender of the ELECTION message. If the algorithm flag is False,
-        it initiates a new election.
+        it requests a new election. The election runs on the run_elections thread, because it waits for ANSWER and END messages
+        that the dispatcher has to receive. The ANSWER is sent without the lock, so a
+        sender that is slow to accept does not hold up the messages that need it.
 
         Args:
             msg (dict): The ELECTION message.
         """
 
         self.lock.acquire()
-        sock = utils.initialize_socket(self.nodeIP)
-        try:
-            print((msg["ip"], msg["port"]))
-            sock.connect((msg["ip"], msg["port"]))
-            self.forward_message(msg, self.nodeId, Type["ANSWER"], sock)
-        except ConnectionRefusedError:
-            pass
-
-        sock.close()
+        print((msg["ip"], msg["port"]))
 
         if self.algoFlag == False:
-            self.lock.release()
-            self.initiate_election()
-            return
+            # Set here rather than when the election starts, so that another ELECTION
+            # message received in the meantime does not request a second one.
+            self.algoFlag = True
+            self.election_requested = True
+            self.election_due.notify_all()
 
         self.lock.release()
+        self.send_to_node((msg["ip"], msg["port"]), Type["ANSWER"])
 
-    def low_id_node(self, index: int) -> int:
+    def low_id_node(self, higher: list) -> int:
         """
-        Checks if there are any nodes with a lower ID that are still up. If there are, it sends an ELECTION message to each of them.
+        Checks if there are any nodes with a lower ID that are still up. If there are, it sends an ELECTION message to all of them at once.
         Then, it waits for a certain amount of time for an ANSWER message from each of them. If it receives an ANSWER message from all of them,
         it returns 0. If it doesn't receive an ANSWER message from at least one of them, it returns 1.
 
+        Must be called with the lock held. The lock is released while waiting, and is released on return if 0 is returned and
+        held otherwise.
+
         Args:
-            index (int): The current position in the list of nodes.
+            higher (list): The nodes with a higher ID than this node.
 
         Returns:
             int: 0 if an ANSWER message is received from all nodes with a lower ID, 1 otherwise.
         """
 
         self.leaderID = DEFAULT_ID
-        self.checkedNodesLength = len(self.nodes) - index
+        self.checkedNodesLength = len(higher)
         ack_nodes = self.checkedNodesLength
-        exit = False
-        for node in range(index, len(self.nodes)):
-            sock = utils.initialize_socket(self.nodeIP)
-            try:
-                sock.connect((self.nodes[node]["ip"], self.nodes[node]["port"]))
-                self.forward_message(
-                    self.nodes[node], self.nodeId, Type["ELECTION"], sock
-                )
-                sock.close()
-                exit = True
-            except ConnectionRefusedError:
-                sock.close()
-                continue
-
-        if exit == False:
-            return 1
+        # Sent without the lock, so that ANSWER and ELECTION messages are processed
+        # while peers that are down are still being tried.
         self.lock.release()
-        timeout_interval = time.time() + TOTAL_DELAY
-        while time.time() < timeout_interval:
-            self.lock.acquire()
-            if self.checkedNodesLength != ack_nodes:
-                self.lock.release()
-                if self.wait_for_longer() == 0:
-                    return 0
-                else:
-                    return 1
-            self.lock.release()
-
+        reached = self.send_to_nodes(higher, Type["ELECTION"])
         self.lock.acquire()
-        return 1
+        if reached == 0:
+            return 1
+        # An END message also ends the wait: the node that sent it has answered too.
+        if not self.election_state.wait_for(
+            lambda: self.checkedNodesLength != ack_nodes or self.coordinatorMessageFlag,
+            timeout=TOTAL_DELAY,
+        ):
+            return 1
+        return self.wait_for_longer()
     
-    def monitor_connections(self):
+    def register_handlers(self):
         """
-        Monitors connections to the node. If a connection is received, it starts a new thread to handle the connection.
+        Fills the dispatcher's handler table. Handlers that take the lock or connect
+        to other nodes run on its worker pool, so they never hold up the others.
         """
-        while True:
-            self.lock.acquire()
-
-            self.socket.settimeout(None)
-            self.lock.release()
-
-            try:
-                connection, addr = self.socket.accept()
-            except socket.timeout:
-                self.logging.debug(
-                    f"[Node]: (ip:{self.nodeIP} port:{self.nodePort} id:{self.nodeId})\n[Terminates]\n"
-                )
-                self.socket.close()
-                os._exit(1)
-
-            data = connection.recv(BUFF_SIZE)
-
-            if not data:
-                continue
+        dispatcher = self.dispatcher
+        dispatcher.register(Type["PEER_LINK"], self.open_peer_link, NodeDispatcher.CONNECTION)
+        # The heartbeat ACK only sleeps when delays are simulated.
+        dispatcher.register(
+            Type["HEARTBEAT"],
+            self.process_heartbeat,
+            NodeDispatcher.POOL if self.delay else NodeDispatcher.INLINE,
+        )
+        dispatcher.register(Type["SHARD_LOOKUP"], lambda msg: self.pub_sub.shard_lookup_reply())
+        dispatcher.register(Type["SUBSCRIBE"], self.process_subscribe_message)
+        dispatcher.register(Type["ANSWER"], lambda msg: self.message_answered(), NodeDispatcher.POOL)
+        dispatcher.register(Type["ELECTION"], self.process_election_message, NodeDispatcher.POOL)
+        dispatcher.register(Type["END"], self.process_end_message, NodeDispatcher.POOL)
+        dispatcher.register(Type["CONNECT_TO_CLIENT"], self.process_client_message, NodeDispatcher.POOL)
+        dispatcher.register(
+            Type["PUBLISH_DATA_TO_SUBSCRIBERS"], self.process_publish_message, NodeDispatcher.POOL
+        )
 
-            data = eval(data.decode("utf-8"))
+    def open_peer_link(self, connection: socket, decoder, msg: dict):
+        codec = wire_codec.negotiate(msg.get("codecs"))
+        print(f"Peer link opened by node: {msg['id']} using codec {codec}")
+        try:
+            utils.send_frame(
+                connection,
+                utils.create_server_message(self.nodeId, Type["ACK"].value, {"codec": codec}),
+            )
+        except OSError as e:
+            print(f"Peer link from node {msg['id']} failed: {e}")
+            connection.close()
+            return
+        self.receive_peer_link(connection, decoder, msg["id"])
+
+    def process_heartbeat(self, msg: dict):
+        if self.leaderID != self.nodeId:
+            print(f"Heartbeat from node {msg['id']} ignored: this node is not the leader")
+            return None
+        print("Heartbeat received from node: ", msg["id"])
+        HEARTBEATS.inc()
+        utils.delay(self.delay, TOTAL_DELAY)
+        print("Sending ack to node: ", msg["id"])
+        return utils.build_message(self.nodeId, Type["ACK"].value, self.nodePort, self.nodeIP)
+
+    def process_subscribe_message(self, msg: dict) -> bytes:
+        if msg["buisnessType"] == "PING":
+            msg = {"response": "ACK"}
+        print(msg, "\n\n")
+        return wire_codec.encode(msg)
+
+    def process_client_message(self, msg: dict):
+        print(f"Received data from client: {msg}")
+        self.pub_sub.process_client_data(msg)
+
+    def process_publish_message(self, msg: dict):
+        print(f"Received data from Publisher: {msg}")
+        self.pub_sub.publish_event_to_subscribers(
+            msg["businessType"], msg.get("offer", ""), msg.get("location")
+        )
 
-            if self.leaderID == self.nodeId and data["type"] == Type["HEARTBEAT"].value:
-                print("Heartbeat received from node: ", data["id"])
-                utils.delay(self.delay, TOTAL_DELAY)
+    def receive_peer_link(self, connection: socket, decoder, peer_id: int):
+        """
+        Reads the messages another node sends over its long-lived peer link until the
+        link is closed.
 
-                msg = utils.build_message(
-                    self.nodeId, Type["ACK"].value, self.nodePort, self.nodeIP
-                )
-                print("Sending ack to node: ", data["id"])
-                connection.send(msg)
-                connection.close()
-                continue
+        Args:
+            connection (socket): The accepted peer link connection.
+            decoder (FrameDecoder): The decoder that read the PEER_LINK frame.
+            peer_id (int): The ID of the node on the other end.
+        """
+        try:
+            while True:
+                data = decoder.next_frame(connection)
+                if data is None:
+                    break
+                if data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+                    print("Dropping message: size exceeds MAX_MESSAGE_SIZE")
+                    continue
+
+                data = utils.parse_message(data)
+                if not data:
+                    continue
+                if data["type"] == Type["PUBLISH_DATA_TO_SUBSCRIBERS"].value:
+                    print(f"Received data from node {peer_id}: {data}")
+                    self.pub_sub.publish_event_to_subscribers(
+                        data["businessType"], data.get("offer", ""), data.get("location")
+                    )
+                elif data["type"] == Type["PUBLISH_BATCH"].value:
+                    print(f"Received batch of {len(data['offers'])} offers from node {peer_id}")
+                    self.pub_sub.publish_batch(data["offers"])
+                elif data["type"] == Type["SHARD_FORWARD"].value:
+                    print(f"Received {len(data['offers'])} offers for this node's shards from {peer_id}")
+                    self.pub_sub.route_offers(data["offers"], data.get("forwarded", False))
+                elif data["type"] == Type["CONNECT_TO_CLIENT"].value:
+                    print(f"Subscriber registration forwarded by node {peer_id}: {data}")
+                    self.pub_sub.process_client_data(data)
+                elif data["type"] in (
+                    Type["SUBSCRIPTION_DELTA"].value,
+                    Type["SUBSCRIPTION_SNAPSHOT"].value,
+                ):
+                    self.pub_sub.replication.apply(data)
+                elif data["type"] == Type["SUBSCRIPTION_SYNC"].value:
+                    self.pub_sub.replication.sync(data["id"], data["epoch"], data["since"])
+                else:
+                    print(f"Unknown type on peer link: {data['type']}")
+        except OSError as e:
+            print(f"Peer link from node {peer_id} failed: {e}")
+        finally:
+            print(f"Peer link from node {peer_id} closed")
+            connection.close()
 
-            elif data["type"] == Type["ANSWER"].value:
-                self.message_answered()
-                connection.close()
-                continue
+    def member_changed(self, node: dict, status: MemberStatus):
+        """
+        Keeps the topology in line with the gossip membership view: dead nodes are
+        removed from it and nodes that join or come back are added. Sets
+        leader_lost if the dead node is the leader. The shards of a node that left or
+        joined then move to their new owners.
 
-            elif data["type"] == Type["CONNECT_TO_CLIENT"].value:
-                print(f"Received data from client: {data}")
-                connection.close()
+        Args:
+            node (dict): The node's ID, IP address and port.
+            status (MemberStatus): Its new status.
+        """
+        with self.lock:
+            if status is MemberStatus.DEAD and self.topology.remove(node["id"]) is not None:
+                print(f"Node {node['id']} left the cluster, the nodes are now: {self.topology.ids}")
+                if node["id"] == self.leaderID and self.leaderID != self.nodeId:
+                    self.leader_lost.set()
+            elif status is MemberStatus.ALIVE and node["id"] not in self.topology:
+                self.topology.add(node)
+                print(f"Node {node['id']} joined the cluster, the nodes are now: {self.topology.ids}")
+            else:
+                return
+        self.pub_sub.update_shards()
 
-                self.pub_sub.process_client_data(data)
+    def follow_register(self):
+        """
+        Passes the nodes that the register reports as joined or left on to the gossip
+        membership, which adds them to or removes them from the node list through
+        member_changed and spreads the change. A node that left closed its
+        registration, so it is declared dead without waiting for the suspicion
+        timeout. Runs until the register goes away; gossip alone keeps the
+        membership from then on.
+        """
+        while True:
+            try:
+                data = self.register_decoder.next_frame(self.register_socket)
+            except OSError:
+                data = None
+            if data is None:
+                print("Lost the connection to the register service")
+                return
+            if data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
                 continue
-
-            elif data["type"] == Type["PUBLISH_DATA_TO_SUBSCRIBERS"].value:
-                print(f"Received data from Publisher: {data}")
-                connection.close()
-
-                self.pub_sub.publish_event_to_subscribers(data["businessType"], data.get("offer", ""))
+            msg = utils.parse_message(data)
+            if msg.get("type") != Type["TOPOLOGY_UPDATE"].value or msg["version"] <= self.topology_version:
                 continue
-
-            elif data["type"] == Type["SUBSCRIBE"].value:
-                if data["buisnessType"] == "PING":
-                    data = {"response": "ACK"}
-                    str(data).encode("utf-8")
-                    print(data)
-                    connection.send(str(data).encode("utf-8"))
-                else:
-                    print(data, "\n\n")
-                    str(data).encode("utf-8")
-                    print(data)
-                    msg = utils.build_message(
-                        self.nodeId, Type["SUBSCRIBE"].value, self.nodePort, self.nodeIP
+            self.topology_version = msg["version"]
+            members = self.gossip.get_view()["members"]
+            for node_id in msg["left"]:
+                if node_id in members:
+                    member = members[node_id]
+                    self.gossip.learn(
+                        {"id": node_id, "ip": member["ip"], "port": member["port"]}, MemberStatus.DEAD
                     )
-                    connection.send(str(data).encode("utf-8"))
-                connection.close()
-                continue
-
+            for node in msg["joined"]:
+                self.gossip.learn(node, MemberStatus.ALIVE)
 
-            func = {
-                Type["ELECTION"].value: self.process_election_message,
-                Type["END"].value: self.process_end_message,
-            }
-
-            if data["type"] in func:
-                func[data["type"]](data)
-            else:
-                print(f"Unknown type: {data['type']}")
-            connection.close()
     def handler(self, signum: int, frame):
         """
         Handles a SIGINT signal. Shuts down the node and logs the shutdown.
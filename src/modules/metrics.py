@@ -0,0 +1,263 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from constants.constants import METRICS_HOST, METRICS_LATENCY_BUCKETS
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: str) -> list:
+        return [(name, labels, self.value)]
+
+
+class GaugeValue(CounterValue):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    def __init__(self, buckets: tuple):
+        self.bounds = buckets
+        # One count per bucket, the last one for observations above every bound.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name: str, labels: str) -> list:
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        prefix = labels[:-1] + "," if labels else "{"
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", f'{prefix}le="{format_value(bound)}"}}', cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Metric:
+    def __init__(self, kind: str, name: str, help: str, labels: tuple = (), function=None, buckets=None):
+        """
+        A named metric, with one value per combination of label values.
+
+        Args:
+            kind (str): counter, gauge or histogram.
+            name (str): The metric name.
+            help (str): What it measures, for the HELP line.
+            labels (tuple): The label names.
+            function (callable): For counters and gauges without labels, returns
+                the value when the metric is scraped instead of it being recorded.
+            buckets (tuple): The upper bounds of the buckets of a histogram.
+        """
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.function = function
+        self.buckets = tuple(buckets or METRICS_LATENCY_BUCKETS)
+        self.values = {}
+        self.lock = Lock()
+        if not self.label_names:
+            self.value = self.labels()
+            # Recording on a metric without labels calls its value directly.
+            for method in ("inc", "dec", "set", "observe"):
+                if hasattr(self.value, method):
+                    setattr(self, method, getattr(self.value, method))
+
+    def labels(self, *values):
+        """
+        Returns:
+            The value for these label values, to record with. Hot paths keep it
+            rather than looking it up on every call.
+        """
+        key = tuple(str(value) for value in values)
+        value = self.values.get(key)
+        if value is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} takes the labels {self.label_names}, got {values}")
+            with self.lock:
+                value = self.values.get(key)
+                if value is None:
+                    if self.kind == "histogram":
+                        value = HistogramValue(self.buckets)
+                    elif self.kind == "gauge":
+                        value = GaugeValue()
+                    else:
+                        value = CounterValue()
+                    self.values[key] = value
+        return value
+
+    # For metrics without labels, replaced by the methods of their value.
+    def inc(self, amount=1):
+        self.value.inc(amount)
+
+    def set(self, value):
+        self.value.set(value)
+
+    def observe(self, value: float):
+        self.value.observe(value)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                print(f"Metric {self.name} not collected: {e}")
+                return []
+            lines.append(f"{self.name} {format_value(value)}")
+            return lines
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            labels = ""
+            if key:
+                pairs = ",".join(f'{name}="{escape(label)}"' for name, label in zip(self.label_names, key))
+                labels = "{" + pairs + "}"
+            for name, sample_labels, sample in value.samples(self.name, labels):
+                lines.append(f"{name}{sample_labels} {format_value(sample)}")
+        return lines
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value)) if value else "0"
+    return str(value)
+
+
+def escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        The metrics of one process. Components create theirs once, when they are
+        imported or constructed, and record into them on the hot path: a counter
+        increment or histogram observation takes a lock and adds a number, nothing
+        is formatted until the metrics are scraped.
+        """
+        self.metrics = {}
+        self.lock = Lock()
+
+    def metric(self, kind: str, name: str, help: str, labels: tuple = (), function=None, buckets=None) -> Metric:
+        """
+        Returns the metric with this name, creating it the first time. A function
+        given for an existing metric replaces its previous one, so the component
+        constructed last is the one scraped.
+
+        Raises:
+            ValueError: If the name is already used by a metric of another kind
+                or with other labels.
+        """
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = Metric(kind, name, help, labels, function, buckets)
+                self.metrics[name] = metric
+            elif metric.kind != kind or metric.label_names != tuple(labels):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind} with {metric.label_names}")
+            elif function is not None:
+                metric.function = function
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple = (), function=None) -> Metric:
+        return self.metric("counter", name, help, labels, function)
+
+    def gauge(self, name: str, help: str, labels: tuple = (), function=None) -> Metric:
+        return self.metric("gauge", name, help, labels, function)
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = None) -> Metric:
+        return self.metric("histogram", name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+# The registry of this process, which every component records into.
+REGISTRY = MetricsRegistry()
+REGISTRY.counter("process_cpu_seconds_total", "CPU time used by this process", function=time.process_time)
+REGISTRY.gauge("process_threads", "Threads running in this process", function=threading.active_count)
+
+
+class MetricsServer:
+    def __init__(self, port: int, host: str = METRICS_HOST, registry: MetricsRegistry = REGISTRY):
+        """
+        Serves the metrics of a registry over HTTP on GET /metrics, for Prometheus
+        to scrape.
+
+        Args:
+            port (int): The port to listen on, 0 for any free one.
+            host (str): The address to listen on, local only by default.
+            registry (MetricsRegistry): The metrics to serve.
+        """
+        self.registry = registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self) -> int:
+        """
+        Serves the metrics on a background thread.
+
+        Returns:
+            int: The port the metrics are served on.
+        """
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        print(f"Serving metrics on http://{self.server.server_address[0]}:{self.port}/metrics")
+        return self.port
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
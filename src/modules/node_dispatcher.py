@@ -0,0 +1,183 @@
+import selectors
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from threading import Semaphore, Thread
+
+from constants.constants import (
+    BUFF_SIZE,
+    DISPATCH_QUEUE_SIZE,
+    DISPATCH_REPLY_TIMEOUT,
+    DISPATCH_WORKERS,
+    ErrorCode,
+    Type,
+)
+from utils import utils as helper
+from .metrics import REGISTRY
+
+DISPATCHED = REGISTRY.counter(
+    "lbn_dispatched_messages_total", "Messages read from the node socket, by how they were handled", ("mode",)
+)
+
+
+class NodeDispatcher:
+    # Handler modes, see register.
+    INLINE = "inline"
+    POOL = "pool"
+    CONNECTION = "connection"
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        workers: int = DISPATCH_WORKERS,
+        queue_size: int = DISPATCH_QUEUE_SIZE,
+    ):
+        """
+        Reads the messages other nodes send to the node socket with a selector, so no
+        connection waits for another one to be handled, and dispatches each message
+        by its Type to the handler registered for it.
+
+        Every connection carries one message, except those a CONNECTION handler
+        takes over. Handlers that only look at local state run on the selector
+        thread; handlers that can block, on the lock or on the network, run on a
+        pool of worker threads, with at most queue_size messages waiting for one.
+        Messages that arrive when the queue is full are dropped.
+
+        Args:
+            sock (socket): The bound and listening node socket.
+            workers (int): The number of threads running POOL handlers.
+            queue_size (int): The number of POOL messages that may be waiting or
+                running at the same time.
+        """
+        self.sock = sock
+        self.selector = selectors.DefaultSelector()
+        self.handlers = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatch")
+        self.queue_slots = Semaphore(queue_size)
+        self.running = False
+        self.stats = {"accepted": 0, "inline": 0, "pool": 0, "connection": 0, "dropped": 0, "unknown": 0}
+
+    def register(self, message_type: Type, handler, mode: str = INLINE):
+        """
+        Sets the handler for a message type.
+
+        Args:
+            message_type (Type): The type of the message.
+            handler (callable): For INLINE and POOL, called with the decoded message;
+                bytes it returns are sent back as a frame before the connection is
+                closed. INLINE handlers must not block. For CONNECTION, called on a
+                thread of its own with the connection, its FrameDecoder and the
+                message, and owns the connection from then on.
+            mode (str): INLINE, POOL or CONNECTION.
+        """
+        self.handlers[message_type.value] = (handler, mode)
+
+    def serve_forever(self):
+        """
+        Accepts connections and dispatches their messages until the socket is closed.
+        """
+        self.sock.setblocking(False)
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.running = True
+        while self.running:
+            try:
+                events = self.selector.select()
+            except (OSError, ValueError):
+                break
+            for key, _ in events:
+                if key.fileobj is self.sock:
+                    self.accept()
+                else:
+                    self.read(key.fileobj, key.data)
+        self.selector.close()
+        self.executor.shutdown(wait=False)
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except BlockingIOError:
+                return
+            except OSError:
+                self.running = False
+                return
+            connection.setblocking(False)
+            self.selector.register(connection, selectors.EVENT_READ, helper.FrameDecoder())
+            self.stats["accepted"] += 1
+
+    def read(self, connection: socket.socket, decoder):
+        try:
+            data = connection.recv(BUFF_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.selector.unregister(connection)
+            connection.close()
+            return
+        decoder.frames.extend(decoder.feed(data))
+        if not decoder.frames:
+            return
+
+        # The rest of the connection belongs to the handler of its first message.
+        self.selector.unregister(connection)
+        connection.setblocking(True)
+        payload = decoder.frames.popleft()
+        if payload is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+            print("Dropping message: size exceeds MAX_MESSAGE_SIZE")
+            connection.close()
+            return
+        msg = helper.parse_message(payload)
+        entry = self.handlers.get(msg.get("type"))
+        if entry is None:
+            if msg:
+                print(f"Unknown type: {msg.get('type')}")
+            self.stats["unknown"] += 1
+            connection.close()
+            return
+
+        handler, mode = entry
+        self.stats[mode] += 1
+        DISPATCHED.labels(mode).inc()
+        if mode == self.CONNECTION:
+            thread = Thread(target=handler, args=(connection, decoder, msg))
+            thread.daemon = True
+            thread.start()
+        elif mode == self.POOL:
+            if not self.queue_slots.acquire(blocking=False):
+                print(f"Dropping message of type {msg['type']}: all dispatch workers are busy")
+                self.stats["dropped"] += 1
+                DISPATCHED.labels("dropped").inc()
+                connection.close()
+                return
+            self.executor.submit(self.run_handler, handler, connection, msg)
+        else:
+            self.handle(handler, connection, msg)
+
+    def run_handler(self, handler, connection: socket.socket, msg: dict):
+        try:
+            self.handle(handler, connection, msg)
+        finally:
+            self.queue_slots.release()
+
+    @staticmethod
+    def handle(handler, connection: socket.socket, msg: dict):
+        try:
+            reply = handler(msg)
+            if reply is not None:
+                # Replies are small, so this only waits on a peer that stopped reading.
+                connection.settimeout(DISPATCH_REPLY_TIMEOUT)
+                helper.send_frame(connection, reply)
+        except OSError as e:
+            print(f"Could not answer message of type {msg['type']}: {e}")
+        except Exception as e:
+            print(f"Exception occurred while handling message of type {msg['type']}: {e}")
+        finally:
+            connection.close()
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
@@ -0,0 +1,571 @@
+import bisect
+import fcntl
+from array import array
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Condition, Event, Lock, Thread
+
+from constants.constants import (
+    OFFER_LOG_FSYNC,
+    OFFER_LOG_FSYNC_INTERVAL,
+    OFFER_LOG_INDEX_INTERVAL,
+    OFFER_LOG_SEGMENT_BYTES,
+)
+
+# offset, timestamp, payload length, CRC32 of the payload
+RECORD_HEADER = struct.Struct("!QdII")
+# offset relative to the segment's base offset, byte position in the segment
+INDEX_ENTRY = struct.Struct("!II")
+
+FSYNC_POLICIES = ("always", "batch", "interval", "never")
+
+
+class Segment:
+    def __init__(self, directory: str, base_offset: int):
+        """
+        One file of the offer log holding the records from base_offset on, and its
+        sparse index with the position of one record every OFFER_LOG_INDEX_INTERVAL
+        bytes. Records are read through a read-only memory map of the file.
+
+        Args:
+            directory (str): The log directory.
+            base_offset (int): The offset of the first record in the segment.
+        """
+        self.base_offset = base_offset
+        name = os.path.join(directory, f"{base_offset:020d}")
+        self.file = open(name + ".log", "a+b")
+        self.index_file = open(name + ".index", "a+b")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.next_offset = base_offset
+        self.index = []
+        self.positions = []
+        self.times = []
+        self.last_indexed = -OFFER_LOG_INDEX_INTERVAL
+        self.map = None
+        self.map_lock = Lock()
+        self.load_index()
+
+    def load_index(self):
+        self.index_file.seek(0)
+        data = self.index_file.read()
+        view = self.view()
+        for start in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            relative, position = INDEX_ENTRY.unpack_from(data, start)
+            if position + RECORD_HEADER.size > self.size or (
+                self.positions and position <= self.positions[-1]
+            ):
+                break
+            self.index.append(self.base_offset + relative)
+            self.positions.append(position)
+            self.times.append(RECORD_HEADER.unpack_from(view, position)[1])
+        if view is not None:
+            view.release()
+        # Drop index entries that point past the end of the log, e.g. after a crash.
+        self.index_file.truncate(len(self.index) * INDEX_ENTRY.size)
+
+    def recover(self):
+        """
+        Finds the next offset by reading the records after the last index entry,
+        and cuts off a record that was only partly written.
+        """
+        # Scan again from the last index entry, which the scan adds back.
+        if self.index:
+            self.next_offset = self.index.pop()
+            position = self.positions.pop()
+            self.times.pop()
+            self.index_file.truncate(len(self.index) * INDEX_ENTRY.size)
+        else:
+            self.next_offset = self.base_offset
+            position = 0
+        self.last_indexed = self.positions[-1] if self.positions else -OFFER_LOG_INDEX_INTERVAL
+
+        view = self.view()
+        while position + RECORD_HEADER.size <= self.size:
+            offset, timestamp, length, crc = RECORD_HEADER.unpack_from(view, position)
+            end = position + RECORD_HEADER.size + length
+            if offset != self.next_offset or end > self.size:
+                break
+            if zlib.crc32(view[position + RECORD_HEADER.size : end]) != crc:
+                break
+            self.add_index_entry(offset, position, timestamp)
+            self.next_offset = offset + 1
+            position = end
+        if view is not None:
+            view.release()
+        if position < self.size:
+            print(f"Offer log: discarding {self.size - position} bytes after offset {self.next_offset - 1}")
+            self.file.truncate(position)
+            self.size = position
+            self.map = None
+
+    def add_index_entry(self, offset: int, position: int, timestamp: float):
+        if position - self.last_indexed < OFFER_LOG_INDEX_INTERVAL:
+            return
+        # Readers look up index and then positions, so positions grows first.
+        self.positions.append(position)
+        self.times.append(timestamp)
+        self.index.append(offset)
+        self.last_indexed = position
+        self.index_file.write(INDEX_ENTRY.pack(offset - self.base_offset, position))
+
+    def write(self, records: list, timestamp: float):
+        """
+        Appends records. Called with the log's append lock held.
+
+        Args:
+            records (list): The payloads, as bytes.
+            timestamp (float): The time stored with the records.
+        """
+        chunks = []
+        position = self.size
+        for payload in records:
+            self.add_index_entry(self.next_offset, position, timestamp)
+            chunks.append(
+                RECORD_HEADER.pack(self.next_offset, timestamp, len(payload), zlib.crc32(payload))
+            )
+            chunks.append(payload)
+            position += RECORD_HEADER.size + len(payload)
+            self.next_offset += 1
+        self.file.write(b"".join(chunks))
+        self.file.flush()
+        self.index_file.flush()
+        self.size = position
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        os.fsync(self.index_file.fileno())
+
+    def view(self):
+        """
+        Returns:
+            memoryview: The segment's records so far, or None if it is empty.
+        """
+        size = self.size
+        if size == 0:
+            return None
+        with self.map_lock:
+            # The map only grows; readers holding an older one can keep using it.
+            if self.map is None or len(self.map) < size:
+                self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+            current = self.map
+        return memoryview(current)[:size]
+
+    def read(self, offset: int, max_records: int, max_bytes: int) -> list:
+        """
+        Returns:
+            list: Up to max_records (offset, timestamp, payload) tuples from offset on,
+            stopping early once max_bytes of payload have been read.
+        """
+        view = self.view()
+        if view is None:
+            return []
+        slot = bisect.bisect_right(self.index, offset) - 1
+        position = self.positions[slot] if slot >= 0 else 0
+        records = []
+        read_bytes = 0
+        size = len(view)
+        try:
+            while position + RECORD_HEADER.size <= size and len(records) < max_records:
+                record_offset, timestamp, length, _ = RECORD_HEADER.unpack_from(view, position)
+                start = position + RECORD_HEADER.size
+                position = start + length
+                if record_offset < offset:
+                    continue
+                if records and read_bytes + length > max_bytes:
+                    break
+                records.append((record_offset, timestamp, bytes(view[start:position])))
+                read_bytes += length
+        finally:
+            view.release()
+        return records
+
+    def read_offsets(self, offsets: list) -> list:
+        """
+        Reads the records with the given offsets, which must be sorted and in this
+        segment. Uses the index to skip ahead between offsets that are far apart.
+
+        Returns:
+            list: (offset, timestamp, payload) tuples.
+        """
+        view = self.view()
+        if view is None:
+            return []
+        records = []
+        current = self.base_offset
+        position = 0
+        size = len(view)
+        try:
+            for offset in offsets:
+                slot = bisect.bisect_right(self.index, offset) - 1
+                if slot >= 0 and self.index[slot] > current:
+                    current = self.index[slot]
+                    position = self.positions[slot]
+                while position + RECORD_HEADER.size <= size:
+                    record_offset, timestamp, length, _ = RECORD_HEADER.unpack_from(view, position)
+                    start = position + RECORD_HEADER.size
+                    if record_offset < offset:
+                        position = start + length
+                        current = record_offset + 1
+                        continue
+                    if record_offset == offset:
+                        records.append((offset, timestamp, bytes(view[start : start + length])))
+                    break
+        finally:
+            view.release()
+        return records
+
+    def offset_for_time(self, timestamp: float):
+        """
+        Returns:
+            int: The offset of the first record stored at or after timestamp, or None
+            if there is no such record in the segment.
+        """
+        view = self.view()
+        if view is None:
+            return None
+        slot = max(bisect.bisect_left(self.times, timestamp) - 1, 0)
+        position = self.positions[slot] if self.positions else 0
+        try:
+            while position + RECORD_HEADER.size <= len(view):
+                record_offset, record_time, length, _ = RECORD_HEADER.unpack_from(view, position)
+                if record_time >= timestamp:
+                    return record_offset
+                position += RECORD_HEADER.size + length
+        finally:
+            view.release()
+        return None
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+        self.map = None
+
+
+class OfferLog:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = OFFER_LOG_SEGMENT_BYTES,
+        fsync: str = OFFER_LOG_FSYNC,
+        fsync_interval: float = OFFER_LOG_FSYNC_INTERVAL,
+        key=None,
+    ):
+        """
+        Append-only log of the offers the leader receives, so they survive a crash
+        and can be read again by offset.
+
+        Every offer gets the next offset. Records go into segment files named after
+        their first offset, and a new segment is started once the current one
+        reaches segment_bytes. Each segment has a sparse index, so a read finds its
+        starting point with a binary search and scans at most
+        OFFER_LOG_INDEX_INTERVAL bytes before the first record it returns.
+
+        With the "batch" fsync policy an append returns once its records are on
+        disk, but appends do not fsync themselves: a flusher thread fsyncs
+        whatever has been written since its last fsync and wakes every appender
+        that is covered, so concurrent publishers share one fsync.
+
+        If a key function is given, the log also keeps the offsets of the records
+        with each key in memory, e.g. per business type, so the records of one key
+        can be found without reading the others. These offsets are rebuilt by
+        reading the whole log when it is opened.
+
+        Only one process can open a log directory at a time.
+
+        Args:
+            directory (str): Where the segment files are kept.
+            segment_bytes (int): Size at which a new segment is started.
+            fsync (str): "always", "batch", "interval" or "never".
+            fsync_interval (float): Seconds between fsyncs with the "interval" policy.
+            key (callable): Returns the key of a record's payload, or None.
+
+        Raises:
+            ValueError: If the fsync policy is unknown.
+            OSError: If the directory is already in use by another process.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.directory = directory
+        # Offsets are only meaningful within one log, so they are sent with its name.
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, "lock"), "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            raise
+
+        bases = sorted(
+            int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log")
+        )
+        self.segments = [Segment(directory, base) for base in bases] or [Segment(directory, 0)]
+        for segment, following in zip(self.segments, self.segments[1:]):
+            segment.next_offset = following.base_offset
+        self.segments[-1].recover()
+        self.bases = [segment.base_offset for segment in self.segments]
+
+        self.key = key
+        self.keys = {}
+        self.last_timestamp = 0.0
+        if self.segments[-1].times:
+            self.last_timestamp = self.segments[-1].times[-1]
+        if key is not None:
+            self.load_keys()
+
+        self.lock = Lock()
+        self.synced = Condition()
+        self.synced_offset = self.next_offset
+        self.fsyncs = 0
+        self.sync_requested = Event()
+        self.closed = False
+        self.flusher = None
+        if fsync in ("batch", "interval"):
+            self.flusher = Thread(target=self.flush_loop)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    @property
+    def next_offset(self) -> int:
+        return self.segments[-1].next_offset
+
+    @property
+    def first_offset(self) -> int:
+        return self.segments[0].base_offset
+
+    def append(self, payload: bytes, timestamp: float = None) -> int:
+        """
+        Appends one record.
+
+        Returns:
+            int: The record's offset.
+        """
+        return self.append_many([payload], timestamp)[0]
+
+    def append_many(self, payloads: list, timestamp: float = None) -> list:
+        """
+        Appends records with a single write. Depending on the fsync policy, waits
+        until they are on disk.
+
+        Args:
+            payloads (list): The records, as bytes.
+            timestamp (float): Stored with the records; defaults to now.
+
+        Returns:
+            list: The offsets of the records.
+        """
+        if not payloads:
+            return []
+        with self.lock:
+            if self.closed:
+                raise ValueError("Offer log is closed")
+            if timestamp is None:
+                # Keep timestamps in offset order so time lookups can use the index.
+                timestamp = max(time.time(), self.last_timestamp)
+            self.last_timestamp = timestamp
+            if self.segments[-1].size >= self.segment_bytes:
+                self.roll()
+            segment = self.segments[-1]
+            first = segment.next_offset
+            segment.write(payloads, timestamp)
+            last = segment.next_offset
+            if self.key is not None:
+                self.add_keys(first, payloads)
+            if self.fsync == "always":
+                segment.sync()
+                self.fsyncs += 1
+                self.synced_offset = last
+        if self.fsync == "batch":
+            self.wait_for_sync(last)
+        return list(range(first, last))
+
+    def load_keys(self):
+        offset = self.first_offset
+        while True:
+            records = self.read(offset, max_records=10000, max_bytes=16 * 1024 * 1024)
+            if not records:
+                break
+            self.add_keys(records[0][0], [payload for _, _, payload in records])
+            offset = records[-1][0] + 1
+
+    def add_keys(self, first: int, payloads: list):
+        for offset, payload in enumerate(payloads, first):
+            key = self.key(payload)
+            if key is None:
+                continue
+            offsets = self.keys.get(key)
+            if offsets is None:
+                offsets = self.keys[key] = array("Q")
+            offsets.append(offset)
+
+    def end_offset(self) -> int:
+        """
+        Returns:
+            int: The offset the next record will get. Every record before it is
+            readable and included in the per-key offsets.
+        """
+        with self.lock:
+            return self.next_offset
+
+    def key_names(self) -> list:
+        with self.lock:
+            return list(self.keys)
+
+    def offsets_for(self, key, start: int = 0, end: int = None) -> array:
+        """
+        Returns:
+            array: The offsets of the records with a key, from start up to but not
+            including end.
+        """
+        with self.lock:
+            offsets = self.keys.get(key)
+            if not offsets:
+                return array("Q")
+            low = bisect.bisect_left(offsets, start)
+            high = len(offsets) if end is None else bisect.bisect_left(offsets, end)
+            return offsets[low:high]
+
+    def offset_for_time(self, timestamp: float) -> int:
+        """
+        Returns:
+            int: The offset of the first record stored at or after timestamp, or
+            next_offset if there is none.
+        """
+        segments = self.segments
+        starts = [segment.times[0] if segment.times else float("inf") for segment in segments]
+        slot = max(bisect.bisect_right(starts, timestamp) - 1, 0)
+        for segment in segments[slot:]:
+            offset = segment.offset_for_time(timestamp)
+            if offset is not None:
+                return offset
+        return self.next_offset
+
+    def read_offsets(self, offsets) -> list:
+        """
+        Reads the records with the given sorted offsets.
+
+        Returns:
+            list: (offset, timestamp, payload) tuples.
+        """
+        records = []
+        run = []
+        run_segment = None
+        for offset in offsets:
+            slot = bisect.bisect_right(self.bases, offset) - 1
+            if slot < 0:
+                continue
+            segment = self.segments[slot]
+            if segment is not run_segment and run:
+                records.extend(run_segment.read_offsets(run))
+                run = []
+            run_segment = segment
+            run.append(offset)
+        if run:
+            records.extend(run_segment.read_offsets(run))
+        return records
+
+    def roll(self):
+        # Called with the append lock held.
+        current = self.segments[-1]
+        if self.fsync != "never":
+            current.sync()
+        segment = Segment(self.directory, current.next_offset)
+        self.segments.append(segment)
+        self.bases.append(segment.base_offset)
+
+    def wait_for_sync(self, offset: int):
+        with self.synced:
+            while self.synced_offset < offset and not self.closed:
+                self.sync_requested.set()
+                self.synced.wait()
+
+    def sync(self):
+        """
+        fsyncs everything appended so far.
+        """
+        with self.lock:
+            segment = self.segments[-1]
+            target = segment.next_offset
+        if target > self.synced_offset:
+            segment.sync()
+            self.fsyncs += 1
+        with self.synced:
+            self.synced_offset = max(self.synced_offset, target)
+            self.synced.notify_all()
+
+    def flush_loop(self):
+        while not self.closed:
+            if self.fsync == "batch":
+                self.sync_requested.wait()
+            else:
+                self.sync_requested.wait(self.fsync_interval)
+            self.sync_requested.clear()
+            if self.closed:
+                break
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                print(f"Offer log fsync failed: {e}")
+
+    def read(self, offset: int, max_records: int = 1000, max_bytes: int = 1024 * 1024) -> list:
+        """
+        Reads records from offset on, across segments.
+
+        Args:
+            offset (int): The first offset to read.
+            max_records (int): At most this many records are returned.
+            max_bytes (int): Stop once this many payload bytes have been read; at
+                least one record is returned if there is one.
+
+        Returns:
+            list: (offset, timestamp, payload) tuples in offset order.
+        """
+        offset = max(offset, self.first_offset)
+        slot = max(bisect.bisect_right(self.bases, offset) - 1, 0)
+        records = []
+        for segment in self.segments[slot:]:
+            if len(records) >= max_records or max_bytes <= 0:
+                break
+            found = segment.read(offset, max_records - len(records), max_bytes)
+            records.extend(found)
+            max_bytes -= sum(len(record[2]) for record in found)
+            if found:
+                offset = found[-1][0] + 1
+        return records
+
+    def get_stats(self) -> dict:
+        return {
+            "first_offset": self.first_offset,
+            "next_offset": self.next_offset,
+            "synced_offset": self.synced_offset,
+            "segments": len(self.segments),
+            "bytes": sum(segment.size for segment in self.segments),
+            "fsyncs": self.fsyncs,
+            "fsync": self.fsync,
+        }
+
+    def close(self):
+        """
+        fsyncs and closes the log.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            if self.fsync != "never":
+                self.segments[-1].sync()
+            self.closed = True
+        self.sync_requested.set()
+        with self.synced:
+            self.synced_offset = self.next_offset
+            self.synced.notify_all()
+        for segment in self.segments:
+            segment.close()
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
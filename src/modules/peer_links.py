@@ -0,0 +1,282 @@
+import socket
+import time
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+
+from constants.constants import (
+    PEER_CONNECT_TIMEOUT,
+    PEER_QUEUE_SIZE,
+    PEER_RECONNECT_DELAY,
+    PEER_WRITE_BATCH,
+    ErrorCode,
+    Type,
+)
+from utils import codec as wire_codec
+from utils import utils as helper
+
+
+class PeerLink:
+    def __init__(self, own_id: int, own_ip: str, node: dict, on_failure=None):
+        """
+        One long-lived, framed connection to another server node.
+
+        Messages are queued by send and written by a dedicated thread, which joins
+        everything queued at that moment into a single write. The connection is
+        opened lazily and re-opened after a failure. It starts with a PEER_LINK
+        frame listing the codecs this node supports; the receiving node answers with
+        the codec to use and then keeps reading frames from the link.
+
+        Args:
+            own_id (int): The ID of this node.
+            own_ip (str): The IP address of this node.
+            node (dict): The peer's entry from the node list.
+            on_failure (callable): Called from the link's thread with the node ID and
+                the messages of a batch that could not be written, e.g. because the
+                peer is down. Without it they are only counted as dropped.
+        """
+        self.own_id = own_id
+        self.own_ip = own_ip
+        self.node_id = node["id"]
+        self.on_failure = on_failure
+        self.address = (node["ip"], node["port"])
+        self.queue = Queue(maxsize=PEER_QUEUE_SIZE)
+        self.sock = None
+        self.codec = wire_codec.DEFAULT_CODEC
+        self.sent = 0
+        self.dropped = 0
+        self.connects = 0
+
+        self.thread = Thread(target=self.write_messages)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, payload) -> bool:
+        """
+        Queues a message for the peer without waiting for it to be written.
+
+        Args:
+            payload (bytes | EncodedMessage): The message. An EncodedMessage is
+                encoded with the codec negotiated on the link.
+
+        Returns:
+            bool: False if the queue is full and the message was dropped.
+        """
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        """
+        Writes what is already queued, then closes the connection. Does not wait:
+        if the queue is full, its oldest messages are dropped to make room.
+        """
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except Empty:
+                pass
+
+    def write_messages(self):
+        closing = False
+        while not closing:
+            payload = self.queue.get()
+            if payload is None:
+                break
+            batch = [payload]
+            while len(batch) < PEER_WRITE_BATCH:
+                try:
+                    payload = self.queue.get_nowait()
+                except Empty:
+                    break
+                if payload is None:
+                    closing = True
+                    break
+                batch.append(payload)
+            self.write(batch)
+        self.disconnect()
+
+    def write(self, batch: list):
+        for _ in range(2):
+            try:
+                if self.sock is None or helper.is_socket_closed(self.sock):
+                    self.connect()
+                batch, frames = self.encode(batch)
+                if not frames:
+                    return
+                data = b"".join(frames)
+                self.sock.settimeout(PEER_CONNECT_TIMEOUT)
+                self.sock.sendall(data)
+                self.sent += len(batch)
+                return
+            except OSError as e:
+                print(f"Peer link to node {self.node_id} at {self.address} failed: {e}")
+                self.disconnect()
+        self.dropped += len(batch)
+        if self.on_failure is not None:
+            try:
+                self.on_failure(self.node_id, batch)
+            except Exception as e:
+                print(f"Failure handler of the peer link to node {self.node_id} failed: {e}")
+        time.sleep(PEER_RECONNECT_DELAY)
+
+    def encode(self, batch: list) -> tuple:
+        """
+        Encodes every message of a batch as a frame, with the codec of the link.
+        A message that cannot be sent, because it is larger than MAX_MESSAGE_SIZE,
+        is dropped on its own, and the rest of the batch is still written.
+
+        Returns:
+            tuple: The messages that were encoded, and their frames.
+        """
+        messages, frames = [], []
+        for msg in batch:
+            try:
+                frames.append(
+                    helper.encode_frame(
+                        msg if isinstance(msg, bytes) else msg.encode_for(self.codec)
+                    )
+                )
+            except ValueError as e:
+                print(f"Dropping message for node {self.node_id}: {e}")
+                self.dropped += 1
+                continue
+            messages.append(msg)
+        return messages, frames
+
+    def connect(self):
+        self.disconnect()
+        sock = socket.create_connection(self.address, timeout=PEER_CONNECT_TIMEOUT)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            hello = helper.create_server_message(
+                self.own_id,
+                Type["PEER_LINK"].value,
+                {
+                    "port": sock.getsockname()[1],
+                    "ip": self.own_ip,
+                    "codecs": wire_codec.PREFERRED_CODECS,
+                },
+            )
+            helper.send_frame(sock, hello)
+            reply = helper.recv_frame(sock)
+        except OSError:
+            sock.close()
+            raise
+        if not reply or reply is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+            sock.close()
+            raise ConnectionError("peer closed the link during codec negotiation")
+        codec = helper.parse_message(reply).get("codec")
+        self.codec = codec if codec in wire_codec.CODECS else wire_codec.DEFAULT_CODEC
+        self.sock = sock
+        self.connects += 1
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+class PeerLinkManager:
+    def __init__(self, own_id: int, own_ip: str, on_failure=None):
+        """
+        Keeps one PeerLink to every other node in the cluster.
+
+        Args:
+            own_id (int): The ID of this node.
+            own_ip (str): The IP address of this node.
+            on_failure (callable): Passed on to every link, see PeerLink.
+        """
+        self.own_id = own_id
+        self.own_ip = own_ip
+        self.on_failure = on_failure
+        self.links = {}
+        self.membership = ()
+        self.lock = Lock()
+
+    def update_membership(self, nodes: list):
+        """
+        Opens links to new nodes and closes links to nodes that left or moved. Does
+        nothing if the membership is unchanged.
+
+        Args:
+            nodes (list): The node list, including this node.
+        """
+        membership = tuple(
+            (node["id"], node["ip"], node["port"])
+            for node in nodes
+            if node["id"] != self.own_id
+        )
+        with self.lock:
+            if membership == self.membership:
+                return
+            self.membership = membership
+            current = {node_id: (ip, port) for node_id, ip, port in membership}
+            closed = [
+                self.links.pop(node_id)
+                for node_id in list(self.links)
+                if self.links[node_id].address != current.get(node_id)
+            ]
+            for node in nodes:
+                if node["id"] != self.own_id and node["id"] not in self.links:
+                    self.links[node["id"]] = PeerLink(
+                        self.own_id, self.own_ip, node, on_failure=self.on_failure
+                    )
+        for link in closed:
+            link.close()
+        print(f"Peer links updated for nodes: {sorted(current)}")
+
+    def broadcast(self, payload) -> int:
+        """
+        Queues a message on the link to every peer.
+
+        Returns:
+            int: The number of peers the message was queued for.
+        """
+        with self.lock:
+            links = list(self.links.values())
+        return sum(1 for link in links if link.send(payload))
+
+    def send(self, node_id: int, payload) -> bool:
+        """
+        Queues a message on the link to one peer.
+
+        Returns:
+            bool: False if there is no link to the peer or its queue is full.
+        """
+        with self.lock:
+            link = self.links.get(node_id)
+        return link is not None and link.send(payload)
+
+    def close_all(self):
+        with self.lock:
+            links = list(self.links.values())
+            self.links.clear()
+            self.membership = ()
+        for link in links:
+            link.close()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            links = list(self.links.values())
+        return {
+            link.node_id: {
+                "queued": link.queue.qsize(),
+                "sent": link.sent,
+                "dropped": link.dropped,
+                "connects": link.connects,
+                "codec": link.codec,
+            }
+            for link in links
+        }
@@ -1,21 +1,127 @@
-import json
+import itertools
+import os
 import socket
-from threading import Thread
+import time
+from threading import Lock, Thread
 
-from constants.constants import BUFF_SIZE, Type
+from constants.constants import OFFER_LOG_DIR, OFFER_LOG_DIR_ENV, ErrorCode, Type
+from utils import codec as wire_codec
 from utils import utils as helper
+from .catch_up import CatchUpJob, CatchUpStreamer
+from .cluster_topology import ClusterTopology
+from .connection_pool import SubscriberConnectionPool
+from .delivery_queues import DeliveryQueues
+from .geo_index import GeoIndex
+from .ingest_server import ClientIngestServer
+from .metrics import REGISTRY
+from .offer_log import OfferLog
+from .peer_links import PeerLinkManager
+from .shard_ring import ShardRing
+from .subscription_replication import SubscriptionReplicator
+from .subscription_index import SubscriptionIndex
+from .topic_trie import TopicTrie
+
+subscriptions = SubscriptionIndex()
+locations = GeoIndex()
+
+CLIENT_REQUESTS = REGISTRY.counter(
+    "lbn_client_requests_total", "Requests received from clients on the leader's client port", ("type",)
+)
+CLIENT_REQUEST_SECONDS = REGISTRY.histogram(
+    "lbn_client_request_seconds", "Time to handle a request received from a client"
+)
+OFFERS_RECEIVED = REGISTRY.counter(
+    "lbn_offers_received_total", "Offers received, from publishers or forwarded by another node", ("source",)
+)
+OFFERS_FORWARDED = REGISTRY.counter(
+    "lbn_offers_forwarded_total", "Offers forwarded to the node that owns their shard", ("result",)
+)
+FANOUTS = REGISTRY.counter("lbn_fanouts_total", "Messages fanned out to the subscribers of a business type")
+FANOUT_SECONDS = REGISTRY.histogram(
+    "lbn_fanout_seconds", "Time to find the subscribers of a message and queue it for each of them"
+)
+FANOUT_DELIVERIES = REGISTRY.counter(
+    "lbn_fanout_deliveries_total", "Messages queued for subscribers, by what became of them", ("outcome",)
+)
+FANOUT_COMPLETION_SECONDS = REGISTRY.histogram(
+    "lbn_fanout_completion_seconds",
+    "Time from queueing a message for its subscribers until every copy was delivered, dropped or failed",
+)
+REPLICATED_CHANGES = REGISTRY.counter(
+    "lbn_replicated_changes_total", "Subscription changes broadcast to the other nodes", ("op",)
+)
+
+
+def business_type_of(payload):
+    """
+    Returns the business type of an offer in the offer log, which the log keeps the
+    offsets of for catch-up.
+    """
+    try:
+        return wire_codec.decode(payload).get("businessType")
+    except wire_codec.CodecError:
+        return None
 
-business_subscribers_dict = {}
 
 class PubSub:
     def __init__(self, leader, id, ip_leader, nodes, ip, port_leader):
         self.leader = leader
         self.id = id
         self.ip_leader = ip_leader
-        self.nodes = nodes
+        # Shared with the election when there is one, so both see the same nodes.
+        self.topology = nodes if isinstance(nodes, ClusterTopology) else ClusterTopology(nodes)
+        self.peer_links_version = None
         self.ip = ip
         self.port_leader = port_leader
         self.count_of_clients = 0
+        self.ingest_server = None
+        self.subscriber_pool = SubscriberConnectionPool()
+        # Every subscriber has its own queue, so one that reads slowly does not hold
+        # up the others.
+        self.delivery = DeliveryQueues(
+            self.subscriber_pool, on_disconnect=self.disconnect_subscriber, on_complete=self.delivery_completed
+        )
+        self.peer_links = PeerLinkManager(self.id, self.ip, on_failure=self.peer_link_failed)
+        self.offer_log = None
+        self.offer_log_dir = os.environ.get(OFFER_LOG_DIR_ENV) or OFFER_LOG_DIR
+        self.offer_log_lock = Lock()
+        self.catch_up = CatchUpStreamer(self.subscriber_pool)
+        # Every node publishes the offers and keeps the subscribers of the business
+        # types it owns on the ring.
+        self.shards = ShardRing(self.topology.node_list())
+        # The codecs, location and delivery policy of every local subscriber, for
+        # handing its subscriptions over when their shard moves to another node.
+        self.registrations = {}
+        self.offer_log_tried = False
+        # Every other node keeps a replica of this node's subscriptions, and this
+        # node of theirs, so the next owner of a shard serves it right away.
+        self.replication = SubscriptionReplicator(self.id, self.peer_links, self.subscription_snapshot)
+
+        REGISTRY.gauge(
+            "lbn_subscribers",
+            "Subscribers of this node",
+            function=lambda: subscriptions.get_stats()["subscribers"],
+        )
+        REGISTRY.gauge(
+            "lbn_subscriber_connections",
+            "Open connections to subscribers",
+            function=lambda: self.subscriber_pool.get_stats()["open_sockets"],
+        )
+        REGISTRY.gauge(
+            "lbn_delivery_queue_depth",
+            "Messages waiting in the subscribers' delivery queues",
+            function=lambda: self.delivery.get_stats()["depth"],
+        )
+        REGISTRY.gauge(
+            "lbn_delivery_stalled_subscribers",
+            "Subscribers whose connection has no room for more",
+            function=lambda: self.delivery.get_stats()["stalled"],
+        )
+        REGISTRY.gauge(
+            "lbn_peer_link_queue_depth",
+            "Messages waiting to be sent to other nodes",
+            function=lambda: sum(link["queued"] for link in self.peer_links.get_stats().values()),
+        )
 
     def set_leader_id(self, leader):
         self.leader = leader
@@ -33,7 +139,12 @@ class PubSub:
             while True:
                 conn, addr = accept_client_socket.accept()
                 print("Received Connection from client")
-                data = eval(conn.recv(BUFF_SIZE).decode("utf-8"))
+                data = helper.recv_frame(conn)
+                if not data or data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+                    print(f"Discarding client message: {data}")
+                    conn.close()
+                    continue
+                data = helper.parse_message(data)
                 print("Received Data from client: ", data)
                 self.process_client_data(data)
                 conn.close()
@@ -43,16 +154,244 @@ class PubSub:
             accept_client_socket.close()
             self.close_all_subscribers()
 
-    def close_all_subscribers(self):
-        for _, subscribers in business_subscribers_dict.items():
-            for subscriber_info in subscribers:
-                # Assuming subscriber_info is a dict with 'ip' and 'port'
+    def serve_clients(self):
+        """
+        Accepts publishers and subscribers on the leader's client port using the
+        asyncio ingest server. Replaces the blocking listen_to_client loop.
+        """
+        ingest_server = ClientIngestServer(
+            self.ip_leader, self.port_leader, self.handle_client_message
+        )
+        self.ingest_server = ingest_server
+        opened_log = self.open_offer_log()
+        try:
+            ingest_server.serve_forever()
+        except BaseException as e:
+            print(f"Exception occurred: {e}")
+        finally:
+            if opened_log:
+                self.close_offer_log()
+            self.close_all_subscribers()
+
+    def open_offer_log(self) -> bool:
+        """
+        Opens the log this node appends the offers it publishes to. Every node has a
+        log of its own, the first of <node ip>-node-<n> in OFFER_LOG_DIR, or the
+        directory in the OFFER_LOG_DIR_ENV environment variable, that no other node
+        on the host has open. Node ports and IDs change on every start, but a
+        node that restarts gets the log it left behind, unless other nodes on the host
+        restarted in the meantime. Offsets are only meaningful within one log, so
+        every message with offsets carries the log's name.
+
+        Returns:
+            bool: True if this call opened the log.
+        """
+        with self.offer_log_lock:
+            if self.offer_log is not None:
+                return False
+            for slot in itertools.count():
+                directory = os.path.join(self.offer_log_dir, f"{self.ip}-node-{slot}")
                 try:
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                        sock.connect((subscriber_info['ip'], subscriber_info['port']))
-                        sock.close()
-                except Exception as e:
-                    print(f"Error closing connection to subscriber {subscriber_info}: {e}")
+                    self.offer_log = OfferLog(directory, key=business_type_of)
+                    break
+                except BlockingIOError:
+                    # Another node on this host has it open.
+                    continue
+                except OSError as e:
+                    print(f"Offer log not available, offers will not be persisted: {e}")
+                    return False
+        print(f"Offer log opened at {directory}: {self.offer_log.get_stats()}")
+        return True
+
+    def close_offer_log(self):
+        with self.offer_log_lock:
+            offer_log, self.offer_log = self.offer_log, None
+        if offer_log is not None:
+            offer_log.close()
+
+    def log_offers(self, offers):
+        """
+        Appends offers to the offer log before they are fanned out. With the default
+        fsync policy this returns once they are on disk.
+
+        Args:
+            offers (list): Offers as dicts with businessType, offer and optionally
+                location.
+
+        Returns:
+            tuple: The name of the offer log they were appended to and their offsets
+            in it, or (None, []) if they were not logged. The name comes from the
+            same log as the offsets, even if the log is reopened meanwhile.
+        """
+        offer_log = self.offer_log
+        if offer_log is None:
+            return None, []
+        try:
+            return offer_log.name, offer_log.append_many([wire_codec.encode(entry) for entry in offers])
+        except (OSError, ValueError) as e:
+            print(f"Offers not written to the offer log: {e}")
+            return None, []
+
+    def handle_client_message(self, payload):
+        """
+        Decodes and processes one framed client request. Runs on an ingest worker thread.
+
+        Returns:
+            bytes: The reply to a SHARD_LOOKUP request, None for other requests.
+        """
+        started = time.perf_counter()
+        try:
+            data = helper.parse_message(payload)
+            print("Received Data from client: ", data)
+            if data.get("type") == Type["SHARD_LOOKUP"].value:
+                CLIENT_REQUESTS.labels("shard_lookup").inc()
+                return self.shard_lookup_reply()
+            CLIENT_REQUESTS.labels(data.get("client_type", "unknown")).inc()
+            self.process_client_data(data)
+        except Exception as e:
+            print(f"Error processing client message: {e}")
+        finally:
+            CLIENT_REQUEST_SECONDS.observe(time.perf_counter() - started)
+        return None
+
+    def shard_lookup_reply(self) -> bytes:
+        """
+        Returns:
+            bytes: The nodes on the shard ring, from which a client builds the same
+            ring to send offers straight to the owner of their business type.
+        """
+        return wire_codec.encode(
+            {
+                "type": Type["SHARD_LOOKUP"].value,
+                "version": self.shards.version,
+                "nodes": self.shards.node_list(),
+            }
+        )
+
+    def update_shards(self):
+        """
+        Rebuilds the shard ring after the node list changed, and hands the
+        subscriptions of shards this node no longer owns over to their new owners.
+        Shards that keep their owner are not touched.
+        """
+        previous = {node["id"] for node in self.shards.node_list()}
+        if not self.shards.update(self.topology.node_list()):
+            return
+        print(f"Shard ring updated: {self.shards.get_stats()}")
+        self.update_peer_links()
+        current = {node["id"] for node in self.shards.node_list()}
+        for node_id in current - previous - {self.id}:
+            self.replication.sync(node_id)
+        for source in set(self.replication.replicated_nodes()) - current:
+            self.take_over_subscriptions(source)
+        for address in subscriptions.all_subscribers():
+            registration = self.registrations.get(address)
+            moved, dropped = {}, []
+            for interest in subscriptions.topics_of(address):
+                owners = {owner["id"] for owner in self.shards.owners_of_interest(interest)}
+                for node_id in owners - {self.id}:
+                    # Patterns every node keeps only go to nodes that just joined.
+                    if self.id not in owners or node_id not in previous:
+                        moved.setdefault(node_id, []).append(interest)
+                if self.id not in owners:
+                    dropped.append(interest)
+            if registration is not None:
+                for node_id, interests in moved.items():
+                    self.forward_registration(
+                        node_id,
+                        dict(registration, client_type="subscriber", ip=address[0], port=address[1], interests=interests),
+                    )
+            if dropped:
+                subscriptions.unsubscribe(address, dropped)
+                self.replicate("unsubscribe", address, dropped)
+                if subscriptions.handle_of(address) is None:
+                    self.drop_subscriber(address)
+            if moved:
+                print(f"Subscriptions of {address} handed over to nodes {sorted(moved)}")
+
+    def take_over_subscriptions(self, source):
+        """
+        Subscribes the subscribers a node that left had for the shards this node
+        owns now, from the replica of its subscriptions.
+        """
+        taken = 0
+        for address, (topics, registration) in self.replication.take_over(source).items():
+            owned = [
+                topic
+                for topic in topics
+                if any(owner["id"] == self.id for owner in self.shards.owners_of_interest(topic))
+            ]
+            if owned:
+                self.process_subscriber(
+                    dict(registration, client_type="subscriber", ip=address[0], port=address[1],
+                         interests=owned, forwarded=True)
+                )
+                taken += 1
+        print(f"Took over {taken} subscribers from node {source}")
+
+    def subscription_snapshot(self):
+        """
+        Returns:
+            list: (address, topics, registration) of every local subscriber.
+        """
+        return [
+            (address, subscriptions.topics_of(address), self.registrations.get(address, {}))
+            for address in subscriptions.all_subscribers()
+        ]
+
+    def update_peer_links(self):
+        """
+        Opens and closes peer links to match the topology, if it changed since the
+        last time.
+        """
+        version = self.topology.version
+        if version != self.peer_links_version:
+            self.peer_links.update_membership(self.topology.node_list())
+            self.peer_links_version = version
+
+    def replicate(self, op, address, topics, registration=None):
+        REPLICATED_CHANGES.labels(op).inc()
+        self.update_peer_links()
+        self.replication.record(op, address, topics, registration)
+
+    def forward_registration(self, node_id, data) -> bool:
+        """
+        Registers a subscriber with the node that owns some of its interests. The
+        owner subscribes it without routing the registration any further.
+        """
+        data = dict(data, type=Type["CONNECT_TO_CLIENT"].value, id=self.id, forwarded=True)
+        if not self.peer_links.send(node_id, wire_codec.EncodedMessage(data)):
+            print(f"Registration of {data['ip']}:{data['port']} not forwarded to node {node_id}")
+            return False
+        return True
+
+    def drop_subscriber(self, address):
+        self.registrations.pop(address, None)
+        locations.remove(address)
+        self.delivery.remove(address)
+        self.subscriber_pool.remove(address)
+
+    def disconnect_subscriber(self, address):
+        """
+        Unsubscribes a subscriber whose delivery policy is to be disconnected once its
+        queue is full, or that could not be reached for DELIVERY_MAX_FAILURES sends in
+        a row, on this node and on the replicas.
+        """
+        topics = sorted(subscriptions.topics_of(address))
+        if topics:
+            subscriptions.unsubscribe(address, topics)
+            self.replicate("unsubscribe", address, topics)
+        self.drop_subscriber(address)
+
+    def close_all_subscribers(self):
+        self.subscriber_pool.close_all()
+        for address in subscriptions.all_subscribers():
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                    sock.connect(address)
+                    sock.close()
+            except Exception as e:
+                print(f"Error closing connection to subscriber {address}: {e}")
 
     def process_client_data(self, data):
         if data["client_type"] == "subscriber":
@@ -67,12 +406,142 @@ class PubSub:
     def process_subscriber(self, data):
         print(f"Processing subscriber {data['ip']}:{data['port']}\n")
         interests = data.get('interests', [])
-        subscriber_info = {'ip': data['ip'], 'port': data['port']}
-        for interest in interests:
-            if interest not in business_subscribers_dict:
-                business_subscribers_dict[interest] = []
-            business_subscribers_dict[interest].append(subscriber_info)
-        print(f"Updated subscriber list: {business_subscribers_dict}")
+        address = (data['ip'], data['port'])
+        if not data.get('forwarded'):
+            interests = self.route_subscription(data)
+        if not interests:
+            return
+        self.registrations[address] = {
+            key: data[key] for key in ('codecs', 'location', 'delivery') if key in data
+        }
+        # Subscribers list the codecs they can decode when they register.
+        self.subscriber_pool.set_codec(address, wire_codec.negotiate(data.get('codecs')))
+        # And what to do with offers for them once their queue is full.
+        delivery = data.get('delivery') or {}
+        try:
+            self.delivery.set_policy(address, delivery.get('policy'), delivery.get('queue_size'))
+        except (TypeError, ValueError) as e:
+            print(f"Invalid delivery settings of subscriber {address}, using the defaults: {e}")
+            self.delivery.set_policy(address)
+        # Subscribers with a location only get offers from within their radius.
+        location = data.get('location')
+        if location:
+            locations.add(address, location['lat'], location['lon'], location['radius'])
+        else:
+            locations.remove(address)
+        # A subscriber that registers again is not added twice.
+        subscriptions.subscribe(address, interests)
+        self.replicate("subscribe", address, interests, self.registrations[address])
+        print(f"Updated subscriber list for interests: {interests}")
+        catch_up = {
+            interest: request
+            for interest, request in (data.get('catch_up') or {}).items()
+            if interest in interests
+        }
+        if catch_up:
+            self.start_catch_up(address, catch_up, data.get('catch_up_owners'))
+
+    def route_subscription(self, data):
+        """
+        Forwards a subscriber's registration to the owners of its interests, each
+        with only the interests it owns and their catch-up requests.
+
+        Returns:
+            list: The interests this node owns itself.
+        """
+        owned, remote = [], {}
+        for interest in data.get('interests', []):
+            for owner in self.shards.owners_of_interest(interest):
+                if owner['id'] == self.id:
+                    owned.append(interest)
+                else:
+                    remote.setdefault(owner['id'], []).append(interest)
+        if remote:
+            self.update_peer_links()
+        # Every owner that sends a catch-up tells the subscriber which others do, so
+        # it knows when it has caught up with all of them.
+        owners = {
+            owner['id']
+            for interest in data.get('interests', [])
+            if interest in (data.get('catch_up') or {})
+            for owner in self.shards.owners_of_interest(interest)
+        }
+        if owners:
+            data['catch_up_owners'] = sorted(owners)
+        for node_id, interests in remote.items():
+            forwarded = dict(data, interests=interests)
+            if data.get('catch_up'):
+                forwarded['catch_up'] = {
+                    interest: request
+                    for interest, request in data['catch_up'].items()
+                    if interest in interests
+                }
+            self.forward_registration(node_id, forwarded)
+            print(f"Subscriber {data['ip']}:{data['port']} redirected to node {node_id} for {interests}")
+        return owned
+
+    def start_catch_up(self, address, requests, owners=None):
+        """
+        Sends a subscriber the offers it missed from this node's offer log, in the
+        background. Must be called after the subscriber is subscribed: offers from
+        the current end of the log on reach it by live delivery, and the catch-up
+        covers the ones before. A node without a log still tells the subscriber it
+        is done.
+
+        Args:
+            address (tuple): The (ip, port) of the subscriber.
+            requests (dict): Per interest, {"offsets": {log name: last offset seen},
+                "since": timestamp} as a subscriber that was offline sends it,
+                {"offset": last offset seen} or {"since": timestamp, "until":
+                timestamp}; until is optional. The offset in this node's log is used
+                if there is one, else since.
+            owners (list): The IDs of all nodes that send the subscriber a catch-up.
+
+        Returns:
+            Future: The running catch-up.
+        """
+        offer_log = self.offer_log
+        if offer_log is None:
+            print(f"No offer log on this node, subscriber {address} cannot catch up")
+            job = CatchUpJob(address, iter(()), None, node=self.id, owners=owners)
+            return self.catch_up.start(None, job)
+        live_from = offer_log.end_offset()
+        topics = offer_log.key_names()
+        streams = []
+        for interest, request in requests.items():
+            if not isinstance(interest, str) or not isinstance(request, dict):
+                continue
+            offsets = request.get("offsets")
+            if isinstance(offsets, dict) and offsets.get(offer_log.name) is not None:
+                start = offsets[offer_log.name] + 1
+            elif request.get("offset") is not None:
+                start = request["offset"] + 1
+            elif request.get("since") is not None:
+                start = offer_log.offset_for_time(request["since"])
+            else:
+                continue
+            end = live_from
+            if request.get("until") is not None:
+                end = min(end, offer_log.offset_for_time(request["until"]))
+            for topic in topics:
+                if TopicTrie.matches(interest, topic):
+                    streams.append(offer_log.offsets_for(topic, start, end))
+
+        def is_near(entry):
+            location = entry.get("location")
+            return not location or locations.covers(address, location["lat"], location["lon"])
+
+        job = CatchUpJob(
+            address,
+            CatchUpStreamer.merge_offsets(streams),
+            live_from,
+            is_near,
+            log=offer_log.name,
+            node=self.id,
+            owners=owners,
+        )
+        print(f"Catching up subscriber {address} on {requests}, live from offset {live_from} of {offer_log.name}")
+        return self.catch_up.start(offer_log, job)
 
     def process_publisher(self, data):
         thread = Thread(target=self.listen_to_publisher, args=(data,))
@@ -91,41 +560,200 @@ class PubSub:
             publisher_socket.listen()
             conn, addr = publisher_socket.accept()
             print(f"Connection received: conn={conn}, addr={addr}\n")
+            decoder = helper.FrameDecoder()
             while True:
-                data = eval(conn.recv(BUFF_SIZE).decode("utf-8"))
+                data = decoder.next_frame(conn)
+                if data is None:
+                    print("Publisher closed the connection")
+                    break
+                if data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+                    print("Dropping offer: size exceeds MAX_MESSAGE_SIZE")
+                    continue
+                data = helper.parse_message(data)
+                if not data:
+                    continue
+                if data.get("type") == Type["PUBLISH_BATCH"].value:
+                    print(f"Batch of {len(data['offers'])} offers received from publisher")
+                    self.route_offers(data["offers"])
+                    continue
                 print(f"Data received from publisher: {data}")
-                self.publish_event_to_subscribers(data["businessType"], data.get("offer", ""))
-                self.broadcast(data)
+                entry = {"businessType": data["businessType"], "offer": data.get("offer", "")}
+                if data.get("location"):
+                    entry["location"] = data["location"]
+                self.route_offers([entry])
         except BaseException as e:
             print("Error:", e)
         finally:
             publisher_socket.close()
 
-    def publish_event_to_subscribers(self, businessType, offer):
+    def route_offers(self, offers, forwarded=False):
+        """
+        Logs and publishes the offers of business types this node owns, and forwards
+        the others to their owners over the peer links. Offers forwarded by another
+        node are published here whoever owns them now, so they never bounce between
+        nodes whose rings disagree for a moment. Offers that cannot be forwarded,
+        because the owner's link is full or down, are published here as well.
+
+        Args:
+            offers (list): Offers as dicts with businessType, offer and optionally
+                location.
+            forwarded (bool): Whether another node already routed the offers.
+
+        Returns:
+            list: The fan-out reports of the offers published here.
+        """
+        OFFERS_RECEIVED.labels("node" if forwarded else "publisher").inc(len(offers))
+        owned, remote = [], {}
+        for entry in offers:
+            owner = None if forwarded else self.shards.owner(entry["businessType"])
+            if owner is None or owner["id"] == self.id:
+                owned.append(entry)
+            else:
+                remote.setdefault(owner["id"], []).append(entry)
+        if remote:
+            self.update_peer_links()
+        for node_id, entries in remote.items():
+            msg = {"type": Type["SHARD_FORWARD"].value, "id": self.id, "offers": entries, "forwarded": True}
+            if self.peer_links.send(node_id, wire_codec.EncodedMessage(msg)):
+                OFFERS_FORWARDED.labels("sent").inc(len(entries))
+            else:
+                OFFERS_FORWARDED.labels("kept").inc(len(entries))
+                print(f"Peer link to node {node_id} not available, publishing {len(entries)} offers here")
+                owned.extend(entries)
+        return self.publish_owned(owned)
+
+    def peer_link_failed(self, node_id, payloads):
+        """
+        Publishes here the offers a peer link could not write to the node that owns
+        them, so they still reach the subscribers on this node. Called from the
+        link's thread.
+
+        Args:
+            node_id (int): The node the link is to.
+            payloads (list): The messages that were not written.
+        """
+        offers = [
+            entry
+            for payload in payloads
+            if isinstance(payload, wire_codec.EncodedMessage)
+            and payload.msg.get("type") == Type["SHARD_FORWARD"].value
+            for entry in payload.msg["offers"]
+        ]
+        if not offers:
+            return
+        OFFERS_FORWARDED.labels("kept").inc(len(offers))
+        print(f"Node {node_id} not reachable, publishing {len(offers)} offers here")
+        self.publish_owned(offers)
+
+    def publish_owned(self, owned):
+        """
+        Logs and publishes offers this node publishes itself.
+
+        Returns:
+            list: The fan-out reports of the offers.
+        """
+        if not owned:
+            return []
+        if self.offer_log is None and not self.offer_log_tried:
+            self.offer_log_tried = True
+            self.open_offer_log()
+        log, offsets = self.log_offers(owned)
+        return self.publish_batch(owned, offsets, log)
+
+    def publish_batch(self, offers, offsets=None, log=None):
+        """
+        Groups a batch of offers by business type and location and fans out each
+        group with one message per subscriber.
+
+        Args:
+            offers (list): Offers as dicts with businessType, offer and optionally
+                location.
+            offsets (list): The offer log offsets of the offers, if they were logged.
+            log (str): The name of the offer log the offsets are in.
+        """
+        groups = {}
+        for index, entry in enumerate(offers):
+            location = entry.get("location")
+            point = (location["lat"], location["lon"]) if location else None
+            group = groups.setdefault((entry["businessType"], point), ([], []))
+            group[0].append(entry.get("offer", ""))
+            if offsets:
+                group[1].append(offsets[index])
+        reports = []
+        for (businessType, point), (group, group_offsets) in groups.items():
+            location = {"lat": point[0], "lon": point[1]} if point else None
+            if len(group) == 1:
+                offset = group_offsets[0] if group_offsets else None
+                reports.append(
+                    self.publish_event_to_subscribers(businessType, group[0], location, offset, log)
+                )
+            else:
+                reports.append(
+                    self.publish_offers_to_subscribers(businessType, group, location, group_offsets, log)
+                )
+        return reports
+
+    def publish_offers_to_subscribers(self, businessType, offers, location=None, offsets=None, log=None):
+        print(f"Sending {len(offers)} offers to the subscribers\n")
+        msg = {"type": Type["PUBLISH_BATCH"].value, "businessType": businessType, "offers": offers}
+        if location:
+            msg["location"] = location
+        if offsets:
+            msg["offsets"] = offsets
+            msg["log"] = log
+        return self.deliver_to_subscribers(businessType, msg, location)
+
+    def publish_event_to_subscribers(self, businessType, offer, location=None, offset=None, log=None):
         print("Sending the data to the subscribers\n")
-        subscribers = business_subscribers_dict.get(businessType, [])
         msg = {"businessType": businessType, "offer": offer}
-        for subscriber_info in subscribers:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                    sock.connect((subscriber_info['ip'], subscriber_info['port']))
-                    sock.sendall(json.dumps(msg).encode("utf-8"))
-                    print(f"Data sent to subscriber at {subscriber_info}")
-            except Exception as e:
-                print(f"Error sending data to subscriber {subscriber_info}: {e}")
+        if location:
+            msg["location"] = location
+        if offset is not None:
+            msg["offset"] = offset
+            msg["log"] = log
+        return self.deliver_to_subscribers(businessType, msg, location)
 
-    def broadcast(self, data):
-        for info in self.nodes:
-            if info["id"] == self.id:
-                continue
-            temp_socket = helper.initialize_socket(self.ip)
-            msg = helper.create_server_message(self.id, Type["PUBLISH_DATA_TO_SUBSCRIBERS"].value, data)
-            client_handler_address = (info["ip"], info["port"])
-            try:
-                temp_socket.connect(client_handler_address)
-                temp_socket.send(msg)
-                print(f"Broadcasted data to server {info}\n")
-            except BaseException as e:
-                print(f"Error broadcasting data to server {info}: {e}")
-            finally:
-                temp_socket.close()
+    def deliver_to_subscribers(self, businessType, msg, location=None):
+        started = time.perf_counter()
+        addresses = self.find_subscribers(businessType, location)
+        payload = wire_codec.EncodedMessage(msg)
+        report = self.delivery.enqueue(addresses, payload, businessType)
+        FANOUT_SECONDS.observe(time.perf_counter() - started)
+        FANOUTS.inc()
+        for outcome in ("queued", "coalesced", "disconnected"):
+            count = getattr(report, outcome)
+            if count:
+                FANOUT_DELIVERIES.labels(outcome).inc(count)
+        print(report)
+        return report
+
+    def delivery_completed(self, report):
+        """
+        Records what became of every copy of a message once the last one was
+        delivered, dropped or failed.
+        """
+        FANOUT_COMPLETION_SECONDS.observe(report.elapsed)
+        for outcome in ("delivered", "dropped", "failed"):
+            count = getattr(report, outcome)
+            if count:
+                FANOUT_DELIVERIES.labels(outcome).inc(count)
+        print(report)
+
+    def find_subscribers(self, businessType, location=None):
+        """
+        Returns the subscribers an offer goes to: those interested in its business
+        type, except subscribers with a location that the offer is too far from.
+        Offers without a location go to every interested subscriber.
+
+        Args:
+            businessType (str): The business type of the offer.
+            location (dict): The lat and lon of the offer, if it has one.
+
+        Returns:
+            tuple | list: (ip, port) addresses of the subscribers.
+        """
+        addresses = subscriptions.snapshot(businessType)
+        if not location or not len(locations):
+            return addresses
+        nearby = set(locations.query(location["lat"], location["lon"]))
+        return [address for address in addresses if address in nearby or address not in locations]
@@ -1,8 +1,22 @@
 import json
 import socket
 import time
+from threading import Event, Lock, Thread
 
-from constants.constants import Type
+from constants.constants import (
+    BATCH_MAX_BYTES,
+    BATCH_MAX_OFFERS,
+    BATCH_WINDOW,
+    REROUTE_MAX_OFFERS,
+    DEFAULT_ID,
+    SHARD_REFRESH_INTERVAL,
+    ErrorCode,
+    Type,
+)
+from .peer_links import PeerLink
+from .shard_ring import ShardRing
+from utils import codec as wire_codec
+from utils import utils as helper
 
 class Publisher:
     def __init__(self, verbose: bool, config_path: str):
@@ -13,8 +27,28 @@ class Publisher:
         self.leaderIP = config["leader"]["ip"]
         self.pubIP = config["publisher"]["ip"]
         self.pubPort = config["publisher"]["port"]
+        # Optional {"lat", "lon"} of the business, attached to every offer.
+        self.location = config["publisher"].get("location")
         self.verbose = verbose
 
+        self.publisher_socket = None
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_started = 0.0
+        self.batch_lock = Lock()
+        self.batch_pending = Event()
+        # Offers go straight to the node that owns their business type, over a
+        # long-lived link per node. Without a ring they go through the leader.
+        self.shards = None
+        self.shards_loaded = 0.0
+        self.owner_links = {}
+        # Offers an owner link could not write, at most REROUTE_MAX_OFFERS, and
+        # when each owner last failed. They go to the leader, and the owner is
+        # skipped until the ring changes or SHARD_REFRESH_INTERVAL has passed.
+        self.rerouted = []
+        self.failed_owners = {}
+        self.reroute_lock = Lock()
+
     def start_service(self):
         msg = {"client_type": "publisher", "ip": self.pubIP, "port": self.pubPort}
 
@@ -26,9 +60,10 @@ class Publisher:
         try:
             server_socket.connect(address)
             print("Connected to Leader Node. Sending message to Leader server_node")
-            server_socket.send(json.dumps(msg).encode("utf-8"))
+            helper.send_frame(server_socket, json.dumps(msg).encode("utf-8"))
             server_socket.close()
 
+            self.load_shards()
             self.publish_data()
         except BaseException as e:
             print("Server Node not available", e)
@@ -46,22 +81,233 @@ class Publisher:
 
         try:
             publisher_socket.connect(address)
+            self.publisher_socket = publisher_socket
+
+            thread = Thread(target=self.flush_batches)
+            thread.daemon = True
+            thread.start()
+
             while True:
                 print("Enter the business details: ")
 
 
             # Prompt for user input
                 print("Enter the business details: ")
-                business_type = input("Enter the Business Type: ")
-                offer = input("Enter the offer details: ")
+                try:
+                    business_type = input("Enter the Business Type: ")
+                    offer = input("Enter the offer details: ")
+                except EOFError:
+                    break
 
-                user_input = {
-                "businessType": business_type,
-                "offer": offer
-            }
-                encoded_data = str(user_input).encode("utf-8")
-                publisher_socket.send(encoded_data)
-                print(f"{encoded_data} Data sent to the server!")
+                self.publish(business_type, offer)
 
         except BaseException as e:
-            print("Publisher server_node not available", e)
\ No newline at end of file
+            print("Publisher server_node not available", e)
+        finally:
+            self.flush()
+
+    def publish(self, business_type: str, offer: str, location: dict = None):
+        """
+        Adds an offer to the current batch. The batch is sent as one frame when it
+        reaches BATCH_MAX_OFFERS offers or BATCH_MAX_BYTES bytes, or BATCH_WINDOW
+        seconds after its first offer, whichever comes first.
+
+        Args:
+            business_type (str): The business type of the offer.
+            offer (str): The offer details.
+            location (dict): The lat and lon the offer applies to. Defaults to the
+                location in the config; subscribers with a location only receive
+                offers within their radius.
+        """
+        entry = {"businessType": business_type, "offer": offer}
+        location = location or self.location
+        if location:
+            entry["location"] = {"lat": location["lat"], "lon": location["lon"]}
+        size = len(json.dumps(entry)) + 2
+        with self.batch_lock:
+            if self.batch and (
+                len(self.batch) >= BATCH_MAX_OFFERS
+                or self.batch_bytes + size > BATCH_MAX_BYTES
+            ):
+                self.send_batch()
+            if not self.batch:
+                self.batch_started = time.monotonic()
+                self.batch_pending.set()
+            self.batch.append(entry)
+            self.batch_bytes += size
+
+    def publish_many(self, offers: list):
+        """
+        Publishes several offers, e.g. a chain store's offers at opening time.
+
+        Args:
+            offers (list): (business_type, offer) pairs.
+        """
+        for business_type, offer in offers:
+            self.publish(business_type, offer)
+
+    def flush(self):
+        """
+        Sends the current batch immediately.
+        """
+        with self.batch_lock:
+            self.send_batch()
+
+    def flush_batches(self):
+        """
+        Sends each batch once it is BATCH_WINDOW seconds old.
+        """
+        while True:
+            self.batch_pending.wait()
+            with self.batch_lock:
+                due = self.batch_started + BATCH_WINDOW
+            time.sleep(max(0, due - time.monotonic()))
+            with self.batch_lock:
+                if self.rerouted or (self.batch and time.monotonic() >= self.batch_started + BATCH_WINDOW):
+                    self.send_batch()
+
+    def load_shards(self) -> bool:
+        """
+        Asks the leader for the nodes on the shard ring and builds the same ring, so
+        offers can be sent to the owners of their business types directly.
+
+        Returns:
+            bool: False if the leader did not answer; offers then go through it.
+        """
+        self.shards_loaded = time.monotonic()
+        request = {"type": Type["SHARD_LOOKUP"].value}
+        try:
+            with socket.create_connection((self.leaderIP, self.leaderPort), timeout=2) as sock:
+                helper.send_frame(sock, json.dumps(request).encode("utf-8"))
+                reply = helper.recv_frame(sock)
+        except OSError as e:
+            print("Shard ring not available, publishing through the leader", e)
+            return False
+        if not reply or reply is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+            print("Shard ring not available, publishing through the leader")
+            return False
+        nodes = helper.parse_message(reply).get("nodes") or []
+        if self.shards is None:
+            self.shards = ShardRing(nodes)
+        elif not self.shards.update(nodes):
+            return True
+        print(f"Shard ring loaded: {self.shards.get_stats()}")
+        with self.reroute_lock:
+            self.failed_owners.clear()
+        current = {(node["id"], node["ip"], node["port"]) for node in nodes}
+        for node_id in list(self.owner_links):
+            link = self.owner_links[node_id]
+            if (node_id, *link.address) not in current:
+                self.owner_links.pop(node_id).close()
+        return True
+
+    def send_to_owners(self, offers: list) -> list:
+        """
+        Queues offers as SHARD_FORWARD frames on the links to the owners of their
+        business types. Callers hold batch_lock.
+
+        Returns:
+            list: The offers that could not be queued.
+        """
+        if time.monotonic() - self.shards_loaded > SHARD_REFRESH_INTERVAL:
+            self.load_shards()
+        if self.shards is None:
+            return offers
+        with self.reroute_lock:
+            now = time.monotonic()
+            failed = {
+                node_id
+                for node_id, failed_at in self.failed_owners.items()
+                if now - failed_at < SHARD_REFRESH_INTERVAL
+            }
+        by_owner, unsent = {}, []
+        for entry in offers:
+            owner = self.shards.owner(entry["businessType"])
+            if owner is None or owner["id"] in failed:
+                unsent.append(entry)
+                continue
+            by_owner.setdefault(owner["id"], (owner, []))[1].append(entry)
+        for node_id, (owner, entries) in by_owner.items():
+            link = self.owner_links.get(node_id)
+            if link is None:
+                link = self.owner_links[node_id] = PeerLink(
+                    DEFAULT_ID, self.pubIP, owner, on_failure=self.reroute
+                )
+            msg = {"type": Type["SHARD_FORWARD"].value, "offers": entries}
+            if not link.send(wire_codec.EncodedMessage(msg)):
+                unsent.extend(entries)
+        if len(unsent) < len(offers):
+            print(f"{len(offers) - len(unsent)} offers sent to {len(by_owner)} shard owners")
+        return unsent
+
+    def reroute(self, node_id: int, payloads: list):
+        """
+        Takes back the offers an owner link could not write, so that send_batch
+        sends them through the leader, which routes them on its current ring, and
+        makes the ring be loaded again. Called from the link's thread.
+
+        Args:
+            node_id (int): The owner the link is to.
+            payloads (list): The SHARD_FORWARD messages that were not written.
+        """
+        offers = [entry for payload in payloads for entry in payload.msg["offers"]]
+        print(f"Shard owner {node_id} not reachable, sending {len(offers)} offers through the leader")
+        with self.reroute_lock:
+            self.failed_owners[node_id] = time.monotonic()
+            self.rerouted.extend(offers)
+            dropped = len(self.rerouted) - REROUTE_MAX_OFFERS
+            if dropped > 0:
+                del self.rerouted[:dropped]
+        if dropped > 0:
+            print(f"Too many offers waiting to go through the leader, dropping the {dropped} oldest")
+        self.shards_loaded = 0.0
+        self.batch_pending.set()
+
+    def send_batch(self):
+        """
+        Sends the queued offers to the owners of their business types, and those
+        that cannot be, with the ones an owner link failed to write, to the leader
+        in PUBLISH_BATCH frames of at most BATCH_MAX_OFFERS offers and
+        BATCH_MAX_BYTES bytes. Callers hold batch_lock.
+        """
+        self.batch_pending.clear()
+        with self.reroute_lock:
+            rerouted, self.rerouted = self.rerouted, []
+        if not self.batch and not rerouted:
+            return
+        offers, self.batch, self.batch_bytes = self.batch, [], 0
+        offers = (self.send_to_owners(offers) if offers else []) + rerouted
+        if not offers:
+            return
+        if self.publisher_socket is None:
+            print(f"Publisher is not connected, dropping {len(offers)} offers")
+            return
+        for batch in self.split_batch(offers):
+            msg = {"type": Type["PUBLISH_BATCH"].value, "offers": batch}
+            try:
+                helper.send_frame(self.publisher_socket, wire_codec.encode(msg))
+            except ValueError as e:
+                print("Offers not sent:", e)
+                continue
+            except OSError as e:
+                print("Publisher server_node not available", e)
+                return
+            print(f"Batch of {len(batch)} offers sent to the server!")
+
+    @staticmethod
+    def split_batch(offers: list) -> list:
+        """
+        Splits offers into batches of at most BATCH_MAX_OFFERS offers and
+        BATCH_MAX_BYTES bytes, sized as publish sizes them.
+        """
+        batches, batch, batch_bytes = [], [], 0
+        for entry in offers:
+            size = len(json.dumps(entry)) + 2
+            if batch and (len(batch) >= BATCH_MAX_OFFERS or batch_bytes + size > BATCH_MAX_BYTES):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(entry)
+            batch_bytes += size
+        if batch:
+            batches.append(batch)
+        return batches
@@ -2,9 +2,26 @@ import json
 import signal
 import socket
 import sys
+import time
+from queue import Queue
+from threading import Lock, Thread
 
 from constants import constants as const
+from utils import codec as wire_codec
 from utils import utils as helper
+from .cluster_topology import ClusterTopology
+from .metrics import REGISTRY
+
+REGISTRATIONS = REGISTRY.counter(
+    "lbn_register_registrations_total", "Node registrations, by whether they were accepted", ("result",)
+)
+DEPARTURES = REGISTRY.counter("lbn_register_departures_total", "Nodes whose registration connection closed")
+PUSH_SECONDS = REGISTRY.histogram(
+    "lbn_register_push_seconds", "Time to send a topology update to a registered node"
+)
+PUSH_FAILURES = REGISTRY.counter(
+    "lbn_register_push_failures_total", "Topology updates that could not be sent to a node"
+)
 
 
 class Register:
@@ -22,88 +39,217 @@ class Register:
         self.my_ip = config["register"]["ip"]
         self.my_port = config["register"]["port"]
 
-        self.nodes = []
+        # The registered nodes. Its version numbers the topology updates.
+        self.topology = ClusterTopology()
         self.verbose = verbose
         self.logging = helper.configure_logging()
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind((self.my_ip, self.my_port))
-        self.connections = []
+        # Node ID -> the node's registration connection, kept open while it is up,
+        # and the queue of frames its writer thread sends on it.
+        self.connections = {}
+        self.outboxes = {}
+        self.lock = Lock()
+        # IDs are handed out from MAX down, so nodes that join later rank below the
+        # nodes already running and do not take the leadership over from them.
+        self.next_id = const.MAX
+        self.released_ids = []
 
         signal.signal(signal.SIGINT, self.handler_log_msgs)
 
+        REGISTRY.gauge("lbn_register_nodes", "Registered nodes", function=lambda: len(self.topology))
+        REGISTRY.gauge(
+            "lbn_register_topology_version", "Version of the node list", function=lambda: self.topology.version
+        )
+
     def receive_connection_request(self):
         """
-        Listen for incoming connection requests and handle them.
+        Accepts node registrations for as long as the register runs.
 
-        This method starts a server that listens for incoming connection requests.
-        When a request is received, it generates an identifier for the new connection,
-        stores the connection details, and prints the details.
+        A node that registers is given an ID and the current node list right away,
+        and the other nodes are sent a TOPOLOGY_UPDATE with the new node. The
+        registration connection stays open; when it closes, the node is removed and
+        the other nodes are sent a TOPOLOGY_UPDATE with the node that left.
         """
         self.sock.listen()
         print("Register is listening on port {}".format(self.my_port))
-        ids = []
-        self.sock.settimeout(const.SOCKET_TIMEOUT)
         while True:
             try:
                 conn, addr = self.sock.accept()
-                data = conn.recv(const.BUFF_SIZE)
-                msg = json.loads(data.decode("utf-8"))
+            except OSError:
+                break
+            thread = Thread(target=self.serve_node, args=(conn, addr))
+            thread.daemon = True
+            thread.start()
 
-                print(f"A server is trying to register from {addr}")
+    def serve_node(self, conn: socket.socket, addr: tuple):
+        """
+        Registers a node and keeps its connection until the node goes away.
+        """
+        data = helper.recv_frame(conn)
+        if not data or data is const.ErrorCode.MESSAGE_SIZE_EXCEEDED:
+            print(f"Invalid registration request received from {addr}.")
+            conn.close()
+            return
+        msg = helper.parse_message(data)
 
-                if 'type' not in msg or msg['type'] != const.REGISTER:
-                    print("Invalid registration request received.")
-                    conn.close()
-                    continue
+        print(f"A server is trying to register from {addr}")
 
-                # Handling new fields: node type and interests/business categories if applicable
-                node_type = msg.get("node_type", "generic")  # Default to 'generic' if not specified
-                interests = msg.get("interests", [])  # Specific for subscribers
-
-                identifier = helper.generate_identifier([node['id'] for node in self.nodes])
-                self.connections.append(conn)
-                node = {
-                    "ip": addr[0],
-                    "port": msg["port"],
-                    "id": identifier,
-                    "type": node_type,  # Store the node type
-                    "interests": interests  # Store interests if any
-                }
-                self.nodes.append(node)
-
-                print(f"Assigned ID {identifier} to the server with details: {node}")
+        if 'type' not in msg or msg['type'] != const.REGISTER:
+            print("Invalid registration request received.")
+            conn.close()
+            return
+
+        node = self.add_node(conn, addr[0], msg)
+        if node is None:
+            REGISTRATIONS.labels("refused").inc()
+            conn.close()
+            return
+        REGISTRATIONS.labels("accepted").inc()
+        print(f"Assigned ID {node['id']} to the server with details: {node}")
 
+        # Nodes do not send anything else; the connection closing means the node left.
+        decoder = helper.FrameDecoder()
+        while True:
+            try:
+                if decoder.next_frame(conn) is None:
+                    break
             except socket.timeout:
+                continue
+            except OSError:
                 break
+        self.remove_node(node["id"], conn)
 
-        self.nodes.sort(key=lambda x: x["id"])
-        if self.nodes:
-            print("Register received the following servers. Their details are:\n")
-            print(self.nodes)
-        else:
-            print("Register did not receive a server\n")
+    def allocate_identifier(self):
+        """
+        Returns the next ID down from MAX. Once those are used up, an ID released by
+        a node that left is only handed out again if it is below the IDs of all
+        running nodes, as a higher one would take the leadership over from them.
+        Called with the lock held.
 
-    def send_details(self):
+        Returns:
+            int: A free node ID, or None if there is no ID left that ranks below the
+            running nodes.
         """
-        Send the details of the registered servers to each server.
+        if self.next_id >= const.MIN:
+            self.next_id -= 1
+            return self.next_id + 1
+        lowest = self.topology.ids[0] if self.topology.ids else const.MAX + 1
+        usable = [identifier for identifier in self.released_ids if identifier < lowest]
+        if not usable:
+            return None
+        identifier = max(usable)
+        self.released_ids.remove(identifier)
+        return identifier
 
-        This method encodes the server details into a byte string and sends it to each server.
-        If a server does not acknowledge the receipt of the details within a timeout period,
-        an error message is printed.
+    def add_node(self, conn: socket.socket, ip: str, msg: dict):
         """
-        data = str(self.nodes).encode("utf-8")
-        for node in range(len(self.nodes)):
-            print("Sending the details of the servers to the servers....")
-            port = self.nodes[node]["port"]
-            try:
-                self.connections[node].send(data)
-            except socket.timeout:
-                print("Error: no ACK received from server_node on port {}".format(port))
+        Adds a node, sends it its ID and the node list, and tells the other nodes.
+        A node registering again from the same address replaces its old entry.
 
-        self.sock.close()
-        sys.exit(1)
+        Returns:
+            dict: The node's entry, or None if no ID is left.
+        """
+        with self.lock:
+            stale = []
+            previous = self.topology.find(ip, msg["port"])
+            if previous is not None:
+                stale.append(previous.id)
+                self.drop_node(previous.id)
+
+            identifier = self.allocate_identifier()
+            if identifier is None:
+                print("No node ID left below the running nodes, registration refused.")
+                return None
+            node = {
+                "ip": ip,
+                "port": msg["port"],
+                "id": identifier,
+                # Handling new fields: node type and interests/business categories if applicable
+                "type": msg.get("node_type", "generic"),
+                "interests": msg.get("interests", []),
+            }
+            self.topology.add(node)
+            reply = {"version": self.topology.version, "id": identifier, "nodes": self.topology.node_list()}
+            # Bounds how long a send to a node that stopped reading can take.
+            conn.settimeout(const.REGISTER_PUSH_TIMEOUT)
+            self.connections[identifier] = conn
+            self.outboxes[identifier] = Queue()
+            self.outboxes[identifier].put(wire_codec.encode(reply))
+            thread = Thread(target=self.write_frames, args=(identifier, conn, self.outboxes[identifier]))
+            thread.daemon = True
+            thread.start()
+            self.push_update({"joined": [node], "left": stale}, exclude=identifier)
+        print(f"Cluster version {self.topology.version}, the nodes are now: {self.topology.node_list()}")
+        return node
+
+    def remove_node(self, node_id: int, conn: socket.socket):
+        """
+        Removes a node whose registration connection closed, unless it registered
+        again on another connection in the meantime.
+        """
+        with self.lock:
+            if self.connections.get(node_id) is not conn:
+                conn.close()
+                return
+            self.drop_node(node_id)
+            DEPARTURES.inc()
+            self.push_update({"joined": [], "left": [node_id]})
+        print(f"Node {node_id} left, cluster version {self.topology.version}, the nodes are now: {self.topology.ids}")
+
+    def drop_node(self, node_id: int):
+        # Called with the lock held.
+        self.topology.remove(node_id)
+        conn = self.connections.pop(node_id, None)
+        if conn is not None:
+            conn.close()
+        outbox = self.outboxes.pop(node_id, None)
+        if outbox is not None:
+            outbox.put(None)
+        self.released_ids.append(node_id)
+
+    def push_update(self, change: dict, exclude: int = None):
+        """
+        Queues a TOPOLOGY_UPDATE for every registered node. Called with the lock
+        held, so every node receives the updates in version order; the sends happen
+        on the nodes' writer threads, so a node that stopped reading does not hold
+        up registrations or the other nodes.
+
+        Args:
+            change (dict): The nodes that joined and the IDs of those that left.
+            exclude (int): A node not to send it to.
+        """
+        update = dict(change, type=const.Type["TOPOLOGY_UPDATE"].value, version=self.topology.version)
+        payload = wire_codec.encode(update)
+        for node_id, outbox in self.outboxes.items():
+            if node_id != exclude:
+                outbox.put(payload)
+
+    def write_frames(self, node_id: int, conn: socket.socket, outbox: Queue):
+        """
+        Sends the frames queued for a node on its registration connection. A send
+        that fails or times out may have written part of a frame, so the connection
+        is shut down, which makes serve_node remove the node as if it had left. If
+        the node is still running, it refutes being dead through gossip.
+        """
+        while True:
+            payload = outbox.get()
+            if payload is None:
+                return
+            started = time.perf_counter()
+            try:
+                helper.send_frame(conn, payload)
+            except OSError as e:
+                PUSH_FAILURES.inc()
+                print(f"Topology update not sent to node {node_id}, dropping its connection: {e}")
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+            PUSH_SECONDS.observe(time.perf_counter() - started)
 
     def handler_log_msgs(self, signum: int, frame):
         """
@@ -121,4 +267,3 @@ class Register:
         )
         self.sock.close()
         sys.exit(1)
-        
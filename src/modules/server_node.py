@@ -3,8 +3,8 @@ import logging
 import sys
 
 from constants.constants import (
-    BUFF_SIZE,
     DEFAULT_ID,
+    ErrorCode,
 )
 from utils import utils as helper
 from .leader_election import BullyLeaderElection, Type
@@ -82,39 +82,40 @@ class ServerNode:
 
         # Send registration message to the registry service
         print("Connected to register service. Sending message to register service")
-        register_socket.send(msg)
+        helper.send_frame(register_socket, msg)
 
-        data = register_socket.recv(BUFF_SIZE)
+        # Kept for the topology updates, which can arrive in the same read as the reply.
+        register_decoder = helper.FrameDecoder()
+        data = register_decoder.next_frame(register_socket)
 
         print("Received data from register service")
-        if not data:
+        if not data or data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
             sock.close()
             print("No data received from register service")
             sys.exit(1)
 
-        data = eval(data.decode("utf-8"))
-        identifier = helper.find_identifier_by_port(sock.getsockname()[1], data)
+        data = helper.parse_message(data)
+        identifier = data["id"]
+        nodes = data["nodes"]
 
         print("The ID assigned to this node is : ", identifier)
-        print("The list of nodes received from register service is : ", data)
-        register_socket.close()
-
-        # Check if there are enough nodes
-        if len(data) == 1:
-            sock.close()
-            print("Not enough nodes started.")
-            sys.exit(1)
+        print("The list of nodes received from register service is : ", nodes)
+        # The registration stays open: the register pushes topology updates over
+        # it, and takes this node out of the cluster once it closes.
 
         if self.algorithm:
             BullyLeaderElection(
                 sock.getsockname()[0],
                 sock.getsockname()[1],
                 identifier,
-                data,
+                nodes,
                 sock,
                 self.verbose,
                 self.delay,
                 self.algorithm,
                 self.leader_ip,
                 self.leader_port,
+                register_socket,
+                register_decoder,
+                data["version"],
             )
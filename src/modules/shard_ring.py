@@ -0,0 +1,102 @@
+import hashlib
+from bisect import bisect
+from threading import Lock
+
+from constants.constants import SHARD_VNODES, TOPIC_MULTI_LEVEL, TOPIC_SEPARATOR, TOPIC_SINGLE_LEVEL
+
+
+class ShardRing:
+    def __init__(self, nodes=(), vnodes: int = SHARD_VNODES):
+        """
+        Consistent-hash ring that gives every business type an owner node.
+
+        Business types are sharded by their first topic level, so food/pizza and
+        food/# belong to the same shard and a wildcard below the first level is
+        served by a single node. Every node is placed on the ring at vnodes points
+        derived from its ID, and a shard is owned by the node at the first point
+        after the shard's hash. Points only depend on the node's ID, so when a node
+        joins it takes over shards from its neighbours only, and when it leaves only
+        its own shards move. Every node and every client that builds a ring from the
+        same node list agrees on the owners.
+
+        Args:
+            nodes (iterable): The node list, entries with id, ip and port.
+            vnodes (int): The number of points per node.
+        """
+        self.vnodes = vnodes
+        self.lock = Lock()
+        self.nodes = {}
+        self.points = []
+        self.owners = []
+        # Incremented whenever the owners change.
+        self.version = 0
+        self.update(nodes)
+
+    @staticmethod
+    def shard_of(topic: str) -> str:
+        return topic.split(TOPIC_SEPARATOR, 1)[0]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        # Not the built-in hash, which differs between processes.
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def update(self, nodes) -> bool:
+        """
+        Rebuilds the ring for a new node list. Does nothing if the node IDs and
+        addresses are unchanged.
+
+        Returns:
+            bool: True if the ring changed.
+        """
+        members = {node["id"]: {"id": node["id"], "ip": node["ip"], "port": node["port"]} for node in nodes}
+        with self.lock:
+            if members == self.nodes:
+                return False
+            ring = sorted(
+                (self.hash(f"{node_id}#{replica}"), node_id)
+                for node_id in members
+                for replica in range(self.vnodes)
+            )
+            self.nodes = members
+            self.points = [point for point, _ in ring]
+            self.owners = [node_id for _, node_id in ring]
+            self.version += 1
+        return True
+
+    def owner(self, topic: str):
+        """
+        Returns:
+            dict: The id, ip and port of the node that owns a business type, or None
+            if the ring is empty.
+        """
+        point = self.hash(self.shard_of(topic))
+        with self.lock:
+            if not self.points:
+                return None
+            return self.nodes[self.owners[bisect(self.points, point) % len(self.points)]]
+
+    def owners_of_interest(self, interest: str) -> list:
+        """
+        Returns:
+            list: The nodes a subscription has to be registered with: the owner of
+            its shard, or every node for a pattern with a wildcard in the first level.
+        """
+        if self.shard_of(interest) in (TOPIC_SINGLE_LEVEL, TOPIC_MULTI_LEVEL):
+            with self.lock:
+                return list(self.nodes.values())
+        owner = self.owner(interest)
+        return [owner] if owner is not None else []
+
+    def node_list(self) -> list:
+        """
+        Returns:
+            list: The nodes on the ring, sorted by ID, for clients to build the same
+            ring from.
+        """
+        with self.lock:
+            return [self.nodes[node_id] for node_id in sorted(self.nodes)]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"version": self.version, "nodes": len(self.nodes), "points": len(self.points)}
@@ -1,13 +1,14 @@
 import json
+import os
 import socket
 import sys
-from threading import Thread
+from threading import Lock, Thread
 import time
 
-from constants.constants import Type
-
-
-BUFF_SIZE = 1024
+from constants.constants import ErrorCode, Type
+from utils import codec as wire_codec
+from utils import utils as helper
+from .topic_trie import TopicTrie
 
 
 class Subscriber:
@@ -29,6 +30,28 @@ class Subscriber:
         self.ip = config["subscriber"]["ip"]
         self.port = config["subscriber"]["port"]
         self.interests = config["subscriber"].get("interests", [])
+        self.codecs = config["subscriber"].get("codecs", wire_codec.PREFERRED_CODECS)
+        # Optional {"lat", "lon", "radius"}: only offers within radius km are received.
+        self.location = config["subscriber"].get("location")
+        # Optional {"policy", "queue_size"}: what the leader does with offers for this
+        # subscriber once it has queue_size of them waiting to be sent.
+        self.delivery = config["subscriber"].get("delivery")
+        # Offers missed while offline are requested from the offer logs of the nodes
+        # that own the interests, as configured in catch_up, e.g. {"Food": {"since":
+        # 1700000000}}, or from where the subscriber stopped if offsets_file is set.
+        # Every node has a log of its own, so offsets are kept per interest and log,
+        # with the time the last offer of the interest arrived for logs that have
+        # none, e.g. of a node that took the interest's shard over.
+        self.catch_up = config["subscriber"].get("catch_up", {})
+        self.offsets_file = config["subscriber"].get("offsets_file")
+        self.offsets, self.seen = self.load_offsets()
+        self.offsets_lock = Lock()
+        # While catching up: the nodes sending a catch-up, those that are done and
+        # their logs, and per log the offsets that also arrived live.
+        self.catching_up = False
+        self.catch_up_owners = set()
+        self.caught_up = {}
+        self.live_offsets = {}
         self.verbose = verbose
 
     def start_service(self):
@@ -51,7 +74,26 @@ class Subscriber:
             "ip": self.ip,
             "port": self.port,
             "interests": self.interests,
+            "codecs": self.codecs,
         }
+        if self.location:
+            msg["location"] = self.location
+        if self.delivery:
+            msg["delivery"] = self.delivery
+        catch_up = dict(self.catch_up)
+        with self.offsets_lock:
+            for interest in self.interests:
+                if interest in self.seen:
+                    catch_up[interest] = {
+                        "offsets": dict(self.offsets.get(interest, {})),
+                        "since": self.seen[interest],
+                    }
+            if catch_up:
+                msg["catch_up"] = catch_up
+                self.catching_up = True
+                self.catch_up_owners = set()
+                self.caught_up = {}
+                self.live_offsets = {}
 
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -61,7 +103,7 @@ class Subscriber:
         try:
             server_socket.connect(address)
             print("Sending connection request to the leader")
-            server_socket.send(json.dumps(msg).encode("utf-8"))
+            helper.send_frame(server_socket, json.dumps(msg).encode("utf-8"))
             print("Connection request sent to the leader node")
         except BaseException as e:
             print("Unable to connect to Leader", e)
@@ -71,7 +113,8 @@ class Subscriber:
 
     def listen_to_port(self):
         """
-        Listens to the subscriber's own port.
+        Listens to the subscriber's own port. The leader keeps its connection open and
+        reuses it for every offer, so each connection is read on its own thread.
         """
         subscriber_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         subscriber_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -84,27 +127,142 @@ class Subscriber:
 
             while True:
                 conn, addr = subscriber_socket.accept()
-                print(f"Connection established with {addr}, waiting for data")
-                # Using a loop to handle multiple messages
-                while True:
-                    data = conn.recv(BUFF_SIZE)
-                    if not data:
-                        print("No more data received. Closing connection.")
-                        break  # Exit the inner loop if no data is received to wait for another connection.
-
-                    msg = json.loads(data.decode("utf-8"))
-                    print(f"\nData Received from the publisher: {msg}\n")
-                    # Process based on interests
-
-                    if "businessType" in msg and msg["businessType"] in self.interests:
-                        print(f"New offer from {msg['businessType']}: {msg.get('offer', 'No offer details')}")
-                    else:
-                        print("Received message does not match subscribed interests or lacks 'businessType'.")
+                thread = Thread(target=self.receive_offers, args=(conn, addr))
+                thread.daemon = True
+                thread.start()
 
         except Exception as e:
             print(f"Exception occurred: {e}")
             sys.exit(1)
         finally:
-            conn.close()
             subscriber_socket.close()
 
+    def receive_offers(self, conn: socket.socket, addr: tuple):
+        """
+        Reads offers from one connection until the sender closes it.
+        """
+        print(f"Connection established with {addr}, waiting for data")
+        decoder = helper.FrameDecoder()
+        try:
+            # Using a loop to handle multiple messages
+            while True:
+                data = decoder.next_frame(conn)
+                if data is None:
+                    print("No more data received. Closing connection.")
+                    break
+                if data is ErrorCode.MESSAGE_SIZE_EXCEEDED:
+                    print("Dropping message: size exceeds MAX_MESSAGE_SIZE")
+                    continue
+
+                msg = helper.parse_message(data)
+                if msg.get("type") == Type["CATCH_UP"].value:
+                    self.process_catch_up(msg)
+                    continue
+                print(f"\nData Received from the publisher: {msg}\n")
+                # Process based on interests
+
+                if "businessType" in msg and self.is_interested(msg["businessType"]):
+                    offers = msg["offers"] if msg.get("type") == Type["PUBLISH_BATCH"].value else [msg.get("offer", "No offer details")]
+                    for offer in offers:
+                        print(f"New offer from {msg['businessType']}: {offer}")
+                    offsets = msg.get("offsets") or ([msg["offset"]] if "offset" in msg else [])
+                    self.record_offsets(msg["businessType"], offsets, msg.get("log"), live=True)
+                else:
+                    print("Received message does not match subscribed interests or lacks 'businessType'.")
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+        finally:
+            conn.close()
+
+    def is_interested(self, business_type: str) -> bool:
+        """
+        Checks a business type against the subscriber's interests, which may be
+        wildcard patterns such as food/#.
+        """
+        return any(TopicTrie.matches(interest, business_type) for interest in self.interests)
+
+    def process_catch_up(self, msg: dict):
+        """
+        Prints offers the subscriber missed, sent by a node from its offer log. An
+        offer that also arrived live while catching up is only printed once. Every
+        node that owns some of the interests sends a catch-up of its own, and the
+        subscriber has caught up once all of them are done.
+        """
+        log = msg.get("log")
+        for entry in msg.get("offers", []):
+            offset = entry.get("offset")
+            with self.offsets_lock:
+                if offset in self.live_offsets.get(log, ()):
+                    continue
+            print(f"Missed offer from {entry.get('businessType')}: {entry.get('offer')}")
+            self.record_offsets(
+                entry.get("businessType", ""), [offset], log, live=False, seen=entry.get("timestamp")
+            )
+        if msg.get("done"):
+            with self.offsets_lock:
+                self.catch_up_owners.update(msg.get("owners") or ())
+                self.caught_up[msg.get("node")] = log
+                self.live_offsets.pop(log, None)
+                pending = self.catch_up_owners - set(self.caught_up)
+                if not pending:
+                    self.catching_up = False
+                    self.live_offsets.clear()
+            print(
+                f"Caught up with node {msg.get('node')}, receiving live offers from offset "
+                f"{msg.get('live_from')} of log {log}"
+            )
+            if pending:
+                print(f"Still catching up with nodes {sorted(pending)}")
+
+    def record_offsets(self, business_type: str, offsets: list, log: str, live: bool, seen: float = None):
+        """
+        Remembers the last offset seen in a log for each interest the business type
+        matches, and when an offer of the interest was last seen.
+        """
+        offsets = [offset for offset in offsets if offset is not None]
+        if not offsets or log is None:
+            return
+        with self.offsets_lock:
+            if live and self.catching_up and log not in self.caught_up.values():
+                self.live_offsets.setdefault(log, set()).update(offsets)
+            seen = seen or time.time()
+            for interest in self.interests:
+                if TopicTrie.matches(interest, business_type):
+                    logs = self.offsets.setdefault(interest, {})
+                    logs[log] = max(logs.get(log, -1), max(offsets))
+                    self.seen[interest] = max(self.seen.get(interest, 0), seen)
+            self.save_offsets()
+
+    def load_offsets(self) -> tuple:
+        """
+        Returns:
+            tuple: Per interest the last offset seen in every log, and when an offer
+            of the interest was last seen.
+        """
+        if not self.offsets_file or not os.path.exists(self.offsets_file):
+            return {}, {}
+        try:
+            with open(self.offsets_file, "r") as offsets_file:
+                saved = json.load(offsets_file)
+        except (OSError, ValueError) as e:
+            print(f"Could not read {self.offsets_file}: {e}")
+            return {}, {}
+        offsets = saved.get("offsets")
+        seen = saved.get("seen")
+        if not isinstance(offsets, dict) or not isinstance(seen, dict):
+            # Offsets saved without their log cannot be used.
+            print(f"Ignoring {self.offsets_file}, it does not say which logs its offsets are in")
+            return {}, {}
+        return offsets, seen
+
+    def save_offsets(self):
+        # Called with offsets_lock held.
+        if not self.offsets_file:
+            return
+        temporary = self.offsets_file + ".tmp"
+        try:
+            with open(temporary, "w") as offsets_file:
+                json.dump({"offsets": self.offsets, "seen": self.seen}, offsets_file)
+            os.replace(temporary, self.offsets_file)
+        except OSError as e:
+            print(f"Could not save offsets to {self.offsets_file}: {e}")
@@ -0,0 +1,196 @@
+from threading import Lock
+
+from constants.constants import SNAPSHOT_CACHE_SIZE
+from .topic_trie import TopicTrie
+
+
+class SubscriptionIndex:
+    def __init__(self, cache_size: int = SNAPSHOT_CACHE_SIZE):
+        """
+        Which subscribers are interested in which business types.
+
+        Every subscriber address gets a small integer handle the first time it
+        subscribes. Each business type maps to the set of handles interested in it,
+        and each handle maps back to the set of business types it is subscribed to,
+        so subscribing, unsubscribing and removing a subscriber never scan other
+        subscribers. Subscribing twice to the same business type has no effect.
+
+        Subscriptions can be topic patterns such as food/* or food/#, kept in a
+        TopicTrie. Fan-out reads the subscribers of a published business type
+        through snapshot, which resolves every matching pattern and returns an
+        immutable tuple that stays valid while the index keeps changing. Tuples are
+        cached for up to cache_size topics and dropped when a matching pattern's
+        subscribers change.
+
+        Args:
+            cache_size (int): The number of published topics to cache snapshots for.
+        """
+        self.lock = Lock()
+        self.next_handle = 0
+        self.handles = {}
+        self.addresses = {}
+        self.topics = {}
+        self.subscriptions = {}
+        self.snapshots = {}
+        self.cache_size = cache_size
+        self.trie = TopicTrie()
+
+    def subscribe(self, address: tuple, topics) -> int:
+        """
+        Subscribes a subscriber to business types, keeping its existing subscriptions.
+
+        Args:
+            address (tuple): The (ip, port) of the subscriber.
+            topics (iterable): The business types or topic patterns.
+
+        Returns:
+            int: The subscriber's handle.
+
+        Raises:
+            ValueError: If a topic pattern is invalid. Nothing is subscribed then.
+        """
+        address = (address[0], address[1])
+        topics = list(topics)
+        for topic in topics:
+            self.trie.validate(topic)
+        with self.lock:
+            handle = self.handles.get(address)
+            if handle is None:
+                handle = self.next_handle
+                self.next_handle += 1
+                self.handles[address] = handle
+                self.addresses[handle] = address
+                self.subscriptions[handle] = set()
+            subscribed = self.subscriptions[handle]
+            for topic in topics:
+                if topic in subscribed:
+                    continue
+                subscribed.add(topic)
+                members = self.topics.get(topic)
+                if members is None:
+                    members = self.topics[topic] = set()
+                    self.trie.insert(topic)
+                members.add(handle)
+                self.invalidate(topic)
+        return handle
+
+    def unsubscribe(self, address: tuple, topics=None) -> bool:
+        """
+        Unsubscribes a subscriber from business types. A subscriber left without any
+        subscription is forgotten, and so is its handle.
+
+        Args:
+            address (tuple): The (ip, port) of the subscriber.
+            topics (iterable): The business types, or None for all of them.
+
+        Returns:
+            bool: False if the subscriber was not subscribed to anything.
+        """
+        address = (address[0], address[1])
+        with self.lock:
+            handle = self.handles.get(address)
+            if handle is None:
+                return False
+            subscribed = self.subscriptions[handle]
+            for topic in list(subscribed if topics is None else topics):
+                if topic not in subscribed:
+                    continue
+                subscribed.discard(topic)
+                members = self.topics[topic]
+                members.discard(handle)
+                if not members:
+                    del self.topics[topic]
+                    self.trie.remove(topic)
+                self.invalidate(topic)
+            if not subscribed:
+                del self.handles[address]
+                del self.addresses[handle]
+                del self.subscriptions[handle]
+        return True
+
+    def invalidate(self, pattern: str):
+        # Called with the lock held.
+        if not self.trie.is_wildcard(pattern):
+            self.snapshots.pop(pattern, None)
+            return
+        for topic in [topic for topic in self.snapshots if self.trie.matches(pattern, topic)]:
+            del self.snapshots[topic]
+
+    def snapshot(self, topic) -> tuple:
+        """
+        Returns:
+            tuple: The (ip, port) addresses of the subscribers whose patterns match a
+            published business type, each listed once, as they were when the method
+            was called.
+        """
+        snapshot = self.snapshots.get(topic)
+        if snapshot is not None:
+            return snapshot
+        with self.lock:
+            snapshot = self.snapshots.get(topic)
+            if snapshot is None:
+                patterns = self.trie.match(topic)
+                if len(patterns) == 1:
+                    handles = self.topics[patterns[0]]
+                else:
+                    handles = set().union(*(self.topics[pattern] for pattern in patterns))
+                snapshot = tuple(self.addresses[handle] for handle in handles)
+                if len(self.snapshots) >= self.cache_size:
+                    # Drop the oldest cached topic.
+                    del self.snapshots[next(iter(self.snapshots))]
+                self.snapshots[topic] = snapshot
+        return snapshot
+
+    def topics_of(self, address: tuple) -> set:
+        """
+        Returns:
+            set: The business types a subscriber is subscribed to.
+        """
+        with self.lock:
+            handle = self.handles.get((address[0], address[1]))
+            return set(self.subscriptions[handle]) if handle is not None else set()
+
+    def handle_of(self, address: tuple):
+        """
+        Returns:
+            int: The subscriber's handle, or None if it is not subscribed.
+        """
+        with self.lock:
+            return self.handles.get((address[0], address[1]))
+
+    def all_subscribers(self) -> list:
+        """
+        Returns:
+            list: The (ip, port) address of every subscriber.
+        """
+        with self.lock:
+            return list(self.addresses.values())
+
+    def subscriber_count(self, topic=None) -> int:
+        """
+        Returns:
+            int: The number of subscribers to a business type or pattern, or of all
+            subscribers.
+        """
+        with self.lock:
+            if topic is None:
+                return len(self.addresses)
+            return len(self.topics.get(topic, ()))
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "subscribers": len(self.addresses),
+                "business_types": len(self.topics),
+                "subscriptions": sum(len(members) for members in self.topics.values()),
+                "cached_snapshots": len(self.snapshots),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.handles.clear()
+            self.addresses.clear()
+            self.topics.clear()
+            self.subscriptions.clear()
+            self.snapshots.clear()
+            self.trie = TopicTrie()
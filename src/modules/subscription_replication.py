@@ -0,0 +1,245 @@
+import time
+from collections import deque
+from threading import Lock
+
+from constants.constants import (
+    MAX_MESSAGE_SIZE,
+    REPLICATION_DELTA_RETAIN,
+    REPLICATION_SNAPSHOT_CHUNK,
+    REPLICATION_SYNC_RETRY,
+    Type,
+)
+from utils import codec as wire_codec
+
+
+class SubscriptionReplicator:
+    def __init__(self, own_id: int, peer_links, snapshot_source):
+        """
+        Replicates the subscriptions this node owns to every other node, and keeps
+        the replicas of the other nodes' subscriptions, so a node that takes over a
+        shard already has its subscribers.
+
+        Every subscribe and unsubscribe is sent to the other nodes as a delta with
+        the next sequence number, in order, over the peer links. The last
+        REPLICATION_DELTA_RETAIN deltas are kept. A replica that finds a gap in the
+        sequence asks for the deltas after the last one it applied; if they are no
+        longer kept, it is sent a compact snapshot of the current subscriptions
+        instead, followed by the deltas from then on. Sequence numbers belong to an epoch
+        that starts when the node does, so a restarted node's replicas start over.
+
+        Args:
+            own_id (int): The ID of this node.
+            peer_links (PeerLinkManager): The links to the other nodes.
+            snapshot_source (callable): Returns the current subscriptions as
+                (address, topics, registration) triples.
+        """
+        self.own_id = own_id
+        self.peer_links = peer_links
+        self.snapshot_source = snapshot_source
+        self.epoch = time.time_ns()
+        self.seq = 0
+        self.deltas = deque(maxlen=REPLICATION_DELTA_RETAIN)
+        # Source node ID -> its epoch, last applied seq and subscribers.
+        self.replicas = {}
+        self.lock = Lock()
+        self.stats = {"deltas_sent": 0, "deltas_applied": 0, "snapshots_sent": 0, "syncs_requested": 0}
+
+    def record(self, op: str, address: tuple, topics: list, registration: dict = None):
+        """
+        Sends a change to this node's subscriptions to the other nodes.
+
+        Args:
+            op (str): "subscribe" or "unsubscribe".
+            address (tuple): The (ip, port) of the subscriber.
+            topics (list): The business types or patterns.
+            registration (dict): The subscriber's codecs and location, for subscribe.
+        """
+        with self.lock:
+            self.seq += 1
+            msg = {
+                "type": Type["SUBSCRIPTION_DELTA"].value,
+                "id": self.own_id,
+                "epoch": self.epoch,
+                "seq": self.seq,
+                "op": op,
+                "address": list(address),
+                "topics": list(topics),
+            }
+            if registration:
+                msg["registration"] = registration
+            payload = wire_codec.EncodedMessage(msg)
+            self.deltas.append((self.seq, payload))
+            # Sent with the lock held, so deltas are queued in sequence order.
+            self.peer_links.broadcast(payload)
+            self.stats["deltas_sent"] += 1
+
+    def sync(self, node_id: int, epoch: int = None, since: int = 0):
+        """
+        Brings a replica on another node up to date: with the deltas after since if
+        they are still kept, otherwise with a snapshot.
+
+        Args:
+            node_id (int): The node the replica is on.
+            epoch (int): The epoch of the replica's last applied delta.
+            since (int): The sequence number of that delta.
+        """
+        with self.lock:
+            oldest = self.deltas[0][0] if self.deltas else self.seq + 1
+            if epoch == self.epoch and since + 1 >= oldest:
+                for seq, payload in self.deltas:
+                    if seq > since:
+                        self.peer_links.send(node_id, payload)
+                return
+            subscribers = [
+                [address[0], address[1], sorted(topics), registration]
+                for address, topics, registration in self.snapshot_source()
+            ]
+            chunks = self.snapshot_chunks(subscribers)
+            for index, chunk in enumerate(chunks):
+                msg = self.snapshot_message(chunk, index == 0, index == len(chunks) - 1)
+                self.peer_links.send(node_id, wire_codec.EncodedMessage(msg))
+            self.stats["snapshots_sent"] += 1
+        print(f"Sent a snapshot of {len(subscribers)} subscribers to node {node_id}")
+
+    def snapshot_message(self, subscribers: list, first: bool, last: bool) -> dict:
+        # Called with the lock held.
+        return {
+            "type": Type["SUBSCRIPTION_SNAPSHOT"].value,
+            "id": self.own_id,
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "first": first,
+            "last": last,
+            "subscribers": subscribers,
+        }
+
+    def snapshot_chunks(self, subscribers: list) -> list:
+        """
+        Splits a snapshot into parts of at most REPLICATION_SNAPSHOT_CHUNK
+        subscribers, halving a part until its message fits in MAX_MESSAGE_SIZE with
+        every codec, since a link could have negotiated any of them. A subscriber
+        too large to fit on its own is left out. Called with the lock held.
+
+        Returns:
+            list: The subscribers of each message, at least one, possibly empty.
+        """
+        pending = [
+            subscribers[start:start + REPLICATION_SNAPSHOT_CHUNK]
+            for start in range(0, len(subscribers), REPLICATION_SNAPSHOT_CHUNK)
+        ]
+        pending.reverse()
+        chunks = []
+        while pending:
+            chunk = pending.pop()
+            # "false" is the longer flag, so a part that fits with both false fits
+            # in any position.
+            msg = self.snapshot_message(chunk, False, False)
+            size = max(len(codec.encode(msg)) for codec in wire_codec.CODECS.values())
+            if size <= MAX_MESSAGE_SIZE:
+                chunks.append(chunk)
+            elif len(chunk) > 1:
+                half = len(chunk) // 2
+                pending.extend([chunk[half:], chunk[:half]])
+            else:
+                print(f"Subscriber {chunk[0][0]}:{chunk[0][1]} is too large for a snapshot, leaving it out")
+        return chunks or [[]]
+
+    def apply(self, msg: dict):
+        """
+        Applies a delta or a snapshot part from another node to its replica. Asks
+        the node for what is missing if a delta does not follow the last one.
+        """
+        request = None
+        with self.lock:
+            source = msg["id"]
+            replica = self.replicas.get(source)
+            if replica is None or replica["epoch"] != msg["epoch"]:
+                replica = self.replicas[source] = {
+                    "epoch": msg["epoch"],
+                    "seq": 0,
+                    "subscribers": {},
+                    "loading": None,
+                    "sync_requested": None,
+                }
+
+            if msg["type"] == Type["SUBSCRIPTION_SNAPSHOT"].value:
+                if msg["first"]:
+                    replica["loading"] = {}
+                loading = replica["loading"]
+                if loading is None:
+                    return
+                for ip, port, topics, registration in msg["subscribers"]:
+                    loading[(ip, port)] = [set(topics), registration]
+                if msg["last"]:
+                    replica["subscribers"] = loading
+                    replica["seq"] = msg["seq"]
+                    replica["loading"] = None
+                    replica["sync_requested"] = None
+                return
+
+            if msg["seq"] <= replica["seq"]:
+                return
+            if msg["seq"] != replica["seq"] + 1:
+                requested = replica["sync_requested"]
+                if replica["loading"] is not None:
+                    return
+                if requested is None or time.monotonic() - requested > REPLICATION_SYNC_RETRY:
+                    replica["sync_requested"] = time.monotonic()
+                    request = (source, replica["epoch"], replica["seq"])
+                    self.stats["syncs_requested"] += 1
+            else:
+                self.apply_delta(replica["subscribers"], msg)
+                replica["seq"] = msg["seq"]
+                replica["sync_requested"] = None
+                self.stats["deltas_applied"] += 1
+
+        if request is not None:
+            source, epoch, since = request
+            print(f"Replica of node {source} is behind, asking for the changes after {since}")
+            msg = {"type": Type["SUBSCRIPTION_SYNC"].value, "id": self.own_id, "epoch": epoch, "since": since}
+            self.peer_links.send(source, wire_codec.EncodedMessage(msg))
+
+    @staticmethod
+    def apply_delta(subscribers: dict, msg: dict):
+        # Called with the lock held.
+        address = tuple(msg["address"])
+        if msg["op"] == "subscribe":
+            entry = subscribers.setdefault(address, [set(), {}])
+            entry[0].update(msg["topics"])
+            if msg.get("registration"):
+                entry[1] = msg["registration"]
+            return
+        entry = subscribers.get(address)
+        if entry is None:
+            return
+        entry[0].difference_update(msg["topics"])
+        if not entry[0]:
+            del subscribers[address]
+
+    def take_over(self, source: int) -> dict:
+        """
+        Removes the replica of a node that left the cluster.
+
+        Returns:
+            dict: (ip, port) -> (topics, registration) of the node's subscribers.
+        """
+        with self.lock:
+            replica = self.replicas.pop(source, None)
+        if replica is None:
+            return {}
+        return {address: (topics, registration) for address, (topics, registration) in replica["subscribers"].items()}
+
+    def replicated_nodes(self) -> list:
+        with self.lock:
+            return list(self.replicas)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["seq"] = self.seq
+            stats["retained_deltas"] = len(self.deltas)
+            stats["replicas"] = {
+                source: {"seq": replica["seq"], "subscribers": len(replica["subscribers"])}
+                for source, replica in self.replicas.items()
+            }
+            return stats
@@ -0,0 +1,114 @@
+from constants.constants import TOPIC_MULTI_LEVEL, TOPIC_SEPARATOR, TOPIC_SINGLE_LEVEL
+
+
+class TopicNode:
+    def __init__(self):
+        self.children = {}
+        self.pattern = None
+
+
+class TopicTrie:
+    def __init__(self):
+        """
+        Subscription patterns stored level by level, for finding every pattern that
+        matches a published topic.
+
+        Topics are business types split on "/", e.g. food/pizza/downtown. In a
+        pattern, "*" matches exactly one level and "#", which must be the last level,
+        matches any number of remaining levels including none, so food/# matches
+        food, food/pizza and food/pizza/downtown. A business type without "/" is a
+        one-level topic and only matches itself or a wildcard.
+
+        Matching visits at most the exact, "*" and "#" child of each node on the
+        way down, so it takes time proportional to the depth of the topic rather
+        than to the number of patterns.
+        """
+        self.root = TopicNode()
+
+    @staticmethod
+    def validate(pattern: str):
+        """
+        Raises:
+            ValueError: If the pattern is empty or "#" is not its last level.
+        """
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError(f"Invalid topic pattern: {pattern!r}")
+        levels = pattern.split(TOPIC_SEPARATOR)
+        if TOPIC_MULTI_LEVEL in levels[:-1]:
+            raise ValueError(f"'{TOPIC_MULTI_LEVEL}' must be the last level of {pattern!r}")
+
+    @staticmethod
+    def is_wildcard(pattern: str) -> bool:
+        levels = pattern.split(TOPIC_SEPARATOR)
+        return TOPIC_SINGLE_LEVEL in levels or TOPIC_MULTI_LEVEL in levels
+
+    @staticmethod
+    def matches(pattern: str, topic: str) -> bool:
+        """
+        Returns:
+            bool: Whether a single pattern matches a topic.
+        """
+        pattern_levels = pattern.split(TOPIC_SEPARATOR)
+        topic_levels = topic.split(TOPIC_SEPARATOR)
+        for depth, level in enumerate(pattern_levels):
+            if level == TOPIC_MULTI_LEVEL:
+                return True
+            if depth >= len(topic_levels):
+                return False
+            if level != TOPIC_SINGLE_LEVEL and level != topic_levels[depth]:
+                return False
+        return len(pattern_levels) == len(topic_levels)
+
+    def insert(self, pattern: str):
+        self.validate(pattern)
+        node = self.root
+        for level in pattern.split(TOPIC_SEPARATOR):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = TopicNode()
+            node = child
+        node.pattern = pattern
+
+    def remove(self, pattern: str):
+        """
+        Removes a pattern and any nodes left without patterns below them.
+        """
+        path = [self.root]
+        levels = pattern.split(TOPIC_SEPARATOR)
+        for level in levels:
+            child = path[-1].children.get(level)
+            if child is None:
+                return
+            path.append(child)
+        path[-1].pattern = None
+        for depth in range(len(levels), 0, -1):
+            node = path[depth]
+            if node.pattern is not None or node.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+
+    def match(self, topic: str) -> list:
+        """
+        Returns:
+            list: Every stored pattern that matches the topic.
+        """
+        levels = topic.split(TOPIC_SEPARATOR)
+        matched = []
+        pending = [(self.root, 0)]
+        while pending:
+            node, depth = pending.pop()
+            multi = node.children.get(TOPIC_MULTI_LEVEL)
+            if multi is not None and multi.pattern is not None:
+                matched.append(multi.pattern)
+            if depth == len(levels):
+                if node.pattern is not None:
+                    matched.append(node.pattern)
+                continue
+            child = node.children.get(levels[depth])
+            if child is not None:
+                pending.append((child, depth + 1))
+            if levels[depth] != TOPIC_SINGLE_LEVEL:
+                single = node.children.get(TOPIC_SINGLE_LEVEL)
+                if single is not None:
+                    pending.append((single, depth + 1))
+        return matched
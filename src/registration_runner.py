@@ -2,6 +2,7 @@ import argparse
 import os
 import pyfiglet
 from modules import registration
+from modules.metrics import MetricsServer
 
 
 def run_registration():
@@ -24,6 +25,13 @@ def run_registration():
         required=True,
         help="Requires JSON config file",
     )
+    parser.add_argument(
+        "-m",
+        "--metrics_port",
+        type=int,
+        action="store",
+        help="Serves the metrics in the Prometheus text format on this local port",
+    )
 
     args = parser.parse_args()
 
@@ -32,9 +40,11 @@ def run_registration():
     print(intro)
     print("The register node assigns IDs to the servers\n")
 
+    if args.metrics_port is not None:
+        MetricsServer(args.metrics_port).start()
+
     register = registration.Register(args.verbose, args.config_file)
     register.receive_connection_request()
-    register.send_details()
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import argparse
 import pyfiglet
 import os
 
+from modules.metrics import MetricsServer
 from modules.server_node import ServerNode
 
 
@@ -30,6 +31,13 @@ def run_server_node():
         action="store",
         help="Requires a JSON config file",
     )
+    algorithm_options.add_argument(
+        "-m",
+        "--metrics_port",
+        type=int,
+        action="store",
+        help="Serves the metrics in the Prometheus text format on this local port",
+    )
 
     args = algorithm_options.parse_args()
 
@@ -41,6 +49,9 @@ def run_server_node():
     print(intro)
     print("This is a server_node")
 
+    if args.metrics_port is not None:
+        MetricsServer(args.metrics_port).start()
+
     node = ServerNode(args.verbose, True, args.config_file, args.delay)
     node.start_server()
 
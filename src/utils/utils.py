@@ -1,16 +1,22 @@
-import json
 import logging
 import socket
+import struct
 import time
+from collections import deque
 from math import floor
 from random import randint
 
 from constants import constants as const
+from utils import codec as wire_codec
 
 BUFF_SIZE = const.BUFF_SIZE
+MAX_MESSAGE_SIZE = const.MAX_MESSAGE_SIZE
 Type = const.Type
 ErrorCode = const.ErrorCode
 
+# Every message on the wire is a 4 byte big-endian payload length followed by the payload.
+FRAME_HEADER = struct.Struct("!I")
+
 
 def initialize_socket(node_ip: str) -> socket:
     """
@@ -28,26 +34,7 @@ def initialize_socket(node_ip: str) -> socket:
     return sock
 
 
-def find_index_by_identifier(id: int, nodes: list) -> int:
-    """
-    Finds the index of a server_node in a list by its ID.
-
-    Args:
-        id (int): The ID of the server_node to find.
-        nodes (list): The list of nodes.
-
-    Returns:
-        int: The index of the server_node in the list, or 0 if the server_node is not found.
-    """
-    i = 0
-    for j in nodes:
-        if j.get("id") == id:
-            return i
-        i += 1
-    return 0
-
-
-def create_server_message(id: int, type: int, data: dict) -> bytes:
+def create_server_message(id: int, type: int, data: dict, codec: str = None) -> bytes:
     """
     Creates a server message.
 
@@ -55,19 +42,18 @@ def create_server_message(id: int, type: int, data: dict) -> bytes:
         id (int): The ID of the server.
         type (int): The type of the message.
         data (dict): The data to include in the message.
+        codec (str): The wire codec to encode with. Defaults to DEFAULT_CODEC.
 
     Returns:
         bytes: The created message as bytes.
     """
     data["type"] = type
     data["id"] = id
-    msg = json.dumps(data)
-    msg = str(msg).encode("utf-8")
-    return msg
+    return wire_codec.encode(data, codec)
 
 
 def build_message(
-    node_id: int, type_of_msg: Type, port_details: int, ip_value: str
+    node_id: int, type_of_msg: Type, port_details: int, ip_value: str, codec: str = None
 ) -> bytes:
     """
     Builds a message.
@@ -77,31 +63,13 @@ def build_message(
         type_of_msg (int): The type of the message.
         port_details (int): The port details to include in the message.
         ip_value (str): The IP value to include in the message.
+        codec (str): The wire codec to encode with. Defaults to DEFAULT_CODEC.
 
     Returns:
         bytes: The built message as bytes.
     """
     msg = {"type": type_of_msg, "id": node_id, "port": port_details, "ip": ip_value}
-    msg = json.dumps(msg)
-    msg = str(msg).encode("utf-8")
-    return msg
-
-
-def find_identifier_by_port(port_value: int, li: list) -> int:
-    """
-    Finds the ID of a server_node in a list by its port value.
-
-    Args:
-        port_value (int): The port value of the server_node to find.
-        li (list): The list of nodes.
-
-    Returns:
-        int: The ID of the server_node, or 0 if the server_node is not found.
-    """
-    for i in li:
-        if i.get("port") == port_value:
-            return i.get("id")
-    return 0
+    return wire_codec.encode(msg, codec)
 
 
 def delay(is_needed: bool, upper_limit: int):
@@ -117,32 +85,164 @@ def delay(is_needed: bool, upper_limit: int):
         time.sleep(time_delay)
 
 
-def generate_identifier(list: list):
-    identifier = randint(const.MIN, const.MAX)
-    if identifier not in list:
-        return identifier
-    else:
-        return generate_identifier(list)
-    
 def parse_message(data: bytes) -> dict:
     """
-    Parses a byte string into a dictionary, safely handling JSON decoding.
+    Decodes a message with whichever wire codec it was encoded with. Never
+    evaluates the payload.
+
+    Returns:
+        dict: The message, or an empty dict if it cannot be decoded.
     """
     try:
-        return json.loads(data.decode("utf-8"))
-    except json.JSONDecodeError:
-        logging.error("Failed to decode message.")
+        return wire_codec.decode(data)
+    except wire_codec.CodecError as e:
+        logging.error(f"Failed to decode message: {e}")
         return {}
-    
-def parse_message(data: bytes) -> dict:
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """
+    Prefixes a payload with its length so it can be sent as a single frame.
+
+    Args:
+        payload (bytes): The encoded message.
+
+    Returns:
+        bytes: The length header followed by the payload.
+    """
+    if len(payload) > MAX_MESSAGE_SIZE:
+        raise ValueError(
+            f"Message of {len(payload)} bytes exceeds MAX_MESSAGE_SIZE ({MAX_MESSAGE_SIZE})"
+        )
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Streaming decoder for length-prefixed frames.
+
+    Bytes read from a socket are fed in as they arrive. The decoder keeps partial
+    frames between reads and can return several frames from a single read. A frame
+    whose header announces more than max_size bytes is reported as
+    ErrorCode.MESSAGE_SIZE_EXCEEDED as soon as the header is seen, and its payload is
+    then skipped without being buffered.
+    """
+
+    def __init__(self, max_size: int = MAX_MESSAGE_SIZE):
+        self.max_size = max_size
+        self.buffer = bytearray()
+        self.frames = deque()
+        self.discard = 0
+
+    def feed(self, data: bytes) -> list:
+        """
+        Adds received bytes to the decoder.
+
+        Args:
+            data (bytes): The bytes read from the socket.
+
+        Returns:
+            list: The complete frames (bytes) or ErrorCode.MESSAGE_SIZE_EXCEEDED
+            entries decoded so far, in arrival order.
+        """
+        view = memoryview(data)
+        if self.discard:
+            skipped = min(self.discard, len(view))
+            self.discard -= skipped
+            view = view[skipped:]
+        self.buffer += view
+
+        frames = []
+        while True:
+            if self.discard:
+                skipped = min(self.discard, len(self.buffer))
+                del self.buffer[:skipped]
+                self.discard -= skipped
+                if self.discard:
+                    break
+            if len(self.buffer) < FRAME_HEADER.size:
+                break
+            (length,) = FRAME_HEADER.unpack_from(self.buffer)
+            if length > self.max_size:
+                del self.buffer[: FRAME_HEADER.size]
+                self.discard = length
+                frames.append(ErrorCode.MESSAGE_SIZE_EXCEEDED)
+                continue
+            end = FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[FRAME_HEADER.size : end]))
+            del self.buffer[:end]
+        return frames
+
+    def next_frame(self, sock: socket.socket):
+        """
+        Blocks until the next frame has been read from the socket.
+
+        Args:
+            sock (socket): The socket to read from.
+
+        Returns:
+            bytes | ErrorCode | None: The frame payload, ErrorCode.MESSAGE_SIZE_EXCEEDED
+            for an oversized frame, or None once the peer has closed the connection.
+        """
+        while not self.frames:
+            data = sock.recv(BUFF_SIZE)
+            if not data:
+                return None
+            self.frames.extend(self.feed(data))
+        return self.frames.popleft()
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    """
+    Sends a payload as one length-prefixed frame.
+
+    Args:
+        sock (socket): The connected socket.
+        payload (bytes): The encoded message.
     """
-    Parses a byte string into a dictionary, safely handling JSON decoding.
+    sock.sendall(encode_frame(payload))
+
+
+def recv_frame(sock: socket.socket, decoder: FrameDecoder = None):
+    """
+    Receives one length-prefixed frame from a socket.
+
+    Callers that keep a connection open for several messages must pass the same
+    decoder on every call, since one read can carry more than one frame.
+
+    Args:
+        sock (socket): The connected socket.
+        decoder (FrameDecoder): The decoder holding the connection's buffered bytes.
+
+    Returns:
+        bytes | ErrorCode | None: See FrameDecoder.next_frame.
+    """
+    if decoder is None:
+        decoder = FrameDecoder()
+    return decoder.next_frame(sock)
+
+
+def is_socket_closed(sock: socket.socket) -> bool:
+    """
+    Checks whether the peer has closed or reset a connection that it never writes to.
+
+    Args:
+        sock (socket): A connection on which only this side sends data.
+
+    Returns:
+        bool: True if the connection can no longer be used.
     """
     try:
-        return json.loads(data.decode("utf-8"))
-    except json.JSONDecodeError:
-        logging.error("Failed to decode message.")
-        return {}
+        # A socket with a timeout waits for readability before recv, so switch it
+        # to non-blocking for the probe. Callers set their timeout again.
+        sock.settimeout(0)
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
 
 
 def configure_logging() -> logging: